@@ -18,11 +18,21 @@ PUBLIC_ROUTE_NAMES = {
     "productos:catalogo",
     # listado filtrado por categoría (ajusta al nombre real si es distinto)
     "productos:catalogo_por_categoria",
+    # autocompletado del buscador
+    "productos:sugerencias",
     # detalle de producto
     "productos:producto_detalle",
     # si tienes vista de preview o detalle legacy, déjalas también públicas
     "productos:producto_preview",
+    "productos:producto_preview_estado",
     "productos:producto_detalle_legacy",
+    # API de catálogo (solo lectura)
+    "productos:api_productos",
+    "productos:api_producto",
+    "productos:api_precios",
+    "productos:sitemap",
+    "productos:sitemap_parte",
+    "productos:feed_productos",
 
     # --- Carrito ---
     "carrito:carrito_ver",
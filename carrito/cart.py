@@ -145,6 +145,31 @@ class Cart:
 
         self.save()
 
+    def repreciar(self) -> int:
+        """
+        Recalcula el precio unitario de todas las líneas con los datos
+        actuales (producto, variante y personalización guardadas en meta), en
+        un número fijo de consultas. Las líneas cuyo producto ya no está a la
+        venta se dejan como están (stock_errors/normalize_to_stock se ocupan).
+        Devuelve cuántas líneas han cambiado de precio.
+        """
+        from productos import precios
+
+        filas = list(self.cart.items())
+        lineas = []
+        for pid, raw in filas:
+            meta = _to_dict(raw.get("meta"))
+            lineas.append((pid, meta.get("variante_id"), meta.get("personalizacion")))
+
+        cambiadas = 0
+        for (pid, raw), nuevo in zip(filas, precios.precios(lineas)):
+            if nuevo is not None and str(nuevo) != str(raw.get("price")):
+                raw["price"] = str(nuevo)
+                cambiadas += 1
+        if cambiadas:
+            self.save()
+        return cambiadas
+
     # --- NUEVO ---
     def stock_errors(self):
         """
@@ -7,6 +7,8 @@ from django.shortcuts import get_object_or_404, redirect, render
 from django.views.decorators.http import require_POST, require_http_methods
 
 from carrito.cart import Cart
+from productos import recomendaciones, subidas, tarjetas
+from productos.forms import PersonalizacionForm
 from productos.models import Producto, Variante  # <-- AÑADIMOS Variante
 
 
@@ -23,7 +25,15 @@ def _to_int_safe(v, default=1, min_val=0):
 @require_http_methods(["GET"])
 def carrito_ver(request):
     cart = Cart(request)
-    return render(request, "carrito/ver.html", {"cart": cart, "stock_errores": cart.stock_errors()})
+    # Precios al día (variantes, recargos) antes de enseñar el total
+    cart.repreciar()
+    # "Otros clientes también compraron": precalculado, una consulta
+    recomendados = tarjetas.renderizar(recomendaciones.para_carrito(cart.cart.keys()))
+    return render(request, "carrito/ver.html", {
+        "cart": cart,
+        "stock_errores": cart.stock_errors(),
+        "recomendados": recomendados,
+    })
 
 
 @require_POST
@@ -112,6 +122,14 @@ def carrito_add(request, product_id: int):
                     # preview_url la rellenará el endpoint de preview, si lo usas
                 }
 
+        # Imagen subida con el formulario: se guarda (deduplicada) y la
+        # personalización apunta a ella por hash, que es lo que busca
+        # limpiar_subidas para no borrarla
+        if product.permite_personalizacion and request.FILES.get("imagen"):
+            form = PersonalizacionForm(request.POST, request.FILES)
+            if form.is_valid() and form.cleaned_data.get("imagen"):
+                pers = {**pers, "subida": subidas.guardar(form.cleaned_data["imagen"]).hash}
+
         if pers:
             meta["personalizacion"] = pers
 
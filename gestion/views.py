@@ -3,6 +3,7 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.core.exceptions import FieldError
 from django.shortcuts import get_object_or_404, redirect, render
 
+from productos import bases, cache_busqueda
 from productos.models import Producto
 from pedidos.models import Pedido
 from .forms import ProductoForm
@@ -46,6 +47,9 @@ def dashboard(request):
         "pedidos_total": pedidos_total,
         "pedidos_pendientes": pedidos_pendientes,
         "pedidos_ultimos": pedidos_ultimos,
+        # LRU de imágenes base de este proceso (para dimensionar MOCKUP_BASES_MAX_BYTES)
+        "mockup_bases": bases.estadisticas(),
+        "cache_busqueda": cache_busqueda.estadisticas(),
     }
     return render(request, "gestion/dashboard.html", ctx)
 
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-18 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pedidos', '0007_pedido_estado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='actualizado',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
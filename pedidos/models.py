@@ -38,6 +38,8 @@ class Pedido(models.Model):
     ciudad = models.CharField(max_length=120)
     cp = models.CharField(max_length=12)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Último cambio: el recálculo de "más vendidos" solo mira lo que ha cambiado
+    actualizado = models.DateTimeField(auto_now=True, db_index=True)
 
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     pago_estado = models.CharField(max_length=20, default="pendiente")
@@ -63,6 +65,9 @@ class Pedido(models.Model):
     def save(self, *args, **kwargs):
         if not self.tracking_token:
             self.tracking_token = get_random_string(32)
+        # También con save(update_fields=[...]) (cambios de estado, pagos)
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "actualizado"}
         super().save(*args, **kwargs)
 
     def __str__(self) -> str:
@@ -88,6 +88,9 @@ def _pedidoitem_kwargs_base(
     }
     if _model_has_field(PedidoItem, "meta"):
         data["meta"] = meta
+    if meta.get("personalizacion") and _model_has_field(PedidoItem, "personalizacion"):
+        # Con el hash de la imagen subida, si la hay: limpiar_subidas no la borra
+        data["personalizacion"] = meta["personalizacion"]
     return data
 
 
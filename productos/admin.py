@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Categoria, Marca, Producto, Variante
+from .models import Categoria, Marca, Producto, ReglaPrecio, Variante
 
 @admin.register(Categoria)
 class CategoriaAdmin(admin.ModelAdmin):
@@ -23,3 +23,10 @@ class ProductoAdmin(admin.ModelAdmin):
     list_filter = ('categoria', 'marca', 'activo', 'destacado')
     search_fields = ('nombre',)
     prepopulated_fields = {"slug": ("nombre",)}
+
+
+@admin.register(ReglaPrecio)
+class ReglaPrecioAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'valores', 'importe', 'solo_personalizables', 'activa')
+    list_filter = ('concepto', 'activa')
+    raw_id_fields = ('producto',)
@@ -0,0 +1,217 @@
+"""
+API JSON de solo lectura del catálogo (v1), para la app y los partners.
+
+Mismos datos y filtros que el catálogo HTML (``q``, ``categoria``, ``marca``,
+``talla``, ``color``, ``precio_min``/``precio_max`` y el cursor de
+paginación), con la misma consulta (listado.py). El ETag del listado sale de
+las filas de la página pedida, que se cargan una sola vez: el
+``actualizado`` más reciente, y de cada fila el id, el stock (el checkout lo
+cambia sin tocar ``actualizado``) y la categoría y marca; si coincide con
+``If-None-Match`` se contesta 304 sin serializar. El ETag lleva
+también el ``?orden=`` y las versiones de lo que no está en Producto: las
+reglas de precio si se pide el precio y la popularidad con ``orden=vendidos``.
+
+``?fields=id,nombre,precio`` limita los campos devueltos. ``truncado`` indica
+que la búsqueda por texto ha llegado a ``BUSQUEDA_MAX_RESULTADOS`` y no
+están todos los resultados.
+"""
+import hashlib
+import json
+
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from . import imagenes, listado, paginacion, popularidad, precios as precios_lote, variantes
+from .models import Producto
+
+VERSION = "v1"
+
+# Líneas máximas por petición de precios
+MAX_LINEAS_PRECIOS = 200
+
+CAMPOS = (
+    "id", "nombre", "slug", "descripcion", "precio", "categoria", "marca",
+    "imagen", "stock", "agotado", "tallas", "colores", "personalizable",
+    "url", "actualizado",
+)
+# La ficha añade las variantes (precio por variante incluido)
+CAMPOS_DETALLE = CAMPOS + ("variantes",)
+
+
+class CampoDesconocido(ValueError):
+    pass
+
+
+def _campos(request, permitidos) -> tuple:
+    pedidos = [c.strip() for c in request.GET.get("fields", "").split(",") if c.strip()]
+    if not pedidos:
+        return permitidos
+    desconocidos = [c for c in pedidos if c not in permitidos]
+    if desconocidos:
+        raise CampoDesconocido(", ".join(desconocidos))
+    return tuple(c for c in permitidos if c in pedidos)
+
+
+def _etag(*partes) -> str:
+    return hashlib.sha1("|".join(str(p) for p in partes).encode("utf-8")).hexdigest()
+
+
+def _version_precios(campos) -> int:
+    """Versión de las reglas si la respuesta lleva precios; 0 si no."""
+    return precios_lote.version() if {"precio", "variantes"} & set(campos) else 0
+
+
+def _relacion(obj):
+    return {"slug": obj.slug, "nombre": obj.nombre} if obj else None
+
+
+def serializar(request, producto, campos) -> dict:
+    valores = {
+        "id": lambda: producto.pk,
+        "nombre": lambda: producto.nombre,
+        "slug": lambda: producto.slug,
+        "descripcion": lambda: producto.descripcion,
+        "precio": lambda: str(producto.calcular_precio()),
+        "categoria": lambda: _relacion(producto.categoria),
+        "marca": lambda: _relacion(producto.marca),
+        "imagen": lambda: {
+            uso: request.build_absolute_uri(imagenes.url(producto, uso))
+            for uso in imagenes.TAMANOS
+        } if producto.imagen else None,
+        "stock": lambda: producto.stock_disponible,
+        "agotado": lambda: producto.agotado,
+        "tallas": lambda: producto.resumen_variantes.get("tallas", []),
+        "colores": lambda: producto.resumen_variantes.get("colores", []),
+        "personalizable": lambda: producto.permite_personalizacion,
+        "url": lambda: request.build_absolute_uri(producto.get_absolute_url()),
+        "actualizado": lambda: producto.actualizado.isoformat(),
+        "variantes": lambda: [
+            {**v, "precio": str(v["precio"])} for v in variantes.matriz(producto)["variantes"]
+        ],
+    }
+    return {c: valores[c]() for c in campos}
+
+
+# ------------------------------------------------------------------
+#  Listado
+# ------------------------------------------------------------------
+
+def _pagina_lista(request):
+    """Se calcula una vez por petición: la usan el ETag y la vista."""
+    if not hasattr(request, "_api_pagina"):
+        filtros = listado.leer_filtros(request)
+        buscados, ids_relevancia = listado.buscar(filtros["q"])
+        productos = listado.filtrar(listado.filtrar_atributos(buscados, filtros), filtros)
+        request._api_pagina = (filtros, listado.paginar(request, productos, filtros, ids_relevancia))
+    return request._api_pagina
+
+
+def _etag_lista(request):
+    try:
+        campos = _campos(request, CAMPOS)
+    except CampoDesconocido:
+        return None
+    filtros, pagina = _pagina_lista(request)
+    items = pagina["items"]
+    ultimo = max((p.actualizado for p in items), default=None)
+    filas = [(p.pk, p.stock, p.stock_variantes, _relacion(p.categoria), _relacion(p.marca)) for p in items]
+    pedido = request.GET.get("orden", "").strip()
+    orden = paginacion.orden(pedido)[0] if pedido else ""
+    return _etag(
+        VERSION, ultimo and ultimo.isoformat(), filas,
+        bool(pagina["siguiente"]), bool(pagina["anterior"]), pagina["truncado"],
+        paginacion.firma_filtros(filtros), orden, request.GET.get("cursor", ""), ",".join(campos),
+        _version_precios(campos), popularidad.version() if orden == "vendidos" else 0,
+    )
+
+
+@require_GET
+@condition(etag_func=_etag_lista)
+def productos(request):
+    try:
+        campos = _campos(request, CAMPOS)
+    except CampoDesconocido as e:
+        return JsonResponse({"error": f"Campos desconocidos: {e}"}, status=400)
+
+    _, pagina = _pagina_lista(request)
+
+    def enlace(token):
+        return request.build_absolute_uri(paginacion.url_pagina(request, token)) if token else None
+
+    return JsonResponse({
+        "resultados": [serializar(request, p, campos) for p in pagina["items"]],
+        "siguiente": enlace(pagina["siguiente"]),
+        "anterior": enlace(pagina["anterior"]),
+        # La búsqueda por texto llegó a BUSQUEDA_MAX_RESULTADOS: faltan resultados
+        "truncado": pagina["truncado"],
+    })
+
+
+# ------------------------------------------------------------------
+#  Ficha
+# ------------------------------------------------------------------
+
+def _etag_producto(request, slug):
+    try:
+        campos = _campos(request, CAMPOS_DETALLE)
+    except CampoDesconocido:
+        return None
+    fila = (
+        Producto.objects.filter(slug=slug, activo=True)
+        .values_list("pk", "actualizado", "stock", "stock_variantes")
+        .first()
+    )
+    if fila is None:
+        return None
+    pk, actualizado, stock, stock_variantes = fila
+    return _etag(
+        VERSION, pk, actualizado.isoformat(), stock, stock_variantes, ",".join(campos),
+        _version_precios(campos),
+    )
+
+
+@require_GET
+@condition(etag_func=_etag_producto)
+def producto(request, slug):
+    try:
+        campos = _campos(request, CAMPOS_DETALLE)
+    except CampoDesconocido as e:
+        return JsonResponse({"error": f"Campos desconocidos: {e}"}, status=400)
+
+    obj = get_object_or_404(
+        Producto.objects.select_related("categoria", "marca"), slug=slug, activo=True
+    )
+    return JsonResponse(serializar(request, obj, campos))
+
+
+# ------------------------------------------------------------------
+#  Precios en lote (presupuestos, apps)
+# ------------------------------------------------------------------
+
+@csrf_exempt  # solo calcula, no guarda nada
+@require_POST
+def precios(request):
+    """
+    Cuerpo JSON: {"lineas": [{"producto": id, "variante": id?, "personalizacion": {...}?}, ...]}
+    Respuesta: {"moneda": "€", "precios": ["12.00", null, ...]} en el mismo orden
+    (null si el producto no está a la venta o la variante no es suya).
+    """
+    try:
+        lineas = json.loads(request.body or b"{}").get("lineas")
+    except (ValueError, AttributeError):
+        lineas = None
+    if not isinstance(lineas, list) or not all(isinstance(l, dict) for l in lineas):
+        return JsonResponse({"error": "Se esperaba {\"lineas\": [...]}"}, status=400)
+    if len(lineas) > MAX_LINEAS_PRECIOS:
+        return JsonResponse({"error": f"Máximo {MAX_LINEAS_PRECIOS} líneas"}, status=400)
+
+    resultado = precios_lote.precios(
+        (l.get("producto"), l.get("variante"), l.get("personalizacion")) for l in lineas
+    )
+    return JsonResponse({
+        "moneda": getattr(settings, "MONEDA", "€"),
+        "precios": [str(p) if p is not None else None for p in resultado],
+    })
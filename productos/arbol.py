@@ -0,0 +1,96 @@
+"""
+Mantenimiento incremental de la tabla de cierre de categorías (CategoriaCierre).
+
+- Alta de una categoría: su fila propia + una por cada ancestro del padre.
+- Cambio de padre: se cortan los enlaces entre los ancestros antiguos y el
+  subárbol movido, y se crean los de los nuevos ancestros. Solo se toca el
+  subárbol afectado, nunca se reconstruye el árbol entero.
+- Baja: sus hijas pasan a ser raíces (Categoria.padre es SET_NULL), así que se
+  desenganchan sus subárboles antes de borrar.
+"""
+from django.db import transaction
+
+from .models import Categoria, CategoriaCierre
+
+
+def es_descendiente(categoria_id, ancestro_id) -> bool:
+    """True si `categoria_id` está en el subárbol de `ancestro_id` (incluida ella misma)."""
+    return CategoriaCierre.objects.filter(
+        ancestro_id=ancestro_id, descendiente_id=categoria_id
+    ).exists()
+
+
+def subarbol_ids(categoria_id) -> list:
+    return list(
+        CategoriaCierre.objects.filter(ancestro_id=categoria_id).values_list(
+            "descendiente_id", flat=True
+        )
+    )
+
+
+def subarbol_ids_slug(slug) -> list:
+    return list(
+        CategoriaCierre.objects.filter(ancestro__slug=slug).values_list(
+            "descendiente_id", flat=True
+        )
+    )
+
+
+@transaction.atomic
+def insertar(categoria) -> None:
+    filas = [CategoriaCierre(ancestro_id=categoria.pk, descendiente_id=categoria.pk, profundidad=0)]
+    if categoria.padre_id:
+        filas += [
+            CategoriaCierre(ancestro_id=a, descendiente_id=categoria.pk, profundidad=p + 1)
+            for a, p in CategoriaCierre.objects.filter(
+                descendiente_id=categoria.padre_id
+            ).values_list("ancestro_id", "profundidad")
+        ]
+    CategoriaCierre.objects.bulk_create(filas, ignore_conflicts=True)
+
+
+@transaction.atomic
+def mover(categoria_id, nuevo_padre_id) -> None:
+    subarbol = list(
+        CategoriaCierre.objects.filter(ancestro_id=categoria_id).values_list(
+            "descendiente_id", "profundidad"
+        )
+    )
+    ids = [d for d, _ in subarbol]
+    if nuevo_padre_id in ids:
+        raise ValueError("Una categoría no puede colgar de sí misma ni de sus hijas.")
+
+    # Fuera los enlaces con los ancestros de antes (los internos se quedan)
+    CategoriaCierre.objects.filter(descendiente_id__in=ids).exclude(ancestro_id__in=ids).delete()
+
+    if nuevo_padre_id:
+        ancestros = CategoriaCierre.objects.filter(
+            descendiente_id=nuevo_padre_id
+        ).values_list("ancestro_id", "profundidad")
+        CategoriaCierre.objects.bulk_create([
+            CategoriaCierre(ancestro_id=a, descendiente_id=d, profundidad=pa + pd + 1)
+            for a, pa in ancestros
+            for d, pd in subarbol
+        ])
+
+
+@transaction.atomic
+def soltar_hijas(categoria_id) -> None:
+    """Antes de borrar una categoría: sus hijas se quedan como raíces."""
+    for hija_id in Categoria.objects.filter(padre_id=categoria_id).values_list("pk", flat=True):
+        mover(hija_id, None)
+
+
+def reconstruir() -> None:
+    """Rehace la tabla entera (solo para migraciones o reparaciones)."""
+    with transaction.atomic():
+        CategoriaCierre.objects.all().delete()
+        padres = dict(Categoria.objects.values_list("pk", "padre_id"))
+        filas = []
+        for cid in padres:
+            actual, profundidad, vistos = cid, 0, set()
+            while actual is not None and actual not in vistos:
+                vistos.add(actual)
+                filas.append(CategoriaCierre(ancestro_id=actual, descendiente_id=cid, profundidad=profundidad))
+                actual, profundidad = padres.get(actual), profundidad + 1
+        CategoriaCierre.objects.bulk_create(filas, batch_size=1000)
@@ -0,0 +1,105 @@
+"""
+Caché en memoria (por proceso) de las imágenes base ya decodificadas a RGBA.
+
+Decodificar un PNG de 2-3 MB es lo más caro de cada vista previa; con esta
+LRU solo se paga la primera vez por imagen. La clave es (ruta, mtime), así
+que si alguien sustituye el fichero se vuelve a leer sin tener que invalidar
+nada a mano.
+
+El límite es de memoria (ancho × alto × 4 bytes por imagen), no de entradas:
+``MOCKUP_BASES_MAX_BYTES`` en settings. ``obtener`` devuelve siempre una
+copia, porque quien la pide dibuja encima.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from PIL import Image
+
+
+def max_bytes() -> int:
+    return int(getattr(settings, "MOCKUP_BASES_MAX_BYTES", 256 * 1024 * 1024))
+
+
+class CacheBases:
+    def __init__(self, limite_bytes=None):
+        self._limite = limite_bytes
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # (ruta, mtime) -> Image RGBA
+        self._bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+
+    @property
+    def limite(self) -> int:
+        return self._limite if self._limite is not None else max_bytes()
+
+    @staticmethod
+    def _tamano(img) -> int:
+        return img.width * img.height * 4
+
+    def obtener(self, ruta):
+        ruta = os.fspath(ruta)
+        clave = (ruta, os.stat(ruta).st_mtime_ns)
+        with self._lock:
+            img = self._entradas.get(clave)
+            if img is not None:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return img.copy()
+            self.fallos += 1
+
+        # Decodificamos fuera del lock: dos hilos pueden leer la misma imagen
+        # a la vez la primera vez, pero nadie espera por la decodificación de otro.
+        with Image.open(ruta) as original:
+            img = original.convert("RGBA")
+        tamano = self._tamano(img)
+        if tamano > self.limite:
+            return img  # no cabe: se usa sin cachear
+
+        with self._lock:
+            if clave not in self._entradas:
+                self._entradas[clave] = img
+                self._bytes += tamano
+                # Versiones antiguas del mismo fichero ya no se van a pedir
+                for vieja in [c for c in self._entradas if c[0] == ruta and c != clave]:
+                    self._bytes -= self._tamano(self._entradas.pop(vieja))
+                while self._bytes > self.limite:
+                    _, fuera = self._entradas.popitem(last=False)
+                    self._bytes -= self._tamano(fuera)
+        return img.copy()
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ratio": self.aciertos / total if total else 0.0,
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "limite_bytes": self.limite,
+            }
+
+    def vaciar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+            self.aciertos = self.fallos = 0
+
+
+_cache = CacheBases()
+
+
+def obtener(ruta):
+    """Imagen base en RGBA (copia propia, se puede modificar)."""
+    return _cache.obtener(ruta)
+
+
+def estadisticas() -> dict:
+    return _cache.estadisticas()
+
+
+def vaciar() -> None:
+    _cache.vaciar()
@@ -0,0 +1,164 @@
+"""
+Búsqueda de texto completo sobre el catálogo.
+
+- SQLite: tabla virtual FTS5 ``productos_producto_fts`` (rowid = Producto.id)
+  que mantienen sincronizada las señales de Producto (ver signals.py).
+- PostgreSQL: índice GIN parcial sobre ``to_tsvector`` de nombre + descripción.
+  Lo mantiene la propia base de datos, así que indexar/desindexar no hacen nada.
+- Cualquier otro motor: ``buscar_ids`` devuelve None y la vista vuelve al
+  ``icontains`` de siempre.
+
+Solo se indexan productos activos: es lo único que enseña el catálogo.
+
+``version()`` avanza solo cuando cambia lo que está en el índice (nombre,
+descripción o activo, vía indexar/desindexar/reindexar_todo): con ella se
+cachean los resultados sin filtrar (ver cache_busqueda.py), que así no
+caducan con cada venta como las listas que dependen del stock.
+"""
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+FTS_TABLA = "productos_producto_fts"
+PG_CONFIG = "spanish"
+
+# El nombre pesa más que la descripción al ordenar por relevancia.
+PESO_NOMBRE = 10.0
+PESO_DESCRIPCION = 1.0
+
+# Misma expresión que el índice GIN de la migración 0005: si cambia aquí,
+# Postgres deja de usar el índice.
+PG_VECTOR = (
+    "(setweight(to_tsvector('spanish', coalesce(nombre, '')), 'A') || "
+    "setweight(to_tsvector('spanish', coalesce(descripcion, '')), 'B'))"
+)
+
+CLAVE_VERSION = "busqueda:version"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_fts_disponible = None
+
+
+def _avanzar() -> None:
+    cache.set(CLAVE_VERSION, time.time_ns(), None)
+
+
+def invalidar() -> None:
+    # Como catalogo.invalidar: ya y otra vez al confirmar la transacción
+    _avanzar()
+    transaction.on_commit(_avanzar)
+
+
+def version() -> int:
+    valor = cache.get(CLAVE_VERSION)
+    if valor is None:
+        cache.add(CLAVE_VERSION, time.time_ns(), None)
+        valor = cache.get(CLAVE_VERSION)
+    return valor
+
+
+def max_resultados() -> int:
+    """Tope de ids por búsqueda; si se llega, el catálogo avisa (ver listado.paginar)."""
+    return int(getattr(settings, "BUSQUEDA_MAX_RESULTADOS", 10_000))
+
+
+def tokens(q: str) -> list:
+    """Palabras de la búsqueda, sin signos (que FTS5/tsquery interpretarían)."""
+    return _TOKEN_RE.findall((q or "").lower())
+
+
+def _sqlite_fts_disponible() -> bool:
+    global _fts_disponible
+    if _fts_disponible is None:
+        _fts_disponible = FTS_TABLA in connection.introspection.table_names()
+    return _fts_disponible
+
+
+def disponible() -> bool:
+    if connection.vendor == "postgresql":
+        return True
+    if connection.vendor == "sqlite":
+        return _sqlite_fts_disponible()
+    return False
+
+
+def buscar_ids(q: str, limite=None):
+    """
+    Devuelve los ids de productos activos que casan con `q`, ordenados por
+    relevancia (los mejores primero). Cada palabra funciona como prefijo
+    ("gorr" encuentra "gorra") y todas deben aparecer.
+
+    Devuelve None si no hay índice de texto para este motor.
+    """
+    if not disponible():
+        return None
+    palabras = tokens(q)
+    if not palabras:
+        return []
+    limite = limite or max_resultados()
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            match = " ".join(f'"{p}"*' for p in palabras)
+            cursor.execute(
+                f"SELECT rowid FROM {FTS_TABLA} WHERE {FTS_TABLA} MATCH %s "
+                f"ORDER BY bm25({FTS_TABLA}, %s, %s) LIMIT %s",
+                [match, PESO_NOMBRE, PESO_DESCRIPCION, limite],
+            )
+        else:
+            consulta = " & ".join(f"{p}:*" for p in palabras)
+            cursor.execute(
+                f"SELECT id FROM productos_producto "
+                f"WHERE activo AND {PG_VECTOR} @@ to_tsquery(%s, %s) "
+                f"ORDER BY ts_rank({PG_VECTOR}, to_tsquery(%s, %s)) DESC, id DESC "
+                f"LIMIT %s",
+                [PG_CONFIG, consulta, PG_CONFIG, consulta, limite],
+            )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def indexar(producto_ids) -> None:
+    """(Re)indexa los productos indicados. Los inactivos salen del índice."""
+    ids = [int(i) for i in producto_ids]
+    if not ids:
+        return
+    invalidar()  # también en PostgreSQL, donde el índice se mantiene solo
+    if connection.vendor != "sqlite" or not _sqlite_fts_disponible():
+        return
+    marcas = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLA} WHERE rowid IN ({marcas})", ids)
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLA} (rowid, nombre, descripcion) "
+            f"SELECT id, nombre, descripcion FROM productos_producto "
+            f"WHERE activo AND id IN ({marcas})",
+            ids,
+        )
+
+
+def desindexar(producto_ids) -> None:
+    ids = [int(i) for i in producto_ids]
+    if not ids:
+        return
+    invalidar()  # también en PostgreSQL, donde el índice se mantiene solo
+    if connection.vendor != "sqlite" or not _sqlite_fts_disponible():
+        return
+    marcas = ", ".join(["%s"] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLA} WHERE rowid IN ({marcas})", ids)
+
+
+def reindexar_todo() -> None:
+    """Reconstruye el índice entero (tras cargas masivas que no lanzan señales)."""
+    invalidar()
+    if connection.vendor != "sqlite" or not _sqlite_fts_disponible():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLA}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLA} (rowid, nombre, descripcion) "
+            f"SELECT id, nombre, descripcion FROM productos_producto WHERE activo"
+        )
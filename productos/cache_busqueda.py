@@ -0,0 +1,139 @@
+"""
+Caché en memoria (por proceso) de los resultados de búsqueda del catálogo.
+
+Unos pocos términos se llevan casi todo el tráfico de ``?q=``. Para cada
+búsqueda normalizada (``normalizar_q``) y cada combinación de filtros se guarda solo la lista de ids
+ya ordenada por relevancia; con ella, una página es un ``in_bulk`` por clave
+primaria.
+
+Es una LRU de ``BUSQUEDA_CACHE_ENTRADAS`` entradas que caducan a los
+``BUSQUEDA_CACHE_TTL`` segundos o en cuanto cambia su versión, lo primero que
+pase. La lista que sale del índice de texto (``ids_texto``) va con la versión
+del índice (ver busqueda.py), que solo cambia con nombre, descripción o
+activo; las ya filtradas (``ids``: precio, talla/color con stock...), con la
+del catálogo (ver catalogo.py).
+
+La búsqueda normalizada es solo la clave: al índice le llega siempre el texto
+original.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import connection
+
+from . import busqueda, catalogo
+from .paginacion import firma_filtros
+from .sugerencias import normalizar
+
+
+def max_entradas() -> int:
+    return int(getattr(settings, "BUSQUEDA_CACHE_ENTRADAS", 500))
+
+
+def ttl() -> int:
+    return int(getattr(settings, "BUSQUEDA_CACHE_TTL", 60 * 5))
+
+
+class CacheBusquedas:
+    def __init__(self, limite=None):
+        self._limite = limite
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # clave -> (version, caduca, ids)
+        self.aciertos = 0
+        self.fallos = 0
+
+    @property
+    def limite(self) -> int:
+        return self._limite if self._limite is not None else max_entradas()
+
+    def obtener(self, clave, version):
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == version and entrada[1] > ahora:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[2]
+            if entrada is not None:
+                del self._entradas[clave]
+            self.fallos += 1
+        return None
+
+    def guardar(self, clave, version, ids) -> None:
+        with self._lock:
+            self._entradas[clave] = (version, time.monotonic() + ttl(), ids)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.limite:
+                self._entradas.popitem(last=False)
+
+    def estadisticas(self) -> dict:
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "ratio": self.aciertos / total if total else 0.0,
+                "entradas": len(self._entradas),
+                "limite": self.limite,
+            }
+
+    def vaciar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+            self.aciertos = self.fallos = 0
+
+
+_cache = CacheBusquedas()
+
+
+def normalizar_q(q: str) -> str:
+    """
+    Minúsculas y espacios colapsados. En SQLite también sin tildes, como el
+    autocompletado: la tabla FTS5 las pliega (``remove_diacritics 2``) y
+    "camion" da lo mismo que "camión". La configuración 'spanish' de Postgres
+    no, así que allí son dos búsquedas distintas.
+    """
+    if connection.vendor == "sqlite":
+        return normalizar(q)
+    return " ".join((q or "").lower().split())
+
+
+def clave(filtros: dict) -> tuple:
+    """La búsqueda normalizada y la firma del resto de filtros."""
+    q = normalizar_q(filtros.get("q", ""))
+    return q, firma_filtros({**filtros, "q": q})
+
+
+def _obtener(k, version, calcular, q) -> tuple:
+    resultado = _cache.obtener(k, version)
+    if resultado is None:
+        resultado = tuple(calcular(q))
+        _cache.guardar(k, version, resultado)
+    return resultado
+
+
+def ids(filtros: dict, calcular) -> tuple:
+    """
+    Lista de ids cacheada para `filtros`; si no está (o ya no vale), la
+    calcula ``calcular(q_normalizada)`` y se guarda.
+    """
+    k = clave(filtros)
+    return _obtener(k, catalogo.version(), calcular, k[0])
+
+
+def ids_texto(q: str, calcular) -> tuple:
+    """
+    Como ``ids`` para la búsqueda sola, tal cual sale del índice de texto:
+    ``calcular`` recibe `q` sin normalizar.
+    """
+    return _obtener(("texto", normalizar_q(q)), busqueda.version(), calcular, q)
+
+
+def estadisticas() -> dict:
+    return _cache.estadisticas()
+
+
+def vaciar() -> None:
+    _cache.vaciar()
@@ -0,0 +1,36 @@
+"""
+Versión del catálogo.
+
+Un número en la caché compartida que avanza con cualquier cambio de
+productos, variantes, categorías o marcas (señales y cargas masivas, ver
+signals.py, stock.py, importacion.py y fix_slugs). Los cambios de solo stock
+cuentan únicamente si algo se agota o se repone. Lo usan los ficheros y
+cachés que dependen del catálogo entero (sitemap, feed de productos) para
+saber si siguen valiendo sin tener que recorrer la tabla.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+CLAVE_VERSION = "catalogo:version"
+
+
+def _avanzar() -> None:
+    cache.set(CLAVE_VERSION, time.time_ns(), None)
+
+
+def invalidar() -> None:
+    # Ahora (este proceso ve sus propios cambios) y otra vez al confirmar la
+    # transacción: si otro proceso regenera entre medias con los datos de
+    # antes, no se queda con la versión buena.
+    _avanzar()
+    transaction.on_commit(_avanzar)
+
+
+def version() -> int:
+    valor = cache.get(CLAVE_VERSION)
+    if valor is None:
+        cache.add(CLAVE_VERSION, time.time_ns(), None)
+        valor = cache.get(CLAVE_VERSION)
+    return valor
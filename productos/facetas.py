@@ -0,0 +1,127 @@
+"""
+Recuentos por categoría y marca para los filtros del catálogo.
+
+Todo sale de UNA consulta agrupada por (categoría, marca) sobre los productos
+que casan con la búsqueda. A partir de esas filas se calculan en Python:
+
+- categorías: cuántos productos hay en cada una (con sus subcategorías)
+  con la marca seleccionada
+- marcas: cuántos hay de cada una en la categoría seleccionada
+
+(cada faceta ignora su propio filtro, para poder cambiar de opción sin
+quitar antes la actual). El resultado se cachea unos segundos por firma de
+filtros, así que navegar mucho por el catálogo no multiplica la carga.
+
+Las opciones de talla y color (``opciones_variantes``) son las de todas las
+variantes con stock, sin recuentos, y se cachean unos minutos.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+
+from .paginacion import firma_filtros
+
+PREFIJO_CACHE = "catalogo:facetas"
+CLAVE_OPCIONES = "catalogo:opciones_variantes"
+
+# Orden de tallas conocido; las demás van detrás por orden alfabético
+ORDEN_TALLAS = ("XXS", "XS", "S", "M", "L", "XL", "XXL", "XXXL")
+
+
+def ttl() -> int:
+    return int(getattr(settings, "CATALOGO_FACETAS_TTL", 60))
+
+
+def _sumar(totales: dict, slug, nombre, n: int) -> None:
+    if not slug:
+        return
+    fila = totales.setdefault(slug, {"slug": slug, "nombre": nombre, "total": 0})
+    fila["total"] += n
+
+
+def _calcular(productos, categoria_sel: str, marca_sel: str) -> dict:
+    # El join con la tabla de cierre repite cada producto una vez por cada
+    # categoría ancestro, así que una categoría cuenta también lo de sus hijas.
+    # La fila de profundidad 0 es la categoría propia del producto.
+    filas = (
+        productos.order_by()
+        .values(
+            "categoria__cierre_ancestros__ancestro__slug",
+            "categoria__cierre_ancestros__ancestro__nombre",
+            "categoria__cierre_ancestros__profundidad",
+            "marca__slug",
+            "marca__nombre",
+        )
+        .annotate(total=Count("id"))
+    )
+    categorias, marcas = {}, {}
+    for f in filas:
+        cat_slug = f["categoria__cierre_ancestros__ancestro__slug"]
+        cat_nombre = f["categoria__cierre_ancestros__ancestro__nombre"]
+        propia = f["categoria__cierre_ancestros__profundidad"] == 0
+
+        # La opción seleccionada se mantiene en la lista aunque quede a 0
+        if not marca_sel or f["marca__slug"] == marca_sel or cat_slug == categoria_sel:
+            n = f["total"] if not marca_sel or f["marca__slug"] == marca_sel else 0
+            _sumar(categorias, cat_slug, cat_nombre, n)
+
+        # Para las marcas, cada producto se cuenta una sola vez: en la fila de
+        # la categoría seleccionada o, sin selección, en la de su categoría propia
+        fila_unica = cat_slug == categoria_sel if categoria_sel else propia
+        if fila_unica or (propia and f["marca__slug"] == marca_sel):
+            n = f["total"] if fila_unica else 0
+            _sumar(marcas, f["marca__slug"], f["marca__nombre"], n)
+
+    return {
+        "categorias": sorted(categorias.values(), key=lambda c: c["nombre"]),
+        "marcas": sorted(marcas.values(), key=lambda m: m["nombre"]),
+    }
+
+
+def facetas(productos, filtros: dict) -> dict:
+    """
+    `productos` es el queryset YA filtrado por búsqueda pero SIN los filtros
+    de categoría/marca (esos se aplican aquí sobre las filas agrupadas).
+    """
+    clave = f"{PREFIJO_CACHE}:{firma_filtros(filtros)}"
+    datos = cache.get(clave)
+    if datos is None:
+        datos = _calcular(productos, filtros.get("categoria", ""), filtros.get("marca", ""))
+        cache.set(clave, datos, ttl())
+    return datos
+
+
+def _orden_talla(talla: str):
+    t = talla.upper()
+    return (0, ORDEN_TALLAS.index(t), "") if t in ORDEN_TALLAS else (1, 0, t)
+
+
+def ttl_opciones() -> int:
+    return int(getattr(settings, "CATALOGO_OPCIONES_TTL", 60 * 10))
+
+
+def opciones_variantes() -> dict:
+    """
+    {"tallas": [...], "colores": [...]} con stock en algún producto activo.
+    Sale de Producto.resumen_variantes (ver stock.py): el listado no toca
+    la tabla Variante.
+    """
+    datos = cache.get(CLAVE_OPCIONES)
+    if datos is None:
+        from .models import Producto
+
+        tallas, colores = set(), set()
+        resumenes = (
+            Producto.objects.filter(activo=True, stock_variantes__gt=0)
+            .order_by()
+            .values_list("resumen_variantes", flat=True)
+        )
+        for resumen in resumenes.iterator(chunk_size=2000):
+            tallas.update((resumen or {}).get("tallas", ()))
+            colores.update((resumen or {}).get("colores", ()))
+        datos = {
+            "tallas": sorted(tallas, key=_orden_talla),
+            "colores": sorted(colores, key=str.lower),
+        }
+        cache.set(CLAVE_OPCIONES, datos, ttl_opciones())
+    return datos
@@ -0,0 +1,120 @@
+"""
+Histograma de precios del catálogo (filtro ``precio_min``/``precio_max``).
+
+La tabla HistogramaPrecio guarda, por (categoría propia, marca, tramo),
+cuántos productos activos hay. Pintar el histograma de una categoría es
+sumar unas pocas filas de esa tabla (con las de sus subcategorías, vía la
+tabla de cierre), nunca agregar Producto.precio.
+
+Se mantiene de forma incremental: al guardar o borrar un producto se resta
+uno en su tramo anterior y se suma uno en el nuevo (ver signals.py). Las
+cargas masivas y los cambios de ``CATALOGO_TRAMOS_PRECIO`` se arreglan con
+``reconstruir()`` (comando ``reconstruir_histograma_precios``).
+"""
+from bisect import bisect_right
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from . import arbol
+from .models import HistogramaPrecio, Producto
+
+# Límite inferior de cada tramo (el último no tiene techo), salvo que se
+# cambien con CATALOGO_TRAMOS_PRECIO.
+TRAMOS = (0, 10, 20, 30, 40, 50, 75, 100, 150, 200)
+
+
+def limites() -> tuple:
+    return tuple(Decimal(str(x)) for x in getattr(settings, "CATALOGO_TRAMOS_PRECIO", TRAMOS))
+
+
+def tramo(precio) -> int:
+    return max(0, bisect_right(limites(), Decimal(precio)) - 1)
+
+
+def clave(producto):
+    """(categoria_id, marca_id, tramo) de un producto activo; None si no cuenta."""
+    if not producto.activo or producto.precio is None:
+        return None
+    return (producto.categoria_id, producto.marca_id, tramo(producto.precio))
+
+
+# ------------------------------------------------------------------
+#  Mantenimiento
+# ------------------------------------------------------------------
+
+def _sumar(clave_fila, delta: int) -> None:
+    categoria_id, marca_id, n = clave_fila
+    filas = HistogramaPrecio.objects.filter(categoria_id=categoria_id, marca_id=marca_id, tramo=n)
+    if filas.update(productos=F("productos") + delta) or delta <= 0:
+        return
+    try:
+        # En un savepoint: si otro proceso crea la fila a la vez, salta la
+        # restricción única y se suma en la suya
+        with transaction.atomic():
+            HistogramaPrecio.objects.create(
+                categoria_id=categoria_id, marca_id=marca_id, tramo=n, productos=delta
+            )
+    except IntegrityError:
+        filas.update(productos=F("productos") + delta)
+
+
+@transaction.atomic
+def mover(antes, despues) -> None:
+    """Pasa un producto de la clave `antes` a `despues` (cualquiera puede ser None)."""
+    if antes == despues:
+        return
+    if antes is not None:
+        _sumar(antes, -1)
+    if despues is not None:
+        _sumar(despues, 1)
+
+
+@transaction.atomic
+def reconstruir() -> int:
+    """Rehace la tabla entera con una consulta agrupada. Devuelve las filas."""
+    cuenta = Counter()
+    filas = (
+        Producto.objects.filter(activo=True)
+        .order_by()
+        .values_list("categoria_id", "marca_id", "precio")
+        .iterator(chunk_size=5000)
+    )
+    for categoria_id, marca_id, precio in filas:
+        cuenta[(categoria_id, marca_id, tramo(precio))] += 1
+    HistogramaPrecio.objects.all().delete()
+    HistogramaPrecio.objects.bulk_create(
+        [HistogramaPrecio(categoria_id=c, marca_id=m, tramo=t, productos=n) for (c, m, t), n in cuenta.items()],
+        batch_size=1000,
+    )
+    return len(cuenta)
+
+
+# ------------------------------------------------------------------
+#  Lectura
+# ------------------------------------------------------------------
+
+def histograma(filtros: dict) -> list:
+    """
+    [{"desde", "hasta", "total"}] de cada tramo para la categoría (con sus
+    subcategorías) y marca de `filtros`. "hasta" es None en el último.
+    """
+    filas = HistogramaPrecio.objects.all()
+    if filtros.get("categoria"):
+        filas = filas.filter(categoria_id__in=arbol.subarbol_ids_slug(filtros["categoria"]))
+    if filtros.get("marca"):
+        filas = filas.filter(marca__slug=filtros["marca"])
+    totales = dict(filas.order_by().values_list("tramo").annotate(total=Sum("productos")))
+
+    bordes = limites()
+    return [
+        {
+            "desde": desde,
+            "hasta": bordes[i + 1] if i + 1 < len(bordes) else None,
+            "total": max(0, totales.get(i) or 0),
+        }
+        for i, desde in enumerate(bordes)
+    ]
@@ -0,0 +1,140 @@
+"""
+Derivados responsive de Producto.imagen.
+
+Al subir (o cambiar) la imagen se generan versiones redimensionadas en WebP y
+JPEG para cada uso (tarjeta, ficha, zoom). Se guardan bajo una ruta que lleva
+el hash del contenido original, de modo que:
+
+- solo se regeneran si cambia el contenido (mismo fichero → mismo hash → nada)
+- las URLs son inmutables y se pueden cachear en el navegador para siempre
+
+``Producto.imagen_hash`` guarda el hash de la imagen con derivados generados;
+vacío significa "sin derivados" (sin imagen o no se pudo procesar) y las
+plantillas usan la imagen original. ``Producto.imagen_anchos`` guarda el
+ancho real de cada derivado (nunca se amplía: con un original de 600px la
+"ficha" y el "zoom" miden 600), que es lo que anuncia el srcset.
+
+El hash solo se recalcula cuando cambia el campo imagen (ver signals.py): un
+save() que no la toca no vuelve a leer el original.
+"""
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+# uso -> ancho máximo en píxeles
+TAMANOS = {
+    "tarjeta": 400,
+    "ficha": 800,
+    "zoom": 1600,
+}
+FORMATOS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "jpeg": {"format": "JPEG", "quality": 82, "optimize": True, "progressive": True},
+}
+CARPETA = "productos/derivados"
+
+
+def hash_fichero(fieldfile) -> str:
+    h = hashlib.sha256()
+    fieldfile.open("rb")
+    try:
+        for trozo in fieldfile.chunks():
+            h.update(trozo)
+    finally:
+        fieldfile.close()
+    return h.hexdigest()
+
+
+def hash_ruta(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for trozo in iter(lambda: f.read(64 * 1024), b""):
+            h.update(trozo)
+    return h.hexdigest()
+
+
+def ruta(hash_imagen: str, uso: str, formato: str) -> str:
+    ext = "jpg" if formato == "jpeg" else formato
+    return f"{CARPETA}/{hash_imagen[:2]}/{hash_imagen}/{uso}-{TAMANOS[uso]}.{ext}"
+
+
+def _codificar(img, formato: str) -> bytes:
+    if formato == "jpeg" and img.mode != "RGB":
+        # JPEG no tiene transparencia: aplanamos sobre blanco
+        fondo = Image.new("RGB", img.size, (255, 255, 255))
+        rgba = img.convert("RGBA")
+        fondo.paste(rgba, mask=rgba.getchannel("A"))
+        img = fondo
+    buf = BytesIO()
+    img.save(buf, **FORMATOS[formato])
+    return buf.getvalue()
+
+
+def generar(fieldfile, hash_imagen: str) -> dict:
+    """Escribe los derivados que falten y devuelve el ancho de cada uno."""
+    fieldfile.open("rb")
+    try:
+        original = Image.open(fieldfile)
+        original.load()
+    finally:
+        fieldfile.close()
+
+    anchos = {}
+    for uso, ancho in TAMANOS.items():
+        img = original.copy()
+        # thumbnail nunca amplía: si el original es pequeño se queda igual
+        img.thumbnail((ancho, ancho * 4), Image.LANCZOS)
+        anchos[uso] = img.width
+        for formato in FORMATOS:
+            destino = ruta(hash_imagen, uso, formato)
+            if not default_storage.exists(destino):
+                default_storage.save(destino, ContentFile(_codificar(img, formato)))
+    return anchos
+
+
+def actualizar(producto) -> None:
+    """Genera los derivados si el contenido de la imagen ha cambiado."""
+    from .models import Producto
+
+    nuevo, anchos = "", {}
+    if producto.imagen:
+        nuevo = hash_fichero(producto.imagen)
+        if nuevo == producto.imagen_hash and producto.imagen_anchos:
+            return
+        try:
+            anchos = generar(producto.imagen, nuevo)
+        except (UnidentifiedImageError, OSError, ValueError):
+            nuevo = ""  # no es una imagen que Pillow sepa leer: se sirve la original
+
+    if (nuevo, anchos) != (producto.imagen_hash, producto.imagen_anchos):
+        producto.imagen_hash, producto.imagen_anchos = nuevo, anchos
+        Producto.objects.filter(pk=producto.pk).update(
+            imagen_hash=nuevo, imagen_anchos=anchos, actualizado=timezone.now()
+        )
+
+
+def srcset(producto, formato: str = "webp") -> str:
+    """
+    Valor para el atributo srcset con el ancho real de cada derivado. Los que
+    miden lo mismo (original pequeño) salen una sola vez, el más ligero.
+    """
+    if not producto.imagen_hash:
+        return ""
+    anchos = producto.imagen_anchos or TAMANOS  # derivados de antes de guardar los anchos
+    partes, vistos = [], set()
+    for uso in TAMANOS:
+        ancho = anchos.get(uso, TAMANOS[uso])
+        if ancho not in vistos:
+            vistos.add(ancho)
+            partes.append(f"{default_storage.url(ruta(producto.imagen_hash, uso, formato))} {ancho}w")
+    return ", ".join(partes)
+
+
+def url(producto, uso: str, formato: str = "jpeg") -> str:
+    if not producto.imagen_hash:
+        return producto.imagen.url if producto.imagen else ""
+    return default_storage.url(ruta(producto.imagen_hash, uso, formato))
@@ -0,0 +1,387 @@
+"""
+Carga masiva del catálogo desde CSV o JSONL (comando ``import_catalogo``).
+
+El fichero se lee en streaming y se procesa por lotes de ``tam_lote``
+productos, cada uno en su transacción:
+
+- categorías y marcas se resuelven con diccionarios en memoria cargados al
+  empezar, por nombre (sin distinguir mayúsculas) y, si no, por slug: el
+  slug de una existente no tiene por qué ser el de su nombre. Las que no
+  existen se crean una vez, con save(), para que se den de alta en el árbol
+  y en el autocompletado;
+- los productos se identifican por slug (el de la fila o el del nombre): los
+  que ya existen van en un ``bulk_update`` y los nuevos en un ``bulk_create``;
+- las variantes, por (producto, talla, color), igual.
+
+``bulk_create``/``bulk_update`` no lanzan señales, así que al final de cada
+lote se hace a mano lo que harían: índice de búsqueda, resumen de stock de
+las variantes y filas de Popularidad (el histograma de precios, una vez al
+final). Solo se guarda en memoria el lote en curso, así que el consumo no
+depende del tamaño del fichero.
+
+Formato (columnas CSV o claves JSON): slug, nombre, descripcion, precio,
+stock, activo, destacado, permite_personalizacion,
+precio_personalizacion_{nombre,color,textura}, categoria y marca (por
+nombre). Variantes: en JSONL una lista ``variantes`` de objetos con talla,
+color, stock y extra_precio; en CSV una fila por variante con las columnas
+talla, color, stock_variante y extra_precio (las filas seguidas del mismo
+producto se juntan). Una celda vacía deja el valor que hubiera.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import busqueda, catalogo, histograma, stock, sugerencias
+from .models import Categoria, Marca, Popularidad, Producto, Variante
+
+TAM_LOTE = 1000
+
+
+class FilaInvalida(ValueError):
+    pass
+
+
+def _decimal(valor):
+    try:
+        return Decimal(str(valor).replace(",", "."))
+    except InvalidOperation:
+        raise FilaInvalida(f"número no válido: {valor!r}")
+
+
+def _importe(max_digitos):
+    """Conversor de un importe que cabe en DecimalField(max_digitos, 2)."""
+    tope = Decimal(10) ** (max_digitos - 2)
+
+    def convertir(valor):
+        numero = _decimal(valor)
+        # NaN e Infinity pasan por Decimal() pero no caben en la columna
+        if not numero.is_finite() or numero < 0 or numero >= tope:
+            raise FilaInvalida(f"importe fuera de rango: {valor!r}")
+        if numero.as_tuple().exponent < -2:
+            raise FilaInvalida(f"importe con más de 2 decimales: {valor!r}")
+        return numero
+    return convertir
+
+
+def _entero(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise FilaInvalida(f"entero no válido: {valor!r}")
+
+
+def _stock(valor):
+    numero = _entero(valor)
+    if numero < 0:
+        raise FilaInvalida(f"stock negativo: {valor!r}")
+    return numero
+
+
+def _texto(max_longitud):
+    """Conversor de un texto que cabe en CharField(max_length=max_longitud)."""
+    def convertir(valor):
+        texto = str(valor).strip()
+        if len(texto) > max_longitud:
+            raise FilaInvalida(f"texto de más de {max_longitud} caracteres: {texto[:30]!r}…")
+        return texto
+    return convertir
+
+
+def _booleano(valor):
+    if isinstance(valor, bool):
+        return valor
+    return str(valor).strip().lower() in ("1", "true", "si", "sí", "s", "yes", "y")
+
+
+CAMPOS = {
+    "nombre": _texto(160),
+    "descripcion": str,
+    "precio": _importe(10),
+    "stock": _stock,
+    "activo": _booleano,
+    "destacado": _booleano,
+    "permite_personalizacion": _booleano,
+    "precio_personalizacion_nombre": _importe(8),
+    "precio_personalizacion_color": _importe(8),
+    "precio_personalizacion_textura": _importe(8),
+}
+_extra_precio = _importe(8)
+_talla = _texto(10)
+_color = _texto(30)
+_nombre_relacion = _texto(120)  # Categoria.nombre y Marca.nombre
+MAX_SLUG = 180
+
+# Errores que se guardan con su fila; del resto solo se cuentan
+MAX_ERRORES = 1000
+# Los que hacen falta para dar de alta un producto nuevo
+OBLIGATORIOS = ("nombre", "precio", "categoria")
+
+
+# ------------------------------------------------------------------
+#  Lectura
+# ------------------------------------------------------------------
+
+def _filas_csv(fichero):
+    for fila in csv.DictReader(fichero):
+        datos = {k.strip(): v for k, v in fila.items() if k and v not in (None, "")}
+        if "talla" in datos or "color" in datos:
+            datos["variantes"] = [{
+                "talla": datos.pop("talla", ""),
+                "color": datos.pop("color", ""),
+                "stock": datos.pop("stock_variante", 0),
+                "extra_precio": datos.pop("extra_precio", 0),
+            }]
+        yield datos
+
+
+def _filas_jsonl(fichero):
+    for linea in fichero:
+        linea = linea.strip()
+        if not linea:
+            yield None
+            continue
+        try:
+            datos = json.loads(linea)
+        except ValueError as e:
+            yield FilaInvalida(f"JSON no válido: {e}")
+            continue
+        if not isinstance(datos, dict):
+            yield FilaInvalida("cada línea debe ser un objeto JSON")
+            continue
+        yield {k: v for k, v in datos.items() if v is not None}
+
+
+def formato_de(ruta: str) -> str:
+    return "csv" if str(ruta).lower().endswith(".csv") else "jsonl"
+
+
+def leer(fichero, formato: str):
+    """Genera (número de fila, datos | FilaInvalida) sin cargar el fichero entero."""
+    filas = _filas_csv(fichero) if formato == "csv" else _filas_jsonl(fichero)
+    for numero, datos in enumerate(filas, start=1):
+        if datos is not None:
+            yield numero, datos
+
+
+# ------------------------------------------------------------------
+#  Normalización de una fila
+# ------------------------------------------------------------------
+
+def _normalizar(datos: dict) -> dict:
+    campos = {k: conv(datos[k]) for k, conv in CAMPOS.items() if k in datos}
+    slug = slugify(datos.get("slug") or campos.get("nombre") or "")
+    if not slug:
+        raise FilaInvalida("falta slug o nombre")
+    # Todo lo que no cabría en la base de datos se rechaza aquí: un error al
+    # guardar (DataError en PostgreSQL) desharía el lote entero y pararía la
+    # importación.
+    if len(slug) > MAX_SLUG:
+        raise FilaInvalida(f"slug de más de {MAX_SLUG} caracteres: {slug[:30]!r}…")
+    lista = datos.get("variantes") or []
+    if not isinstance(lista, list) or not all(isinstance(v, dict) for v in lista):
+        raise FilaInvalida("variantes debe ser una lista de objetos")
+    variantes = []
+    for v in lista:
+        if not v.get("talla") and not v.get("color"):
+            raise FilaInvalida("variante sin talla ni color")
+        variantes.append({
+            "talla": _talla(v.get("talla") or ""),
+            "color": _color(v.get("color") or ""),
+            "stock": _stock(v.get("stock") or 0),
+            "extra_precio": _extra_precio(v.get("extra_precio") or 0),
+        })
+    return {
+        "slug": slug,
+        "campos": campos,
+        "categoria": _nombre_relacion(datos.get("categoria") or ""),
+        "marca": _nombre_relacion(datos.get("marca") or ""),
+        "variantes": variantes,
+    }
+
+
+def _juntar(anterior: dict, nueva: dict) -> dict:
+    anterior["campos"].update(nueva["campos"])
+    anterior["categoria"] = nueva["categoria"] or anterior["categoria"]
+    anterior["marca"] = nueva["marca"] or anterior["marca"]
+    anterior["variantes"] += nueva["variantes"]
+    return anterior
+
+
+# ------------------------------------------------------------------
+#  Importador
+# ------------------------------------------------------------------
+
+class Importador:
+    def __init__(self, tam_lote=TAM_LOTE, progreso=None):
+        self.tam_lote = max(1, int(tam_lote))
+        self.progreso = progreso
+        self.categorias = self._mapas(Categoria)
+        self.marcas = self._mapas(Marca)
+        self.stats = {
+            "filas": 0, "creados": 0, "actualizados": 0, "variantes": 0,
+            "errores": [], "total_errores": 0, "segundos": 0.0,
+        }
+        self._inicio = None
+
+    def _error(self, linea, texto) -> None:
+        # Con un fichero malo entero no se guarda un error por fila
+        self.stats["total_errores"] += 1
+        if len(self.stats["errores"]) < MAX_ERRORES:
+            self.stats["errores"].append((linea, texto))
+
+    # -- categorías y marcas ------------------------------------------
+
+    @staticmethod
+    def _mapas(modelo) -> tuple:
+        """({nombre en minúsculas: id}, {slug: id})"""
+        por_nombre, por_slug = {}, {}
+        for pk, nombre, slug in modelo.objects.values_list("pk", "nombre", "slug"):
+            por_nombre.setdefault(nombre.lower(), pk)
+            por_slug[slug] = pk
+        return por_nombre, por_slug
+
+    def _id(self, mapas, modelo, nombre):
+        if not nombre:
+            return None
+        por_nombre, por_slug = mapas
+        clave = nombre.lower()
+        if clave not in por_nombre:
+            slug = slugify(nombre)
+            if slug not in por_slug:
+                por_slug[slug] = modelo.objects.create(nombre=nombre, slug=slug).pk
+            por_nombre[clave] = por_slug[slug]
+        return por_nombre[clave]
+
+    # -- lotes --------------------------------------------------------
+
+    @transaction.atomic
+    def _guardar(self, lote: dict) -> None:
+        ahora = timezone.now()
+        existentes = Producto.objects.in_bulk(list(lote), field_name="slug")
+        nuevos, cambiados, campos_cambiados = [], [], {"actualizado"}
+
+        for slug, fila in lote.items():
+            campos = dict(fila["campos"])
+            if fila["categoria"]:
+                campos["categoria_id"] = self._id(self.categorias, Categoria, fila["categoria"])
+            if fila["marca"]:
+                campos["marca_id"] = self._id(self.marcas, Marca, fila["marca"])
+
+            producto = existentes.get(slug)
+            if producto is None:
+                if not all(campos.get(k) is not None for k in ("nombre", "precio", "categoria_id")):
+                    self._error(
+                        fila["linea"], f"{slug}: para crearlo hacen falta {', '.join(OBLIGATORIOS)}"
+                    )
+                    fila["variantes"] = []
+                    continue
+                nuevos.append(Producto(slug=slug, actualizado=ahora, **campos))
+            else:
+                for campo, valor in campos.items():
+                    setattr(producto, campo, valor)
+                producto.actualizado = ahora
+                campos_cambiados.update(campos)
+                cambiados.append(producto)
+
+        Producto.objects.bulk_create(nuevos, batch_size=self.tam_lote)
+        if cambiados:
+            Producto.objects.bulk_update(cambiados, sorted(campos_cambiados), batch_size=self.tam_lote)
+
+        ids = dict(Producto.objects.filter(slug__in=list(lote)).values_list("slug", "pk"))
+        ids_nuevos = [ids[p.slug] for p in nuevos]
+        Popularidad.objects.bulk_create(
+            [Popularidad(producto_id=pk) for pk in ids_nuevos], ignore_conflicts=True
+        )
+        con_variantes = self._guardar_variantes(lote, ids)
+
+        # Lo que harían las señales de post_save
+        busqueda.indexar(ids.values())
+        stock.recalcular(con_variantes)
+        catalogo.invalidar()
+
+        self.stats["creados"] += len(nuevos)
+        self.stats["actualizados"] += len(cambiados)
+
+    def _guardar_variantes(self, lote: dict, ids: dict) -> list:
+        filas = {}
+        for slug, fila in lote.items():
+            for v in fila["variantes"]:
+                if slug in ids:
+                    filas[(ids[slug], v["talla"], v["color"])] = v
+        producto_ids = sorted({pid for pid, _, _ in filas})
+        if not producto_ids:
+            return []
+
+        existentes = {
+            (v.producto_id, v.talla, v.color): v
+            for v in Variante.objects.filter(producto_id__in=producto_ids).only(
+                "pk", "producto_id", "talla", "color", "stock", "extra_precio"
+            )
+        }
+        nuevas, cambiadas = [], []
+        for clave, v in filas.items():
+            variante = existentes.get(clave)
+            if variante is None:
+                nuevas.append(Variante(
+                    producto_id=clave[0], talla=clave[1], color=clave[2],
+                    stock=v["stock"], extra_precio=v["extra_precio"],
+                ))
+            else:
+                variante.stock, variante.extra_precio = v["stock"], v["extra_precio"]
+                cambiadas.append(variante)
+        Variante.objects.bulk_create(nuevas, batch_size=self.tam_lote)
+        Variante.objects.bulk_update(cambiadas, ["stock", "extra_precio"], batch_size=self.tam_lote)
+        self.stats["variantes"] += len(filas)
+        return producto_ids
+
+    def _vaciar(self, lote: dict) -> None:
+        if not lote:
+            return
+        self._guardar(lote)
+        lote.clear()
+        self.stats["segundos"] = time.monotonic() - self._inicio
+        if self.progreso:
+            self.progreso(self.stats)
+
+    # -- entrada ------------------------------------------------------
+
+    def importar(self, filas) -> dict:
+        """`filas`: lo que genera leer(). Devuelve las estadísticas."""
+        self._inicio = time.monotonic()
+        lote = {}
+        for numero, datos in filas:
+            self.stats["filas"] += 1
+            try:
+                if isinstance(datos, Exception):
+                    raise datos
+                fila = _normalizar(datos)
+            except FilaInvalida as e:
+                self._error(numero, str(e))
+                continue
+            fila["linea"] = numero
+            slug = fila["slug"]
+            if slug in lote:
+                _juntar(lote[slug], fila)
+                continue
+            if len(lote) >= self.tam_lote:
+                self._vaciar(lote)
+            lote[slug] = fila
+        self._vaciar(lote)
+        self.stats["segundos"] = time.monotonic() - self._inicio
+
+        # El autocompletado de este proceso se reconstruye en la siguiente consulta
+        sugerencias.vaciar()
+        # Una pasada agrupada al final en vez de un ajuste por producto
+        histograma.reconstruir()
+        return self.stats
+
+
+def importar(ruta: str, formato=None, tam_lote=TAM_LOTE, progreso=None) -> dict:
+    formato = formato or formato_de(ruta)
+    with open(ruta, newline="", encoding="utf-8-sig") as fichero:
+        return Importador(tam_lote, progreso).importar(leer(fichero, formato))
@@ -0,0 +1,151 @@
+"""
+Consulta del listado del catálogo: filtros de la URL, búsqueda, filtrado y
+paginación por cursor.
+
+La comparten el catálogo HTML (views.py) y la API (api.py), así que los dos
+devuelven los mismos productos en el mismo orden para los mismos parámetros.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Exists, OuterRef, Q
+
+from . import arbol, busqueda, cache_busqueda, paginacion, popularidad
+from .models import Producto, Variante
+
+
+# ------------------------------------------------------------------
+#  Filtros
+# ------------------------------------------------------------------
+
+def lista_param(request, nombre) -> list:
+    """Valores de un filtro múltiple (?talla=M&talla=L), limpios y ordenados."""
+    return sorted({v.strip() for v in request.GET.getlist(nombre) if v.strip()})
+
+
+def precio_param(request, nombre) -> str:
+    """Importe de ?precio_min= / ?precio_max= normalizado ("" si no es válido)."""
+    valor = request.GET.get(nombre, "").strip().replace(",", ".")
+    try:
+        importe = Decimal(valor)
+    except InvalidOperation:
+        return ""
+    return str(importe) if importe.is_finite() and importe >= 0 else ""
+
+
+def leer_filtros(request) -> dict:
+    return {
+        "q": request.GET.get("q", "").strip(),
+        "categoria": request.GET.get("categoria", "").strip(),
+        "marca": request.GET.get("marca", "").strip(),
+        "talla": lista_param(request, "talla"),
+        "color": lista_param(request, "color"),
+        "precio_min": precio_param(request, "precio_min"),
+        "precio_max": precio_param(request, "precio_max"),
+    }
+
+
+def buscar(q):
+    """
+    Productos activos que casan con `q` y, si hay índice de texto, sus ids
+    ordenados por relevancia (None si el orden es el normal).
+    """
+    productos = Producto.objects.filter(activo=True)
+    ids_relevancia = None
+    if q and busqueda.disponible():
+        # No depende del stock: una venta no la saca de la caché
+        ids_relevancia = cache_busqueda.ids_texto(q, busqueda.buscar_ids)
+    if q and ids_relevancia is None:
+        # Motor sin índice de texto: búsqueda clásica
+        productos = productos.filter(Q(nombre__icontains=q) | Q(descripcion__icontains=q))
+    elif q:
+        productos = productos.filter(pk__in=ids_relevancia)
+    return productos, ids_relevancia
+
+
+def en_subarbol(productos, ids):
+    """
+    Filtra por una categoría y sus subcategorías (ids sacados de la tabla de
+    cierre). Con una sola categoría el filtro es una igualdad y los índices
+    (categoria, orden) devuelven las filas ya ordenadas.
+    """
+    if len(ids) == 1:
+        return productos.filter(categoria_id=ids[0])
+    return productos.filter(categoria_id__in=ids)
+
+
+def filtrar_variantes(productos, filtros):
+    """
+    Solo productos con alguna variante en stock de esas tallas/colores (la
+    misma variante tiene que cumplir los dos). Es un EXISTS correlacionado
+    que entra por el índice (talla, color, producto) de Variante: no hay join,
+    así que ni filas repetidas ni DISTINCT sobre el catálogo.
+    """
+    tallas, colores = filtros.get("talla"), filtros.get("color")
+    if not tallas and not colores:
+        return productos
+    variantes = Variante.objects.filter(producto=OuterRef("pk"), stock__gt=0)
+    if tallas:
+        variantes = variantes.filter(talla__in=tallas)
+    if colores:
+        variantes = variantes.filter(color__in=colores)
+    return productos.filter(Exists(variantes))
+
+
+def filtrar_atributos(productos, filtros):
+    """
+    Filtros que también cuentan para los recuentos de categoría/marca:
+    rango de precio (índices parciales por precio) y talla/color.
+    """
+    if filtros.get("precio_min"):
+        productos = productos.filter(precio__gte=Decimal(filtros["precio_min"]))
+    if filtros.get("precio_max"):
+        productos = productos.filter(precio__lte=Decimal(filtros["precio_max"]))
+    return filtrar_variantes(productos, filtros)
+
+
+def filtrar(productos, filtros):
+    if filtros.get("categoria"):
+        # La categoría incluye todas sus subcategorías (tabla de cierre)
+        productos = en_subarbol(productos, arbol.subarbol_ids_slug(filtros["categoria"]))
+    if filtros.get("marca"):
+        productos = productos.filter(marca__slug=filtros["marca"])
+    return productos
+
+
+# ------------------------------------------------------------------
+#  Paginación
+# ------------------------------------------------------------------
+
+def paginar(request, productos, filtros, ids_relevancia=None):
+    """
+    Corta el listado en páginas por cursor. Con búsqueda por texto el orden
+    es el de relevancia (lista de ids) salvo que se pida otro con ?orden=;
+    sin búsqueda, el -creado de siempre.
+    """
+    token = request.GET.get("cursor", "")
+    productos = productos.select_related("categoria", "marca")
+
+    pedido = request.GET.get("orden", "").strip()
+    if pedido:
+        nombre, campos = paginacion.orden(pedido)
+        if nombre == "vendidos":
+            productos = popularidad.anotar(productos)
+        # El orden va en la firma: un cursor de "precio" no vale para "nombre"
+        filtros = {**filtros, "orden": nombre}
+        pagina = paginacion.paginar_keyset(productos, token, filtros, orden=campos)
+        pagina["orden"] = nombre
+    elif ids_relevancia is None:
+        pagina = paginacion.paginar_keyset(productos, token, filtros)
+    else:
+        def filtrados(_q):
+            validos = set(productos.filter(pk__in=ids_relevancia).values_list("pk", flat=True))
+            return [pk for pk in ids_relevancia if pk in validos]
+
+        # Con la lista cacheada, la página es solo el in_bulk de abajo
+        ids = cache_busqueda.ids(filtros, filtrados)
+        pagina = paginacion.paginar_ids(ids, token, filtros)
+        encontrados = productos.in_bulk(pagina["ids"])
+        pagina["items"] = [encontrados[pk] for pk in pagina["ids"] if pk in encontrados]
+    # El índice de texto corta en BUSQUEDA_MAX_RESULTADOS, sea cual sea el orden
+    pagina["truncado"] = ids_relevancia is not None and len(ids_relevancia) >= busqueda.max_resultados()
+    return pagina
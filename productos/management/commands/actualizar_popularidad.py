@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from productos import popularidad
+
+
+class Command(BaseCommand):
+    help = (
+        "Lleva a las ventas diarias los pedidos confirmados o cancelados y recalcula el "
+        "ranking de más vendidos (programar, p. ej., cada hora)"
+    )
+
+    def handle(self, *args, **kwargs):
+        stats = popularidad.actualizar()
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['lineas']} líneas tratadas; {stats['productos_recalculados']} productos recalculados."
+        ))
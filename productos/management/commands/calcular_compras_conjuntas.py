@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from productos import recomendaciones
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye las recomendaciones "comprados juntos" a partir de los pedidos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--trozo", type=int, default=2000,
+            help="Pedidos por trozo (marca la memoria usada)",
+        )
+        parser.add_argument("--top", type=int, default=None, help="Compañeros por producto")
+
+    def handle(self, *args, **opts):
+        filas = recomendaciones.calcular(tam_trozo=opts["trozo"], k=opts["top"])
+        self.stdout.write(self.style.SUCCESS(f"{filas} recomendaciones guardadas."))
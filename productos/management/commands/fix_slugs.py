@@ -1,32 +1,97 @@
+from collections import Counter
+
 from django.core.management.base import BaseCommand
-from django.utils.text import slugify
-from productos.models import Producto
 from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from productos import catalogo, sugerencias
+from productos.models import Categoria, Marca, Producto
+
+MODELOS = {
+    "producto": Producto,
+    "categoria": Categoria,
+    "marca": Marca,
+}
+
+
+def nuevos_slugs(filas, ocupados: Counter, prefijo: str):
+    """
+    `filas`: (pk, slug, nombre) en orden de id; `ocupados`, los slugs actuales
+    de la tabla. Genera (pk, antiguo, nuevo) de los que cambian.
+
+    Todo en memoria: un slug está libre si no lo tiene ya otra fila (las
+    anteriores con su slug nuevo, las siguientes con el de ahora). El
+    siguiente sufijo de cada base se recuerda, así que las colisiones no
+    vuelven a probar -2, -3... desde el principio.
+    """
+    vistos = set()
+    sufijo = {}
+    for pk, slug, nombre in filas:
+        ocupados[slug] -= 1
+        base = slugify(slug or nombre) or f"{prefijo}-{pk}"
+        nuevo = base
+        i = sufijo.get(base, 2)
+        while nuevo in vistos or ocupados[nuevo] > 0:
+            nuevo = f"{base}-{i}"
+            i += 1
+        if nuevo != base:
+            sufijo[base] = i
+        vistos.add(nuevo)
+        if nuevo != slug:
+            yield pk, slug, nuevo
+
 
 class Command(BaseCommand):
-    help = "Normaliza a ASCII los slugs de productos y garantiza unicidad"
+    help = "Normaliza a ASCII los slugs de productos, categorías y marcas y garantiza unicidad"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Solo enseña los cambios, no guarda nada",
+        )
+        parser.add_argument(
+            "--modelos", nargs="+", choices=list(MODELOS), default=list(MODELOS),
+        )
+        parser.add_argument("--lote", type=int, default=1000, help="Filas por bulk_update")
+
+    def _normalizar(self, nombre, modelo, simular, tam_lote):
+        ocupados = Counter(modelo.objects.values_list("slug", flat=True).iterator(chunk_size=10000))
+        filas = modelo.objects.order_by("id").values_list("pk", "slug", "nombre")
+        con_actualizado = any(f.name == "actualizado" for f in modelo._meta.fields)
+        campos = ["slug", "actualizado"] if con_actualizado else ["slug"]
+
+        cambios, pendientes = 0, []
+        for pk, antiguo, nuevo in nuevos_slugs(filas.iterator(chunk_size=10000), ocupados, nombre):
+            cambios += 1
+            self.stdout.write(f"  - {nombre} {pk}: {antiguo!r} -> {nuevo!r}")
+            if simular:
+                continue
+            obj = modelo(pk=pk, slug=nuevo)
+            if con_actualizado:
+                # invalida las cachés por producto (tarjetas, etc.)
+                obj.actualizado = timezone.now()
+            pendientes.append(obj)
+            if len(pendientes) >= tam_lote:
+                modelo.objects.bulk_update(pendientes, campos)
+                pendientes = []
+        if pendientes:
+            modelo.objects.bulk_update(pendientes, campos)
+        return cambios
 
     @transaction.atomic
-    def handle(self, *args, **kwargs):
-        vistos = set()
-        cambios = 0
-
-        for p in Producto.objects.all().order_by("id"):
-            base = slugify(p.slug or p.nombre) or f"producto-{p.pk}"
-            nuevo = base
-            i = 2
-            # evita colisiones con otros productos
-            while nuevo in vistos or Producto.objects.exclude(pk=p.pk).filter(slug=nuevo).exists():
-                nuevo = f"{base}-{i}"
-                i += 1
-
-            vistos.add(nuevo)
-
-            if p.slug != nuevo:
-                old = p.slug
-                p.slug = nuevo
-                p.save(update_fields=["slug"])
-                cambios += 1
-                self.stdout.write(f"  - {old!r} -> {nuevo!r}")
-
-        self.stdout.write(self.style.SUCCESS(f"Slugs normalizados. Cambios: {cambios}"))
+    def handle(self, *args, **opts):
+        simular = opts["dry_run"]
+        total = 0
+        for nombre in opts["modelos"]:
+            total += self._normalizar(nombre, MODELOS[nombre], simular, max(1, opts["lote"]))
+
+        if simular:
+            self.stdout.write(self.style.WARNING(f"Simulación: {total} slugs cambiarían."))
+            return
+        if total:
+            # bulk_update no lanza señales: el autocompletado y el sitemap
+            # guardan las URLs
+            sugerencias.vaciar()
+            catalogo.invalidar()
+        self.stdout.write(self.style.SUCCESS(f"Slugs normalizados. Cambios: {total}"))
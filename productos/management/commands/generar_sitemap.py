@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from productos import sitemap
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera sitemap.xml y el feed de productos de la versión actual del "
+        "catálogo (si no estaban ya), para no hacerlo en la primera petición"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="", help="URL del sitio (por defecto, SITIO_URL)")
+
+    def handle(self, *args, **opts):
+        base = opts["url"] or sitemap.base_url()
+        if not base:
+            raise CommandError("Indica --url o configura SITIO_URL.")
+        carpeta = sitemap.generar(base)
+        self.stdout.write(self.style.SUCCESS(f"Sitemap y feed en {carpeta}"))
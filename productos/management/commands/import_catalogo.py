@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from productos import importacion
+
+
+class Command(BaseCommand):
+    help = (
+        "Importa (alta o actualización por slug) productos y variantes desde un "
+        "CSV o JSONL, por lotes y sin cargar el fichero en memoria"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("fichero")
+        parser.add_argument(
+            "--formato", choices=["csv", "jsonl"], default=None,
+            help="Por defecto, según la extensión (.csv; lo demás se lee como JSONL)",
+        )
+        parser.add_argument(
+            "--lote", type=int, default=importacion.TAM_LOTE,
+            help="Productos por lote (y por transacción)",
+        )
+
+    def _progreso(self, stats):
+        if self.verbosity >= 2:
+            self.stdout.write(
+                f"  {stats['filas']} filas en {stats['segundos']:.1f}s "
+                f"({stats['filas'] / max(stats['segundos'], 1e-6):.0f} filas/s)"
+            )
+
+    def handle(self, *args, **opts):
+        self.verbosity = opts["verbosity"]
+        try:
+            stats = importacion.importar(
+                opts["fichero"], formato=opts["formato"], tam_lote=opts["lote"],
+                progreso=self._progreso,
+            )
+        except OSError as e:
+            raise CommandError(f"No se puede leer {opts['fichero']}: {e}")
+
+        for linea, error in stats["errores"][:50]:
+            self.stderr.write(f"  fila {linea}: {error}")
+        if stats["total_errores"] > 50:
+            self.stderr.write(f"  ... y {stats['total_errores'] - 50} errores más")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['filas']} filas en {stats['segundos']:.1f}s "
+            f"({stats['filas'] / max(stats['segundos'], 1e-6):.0f} filas/s): "
+            f"{stats['creados']} productos nuevos, {stats['actualizados']} actualizados, "
+            f"{stats['variantes']} variantes, {stats['total_errores']} errores."
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from productos import subidas
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra las imágenes de personalización sin usar desde hace más de "
+        "SUBIDAS_TTL_HORAS que no están en ningún carrito ni pedido"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Solo cuenta lo que se borraría",
+        )
+
+    def handle(self, *args, **opts):
+        stats = subidas.limpiar(simular=opts["dry_run"])
+        verbo = "Se borrarían" if opts["dry_run"] else "Borradas"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verbo} {stats['registros']} subidas y {stats['ficheros']} ficheros huérfanos "
+            f"({filesizeformat(stats['bytes'])})."
+        ))
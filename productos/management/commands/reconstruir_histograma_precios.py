@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from productos import histograma
+
+
+class Command(BaseCommand):
+    help = (
+        "Rehace el histograma de precios del catálogo (tras cargas masivas o "
+        "si se cambian CATALOGO_TRAMOS_PRECIO)"
+    )
+
+    def handle(self, *args, **kwargs):
+        filas = histograma.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f"Histograma de precios: {filas} filas."))
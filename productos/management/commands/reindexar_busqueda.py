@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from productos import busqueda
+
+
+class Command(BaseCommand):
+    help = "Reconstruye el índice de búsqueda de texto completo del catálogo"
+
+    @transaction.atomic
+    def handle(self, *args, **kwargs):
+        if not busqueda.disponible():
+            self.stdout.write(self.style.WARNING("Este motor no tiene índice de búsqueda; nada que hacer."))
+            return
+        busqueda.reindexar_todo()
+        self.stdout.write(self.style.SUCCESS("Índice de búsqueda reconstruido."))
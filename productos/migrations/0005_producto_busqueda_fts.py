@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+FTS_TABLA = "productos_producto_fts"
+PG_INDICE = "productos_producto_busqueda_gin"
+PG_VECTOR = (
+    "(setweight(to_tsvector('spanish', coalesce(nombre, '')), 'A') || "
+    "setweight(to_tsvector('spanish', coalesce(descripcion, '')), 'B'))"
+)
+
+
+def crear_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLA} USING fts5("
+            f"nombre, descripcion, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLA} (rowid, nombre, descripcion) "
+            f"SELECT id, nombre, descripcion FROM productos_producto WHERE activo"
+        )
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {PG_INDICE} ON productos_producto "
+            f"USING GIN ({PG_VECTOR}) WHERE activo"
+        )
+
+
+def borrar_indice(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLA}")
+    elif vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX IF EXISTS {PG_INDICE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0004_producto_precio_personalizacion_color_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0005_producto_busqueda_fts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['activo', '-creado', '-id'], name='productos_p_activo_c4fc89_idx'),
+        ),
+    ]
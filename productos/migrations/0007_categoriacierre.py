@@ -0,0 +1,44 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def rellenar_cierre(apps, schema_editor):
+    Categoria = apps.get_model("productos", "Categoria")
+    CategoriaCierre = apps.get_model("productos", "CategoriaCierre")
+    padres = dict(Categoria.objects.values_list("pk", "padre_id"))
+    filas = []
+    for cid in padres:
+        actual, profundidad, vistos = cid, 0, set()
+        while actual is not None and actual not in vistos:
+            vistos.add(actual)
+            filas.append(CategoriaCierre(ancestro_id=actual, descendiente_id=cid, profundidad=profundidad))
+            actual, profundidad = padres.get(actual), profundidad + 1
+    CategoriaCierre.objects.bulk_create(filas, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0006_producto_indice_paginacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoriaCierre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profundidad', models.PositiveIntegerField(default=0)),
+                ('ancestro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cierre_descendientes', to='productos.categoria')),
+                ('descendiente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cierre_ancestros', to='productos.categoria')),
+            ],
+            options={
+                'verbose_name': 'Relación de categorías',
+                'verbose_name_plural': 'Relaciones de categorías',
+                'indexes': [models.Index(fields=['descendiente', 'ancestro'], name='productos_c_descend_2b04d0_idx')],
+                'unique_together': {('ancestro', 'descendiente')},
+            },
+        ),
+        migrations.RunPython(rellenar_cierre, migrations.RunPython.noop),
+    ]
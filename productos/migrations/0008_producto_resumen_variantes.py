@@ -0,0 +1,48 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:32
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def rellenar_resumen(apps, schema_editor):
+    Producto = apps.get_model("productos", "Producto")
+    Variante = apps.get_model("productos", "Variante")
+    por_producto = defaultdict(list)
+    for pid, talla, color, stock in Variante.objects.values_list("producto_id", "talla", "color", "stock"):
+        por_producto[pid].append((talla, color, stock))
+    cambios = []
+    for pid, filas in por_producto.items():
+        con_stock = [(t, c, s) for t, c, s in filas if s > 0]
+        cambios.append(Producto(
+            pk=pid,
+            stock_variantes=sum(s for _, _, s in filas),
+            resumen_variantes={
+                "variantes": len(filas),
+                "con_stock": len(con_stock),
+                "tallas": sorted({t for t, _, _ in con_stock if t}),
+                "colores": sorted({c for _, c, _ in con_stock if c}),
+            },
+        ))
+    Producto.objects.bulk_update(cambios, ["stock_variantes", "resumen_variantes"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0007_categoriacierre'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='resumen_variantes',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Nº de variantes, cuántas tienen stock y tallas/colores disponibles.'),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='stock_variantes',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Unidades disponibles sumando todas las variantes.'),
+        ),
+        migrations.RunPython(rellenar_resumen, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0008_producto_resumen_variantes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
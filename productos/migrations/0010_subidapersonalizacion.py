@@ -0,0 +1,29 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:39
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0009_producto_imagen_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubidaPersonalizacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('fichero', models.CharField(max_length=255)),
+                ('tamano', models.PositiveIntegerField(default=0)),
+                ('creada', models.DateTimeField(auto_now_add=True)),
+                ('usada', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Subida de personalización',
+                'verbose_name_plural': 'Subidas de personalización',
+            },
+        ),
+    ]
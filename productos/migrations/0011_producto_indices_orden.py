@@ -0,0 +1,53 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0010_subidapersonalizacion'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='producto',
+            name='productos_p_activo_c4fc89_idx',
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['-creado', '-id'], name='prod_cat_novedad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['precio', 'id'], name='prod_cat_precio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['nombre', 'id'], name='prod_cat_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['categoria', '-creado', '-id'], name='prod_categoria_novedad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['categoria', 'precio', 'id'], name='prod_categoria_precio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['categoria', 'nombre', 'id'], name='prod_categoria_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['marca', '-creado', '-id'], name='prod_marca_novedad_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['marca', 'precio', 'id'], name='prod_marca_precio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['marca', 'nombre', 'id'], name='prod_marca_nombre_idx'),
+        ),
+    ]
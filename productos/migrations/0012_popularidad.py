@@ -0,0 +1,69 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def crear_filas(apps, schema_editor):
+    # Una fila a 0 por producto: el orden "más vendidos" usa un join interno
+    Producto = apps.get_model("productos", "Producto")
+    Popularidad = apps.get_model("productos", "Popularidad")
+    Popularidad.objects.bulk_create(
+        [Popularidad(producto_id=pk) for pk in Producto.objects.values_list("pk", flat=True)],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0011_producto_indices_orden'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProgresoTarea',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tarea', models.CharField(max_length=60, unique=True)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Progreso de tarea',
+                'verbose_name_plural': 'Progreso de tareas',
+            },
+        ),
+        migrations.CreateModel(
+            name='Popularidad',
+            fields=[
+                ('producto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularidad', serialize=False, to='productos.producto')),
+                ('unidades_7', models.PositiveIntegerField(default=0)),
+                ('unidades_30', models.PositiveIntegerField(default=0)),
+                ('unidades_90', models.PositiveIntegerField(default=0)),
+                ('puntuacion', models.FloatField(default=0)),
+                ('calculado', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Popularidad',
+                'verbose_name_plural': 'Popularidad',
+                'indexes': [models.Index(fields=['-puntuacion', '-producto'], name='productos_p_puntuac_1a07e0_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('unidades', models.PositiveIntegerField(default=0)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ventas_diarias', to='productos.producto')),
+            ],
+            options={
+                'verbose_name': 'Venta diaria',
+                'verbose_name_plural': 'Ventas diarias',
+                'indexes': [models.Index(fields=['dia'], name='productos_v_dia_dacfab_idx')],
+                'unique_together': {('producto', 'dia')},
+            },
+        ),
+        migrations.RunPython(crear_filas, migrations.RunPython.noop),
+    ]
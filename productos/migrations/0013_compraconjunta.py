@@ -0,0 +1,29 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0012_popularidad'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompraConjunta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('veces', models.PositiveIntegerField()),
+                ('posicion', models.PositiveSmallIntegerField()),
+                ('companero', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='comprado_con', to='productos.producto')),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compras_conjuntas', to='productos.producto')),
+            ],
+            options={
+                'verbose_name': 'Compra conjunta',
+                'verbose_name_plural': 'Compras conjuntas',
+                'unique_together': {('producto', 'posicion')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+
+def rellenar_extra_precio(apps, schema_editor):
+    # Rango de extra_precio en resumen_variantes (ver stock.resumen)
+    Producto = apps.get_model("productos", "Producto")
+    Variante = apps.get_model("productos", "Variante")
+    extras = defaultdict(list)
+    for pid, extra in Variante.objects.values_list("producto_id", "extra_precio"):
+        extras[pid].append(extra or 0)
+    cambios = []
+    for producto in Producto.objects.filter(pk__in=[p for p, e in extras.items() if min(e) != max(e)]):
+        e = extras[producto.pk]
+        producto.resumen_variantes = {
+            **(producto.resumen_variantes or {}),
+            "extra_precio": [str(min(e)), str(max(e))],
+        }
+        cambios.append(producto)
+    Producto.objects.bulk_update(cambios, ["resumen_variantes"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("productos", "0013_compraconjunta"),
+    ]
+
+    operations = [
+        migrations.RunPython(rellenar_extra_precio, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+ESTILOS_PANTALON = [
+    # los campos de color/textura hacen de recargo "roto" y "parche"
+    ("roto,roto-parche", "color"),
+    ("parche,roto-parche", "textura"),
+]
+
+
+def reglas_iniciales(apps, schema_editor):
+    # Las mismas reglas que calcular_precio tenía escritas en el código
+    ReglaPrecio = apps.get_model("productos", "ReglaPrecio")
+    Categoria = apps.get_model("productos", "Categoria")
+    reglas = [
+        ReglaPrecio(concepto="texto", recargo="nombre"),
+        ReglaPrecio(concepto="color", valores="#ffffff,#fff,#000000,#000", recargo="color"),
+        ReglaPrecio(concepto="textura", recargo="textura"),
+    ]
+    pantalones = [
+        c.pk for c in Categoria.objects.only("pk", "nombre") if "pantal" in c.nombre.lower()
+    ]
+    for valores, recargo in ESTILOS_PANTALON:
+        reglas.append(ReglaPrecio(
+            tipo="pantalon", concepto="estilo", valores=valores, recargo=recargo,
+            solo_personalizables=False,
+        ))
+        reglas += [
+            ReglaPrecio(
+                categoria_id=pk, concepto="estilo", valores=valores, recargo=recargo,
+                solo_personalizables=False,
+            )
+            for pk in pantalones
+        ]
+    ReglaPrecio.objects.bulk_create(reglas)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0014_resumen_variantes_extra_precio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReglaPrecio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(blank=True, max_length=40)),
+                ('concepto', models.CharField(choices=[('estilo', 'Estilo (uno de los valores)'), ('texto', 'Texto'), ('color', 'Color de texto (salvo los valores)'), ('textura', 'Textura / imagen')], max_length=20)),
+                ('valores', models.CharField(blank=True, help_text='Separados por comas. Estilo: los que llevan recargo; color: los que no.', max_length=200)),
+                ('recargo', models.CharField(choices=[('nombre', 'Precio personalización nombre'), ('color', 'Precio personalización color'), ('textura', 'Precio personalización textura')], help_text='Campo del producto que da el importe.', max_length=20)),
+                ('importe', models.DecimalField(blank=True, decimal_places=2, help_text='Importe fijo (si se indica, sustituye al del producto).', max_digits=8, null=True)),
+                ('solo_personalizables', models.BooleanField(default=True, help_text='Solo en productos con permite_personalizacion.')),
+                ('activa', models.BooleanField(default=True)),
+                ('categoria', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reglas_precio', to='productos.categoria')),
+                ('producto', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reglas_precio', to='productos.producto')),
+            ],
+            options={
+                'verbose_name': 'Regla de precio',
+                'verbose_name_plural': 'Reglas de precio',
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.RunPython(reglas_iniciales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.24 on 2026-10-18 04:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0015_reglaprecio'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='variante',
+            index=models.Index(fields=['talla', 'color', 'producto'], name='variante_talla_color_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.24 on 2026-10-18 05:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def rellenar_histograma(apps, schema_editor):
+    from collections import Counter
+
+    # Con los tramos configurados (CATALOGO_TRAMOS_PRECIO o histograma.TRAMOS)
+    from productos.histograma import tramo
+
+    Producto = apps.get_model("productos", "Producto")
+    HistogramaPrecio = apps.get_model("productos", "HistogramaPrecio")
+    cuenta = Counter(
+        (c, m, tramo(p))
+        for c, m, p in Producto.objects.filter(activo=True).values_list("categoria_id", "marca_id", "precio")
+    )
+    HistogramaPrecio.objects.bulk_create(
+        [HistogramaPrecio(categoria_id=c, marca_id=m, tramo=t, productos=n) for (c, m, t), n in cuenta.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0016_variante_indice_talla_color'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistogramaPrecio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tramo', models.PositiveSmallIntegerField()),
+                ('productos', models.IntegerField(default=0)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='productos.categoria')),
+                ('marca', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='productos.marca')),
+            ],
+            options={
+                'verbose_name': 'Histograma de precios',
+                'verbose_name_plural': 'Histograma de precios',
+                'unique_together': {('categoria', 'marca', 'tramo')},
+            },
+        ),
+        migrations.RunPython(rellenar_histograma, migrations.RunPython.noop),
+    ]
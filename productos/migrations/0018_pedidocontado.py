@@ -0,0 +1,32 @@
+# Generated by Django 4.2.24 on 2026-10-18 05:17
+
+from django.db import migrations, models
+
+
+def empezar_de_cero(apps, schema_editor):
+    # Lo sumado con la marca por id no dice qué pedidos están contados: la
+    # siguiente pasada de actualizar_popularidad rehace la ventana entera.
+    apps.get_model("productos", "VentaDiaria").objects.all().delete()
+    apps.get_model("productos", "ProgresoTarea").objects.filter(tarea="popularidad").update(ultimo_id=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0017_histogramaprecio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PedidoContado',
+            fields=[
+                ('pedido_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('dia', models.DateField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Pedido contado',
+                'verbose_name_plural': 'Pedidos contados',
+            },
+        ),
+        migrations.RunPython(empezar_de_cero, migrations.RunPython.noop),
+    ]
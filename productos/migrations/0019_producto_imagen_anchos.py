@@ -0,0 +1,18 @@
+# Generated by Django 4.2.24 on 2026-10-18 05:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0018_pedidocontado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='imagen_anchos',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
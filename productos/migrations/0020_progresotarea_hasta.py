@@ -0,0 +1,22 @@
+# Generated by Django 4.2.24 on 2026-10-18 05:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0019_producto_imagen_anchos'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='progresotarea',
+            name='ultimo_id',
+        ),
+        migrations.AddField(
+            model_name='progresotarea',
+            name='hasta',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.24 on 2026-10-18 05:50
+
+from django.db import migrations, models
+
+
+def fusionar_sin_marca(apps, schema_editor):
+    """Junta en una las filas sin marca repetidas (unique_together las dejaba pasar)."""
+    from django.db.models import Count, Sum
+
+    HistogramaPrecio = apps.get_model("productos", "HistogramaPrecio")
+    sin_marca = HistogramaPrecio.objects.filter(marca__isnull=True)
+    repetidas = (
+        sin_marca.values("categoria_id", "tramo")
+        .annotate(n=Count("id"), total=Sum("productos"))
+        .filter(n__gt=1)
+    )
+    for r in repetidas:
+        filas = sin_marca.filter(categoria_id=r["categoria_id"], tramo=r["tramo"]).order_by("pk")
+        primera = filas.first()
+        filas.exclude(pk=primera.pk).delete()
+        HistogramaPrecio.objects.filter(pk=primera.pk).update(productos=r["total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('productos', '0020_progresotarea_hasta'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='histogramaprecio',
+            unique_together=set(),
+        ),
+        migrations.RunPython(fusionar_sin_marca, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='histogramaprecio',
+            constraint=models.UniqueConstraint(condition=models.Q(('marca__isnull', False)), fields=('categoria', 'marca', 'tramo'), name='histograma_cat_marca_tramo_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='histogramaprecio',
+            constraint=models.UniqueConstraint(condition=models.Q(('marca__isnull', True)), fields=('categoria', 'tramo'), name='histograma_cat_sin_marca_tramo_uniq'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from decimal import Decimal  # <-- NUEVO
 
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.utils import timezone
 from django.utils.text import slugify
 from django.urls import reverse
 
@@ -25,10 +27,43 @@ class Categoria(models.Model):
         self.slug = slugify(self.slug or self.nombre)
         super().save(*args, **kwargs)
 
+    def clean(self):
+        from .arbol import es_descendiente
+
+        if self.pk and self.padre_id and es_descendiente(self.padre_id, self.pk):
+            raise ValidationError({"padre": "Una categoría no puede colgar de sí misma ni de sus hijas."})
+
     def __str__(self) -> str:
         return self.nombre
 
 
+class CategoriaCierre(models.Model):
+    """
+    Tabla de cierre del árbol de categorías: una fila por cada par
+    ancestro → descendiente, incluida la propia categoría (profundidad 0).
+    Con ella, "todos los productos bajo X" es un único join indexado.
+    La mantiene productos/arbol.py desde las señales de Categoria.
+    """
+    ancestro = models.ForeignKey(
+        Categoria, on_delete=models.CASCADE, related_name="cierre_descendientes"
+    )
+    descendiente = models.ForeignKey(
+        Categoria, on_delete=models.CASCADE, related_name="cierre_ancestros"
+    )
+    profundidad = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("ancestro", "descendiente")
+        verbose_name = "Relación de categorías"
+        verbose_name_plural = "Relaciones de categorías"
+        indexes = [
+            models.Index(fields=["descendiente", "ancestro"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.ancestro_id} → {self.descendiente_id} ({self.profundidad})"
+
+
 class Marca(models.Model):
     nombre = models.CharField(max_length=120, unique=True)
     slug = models.SlugField(max_length=140, unique=True, blank=True)
@@ -50,6 +85,10 @@ class Marca(models.Model):
         return self.nombre
 
 
+# Condición de los índices parciales del catálogo
+SOLO_ACTIVOS = models.Q(activo=True)
+
+
 class Producto(models.Model):
     categoria = models.ForeignKey(
         Categoria, on_delete=models.PROTECT, related_name="productos"
@@ -65,12 +104,29 @@ class Producto(models.Model):
     imagen = models.ImageField(
         upload_to="productos/", blank=True
     )  # pon null=True si quieres
+    # sha256 de la imagen cuyos derivados responsive existen (ver imagenes.py)
+    imagen_hash = models.CharField(max_length=64, blank=True, editable=False)
+    # ancho real en píxeles de cada derivado, {uso: ancho}, para el srcset
+    imagen_anchos = models.JSONField(default=dict, blank=True, editable=False)
     activo = models.BooleanField(default=True)
     destacado = models.BooleanField(default=False)
     creado = models.DateTimeField(auto_now_add=True)
     actualizado = models.DateTimeField(auto_now=True)
     permite_personalizacion = models.BooleanField(default=False)
 
+    # Resumen de las variantes (lo mantiene productos/stock.py)
+    stock_variantes = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        help_text="Unidades disponibles sumando todas las variantes.",
+    )
+    resumen_variantes = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="Nº de variantes, cuántas tienen stock y tallas/colores disponibles.",
+    )
+
     # === NUEVOS CAMPOS: recargos de personalización ===
     precio_personalizacion_nombre = models.DecimalField(
         max_digits=8,
@@ -102,15 +158,37 @@ class Producto(models.Model):
             models.Index(fields=["activo"]),
             models.Index(fields=["destacado"]),
             models.Index(fields=["slug"]),
+            # Órdenes del catálogo (?orden=, ver paginacion.ORDENES), solos y
+            # tras filtrar por categoría o marca. Son parciales sobre activo:
+            # en SQLite el filtro sale como WHERE "activo" (no "activo = 1") y
+            # un índice que empiece por activo no serviría para ordenar.
+            models.Index(fields=["-creado", "-id"], name="prod_cat_novedad_idx", condition=SOLO_ACTIVOS),
+            models.Index(fields=["precio", "id"], name="prod_cat_precio_idx", condition=SOLO_ACTIVOS),
+            models.Index(fields=["nombre", "id"], name="prod_cat_nombre_idx", condition=SOLO_ACTIVOS),
+            models.Index(fields=["categoria", "-creado", "-id"], name="prod_categoria_novedad_idx", condition=SOLO_ACTIVOS),
+            models.Index(fields=["categoria", "precio", "id"], name="prod_categoria_precio_idx", condition=SOLO_ACTIVOS),
+            models.Index(fields=["categoria", "nombre", "id"], name="prod_categoria_nombre_idx", condition=SOLO_ACTIVOS),
+            models.Index(fields=["marca", "-creado", "-id"], name="prod_marca_novedad_idx", condition=SOLO_ACTIVOS),
+            models.Index(fields=["marca", "precio", "id"], name="prod_marca_precio_idx", condition=SOLO_ACTIVOS),
+            models.Index(fields=["marca", "nombre", "id"], name="prod_marca_nombre_idx", condition=SOLO_ACTIVOS),
         ]
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.slug or self.nombre)
         super().save(*args, **kwargs)
 
+    @property
+    def tiene_variantes(self) -> bool:
+        return bool((self.resumen_variantes or {}).get("variantes"))
+
+    @property
+    def stock_disponible(self) -> int:
+        """Con variantes manda su suma; sin ellas, el stock del producto."""
+        return self.stock_variantes if self.tiene_variantes else self.stock
+
     @property
     def agotado(self) -> bool:
-        return self.stock == 0
+        return self.stock_disponible == 0
 
     def get_absolute_url(self):
         return reverse("productos:producto_detalle", kwargs={"slug": self.slug})
@@ -125,70 +203,19 @@ class Producto(models.Model):
         - extra_precio de la variante (si la hay)
         - recargos por personalización.
 
-        REGLAS:
-
-        PANTALÓN (tipo="pantalon" en meta o categoría con 'pantal'):
-          - estilo = 'estandar'      -> sin recargo
-          - estilo = 'roto'          -> +precio_personalizacion_color
-          - estilo = 'parche'        -> +precio_personalizacion_textura
-          - estilo = 'roto-parche'   -> ambos recargos
-
-        RESTO (camisetas, gorras, etc.) cuando permite_personalizacion=True:
-          - Texto -> +precio_personalizacion_nombre
-          - Color (no blanco/negro) -> +precio_personalizacion_color
-          - Textura/imagen (preview_url) -> +precio_personalizacion_textura
+        Los recargos salen de ReglaPrecio (compiladas en memoria, ver
+        precios.py): el grupo del producto, el del `tipo` que mande la
+        personalización (p. ej. "pantalon"), el de su categoría o el general.
         """
+        from .precios import recargo
+
         precio = Decimal(self.precio)
 
         # Extra de la variante (talla/color)
         if variante is not None:
             precio += Decimal(getattr(variante, "extra_precio", 0) or 0)
 
-        pers = personalizacion or {}
-
-        # --- DETECCIÓN PANTALÓN ---
-        tipo = str(pers.get("tipo") or "").lower()
-        cat_nombre = (self.categoria.nombre if self.categoria else "") or ""
-        es_pantalon = (tipo == "pantalon") or ("pantal" in cat_nombre.lower())
-
-        if es_pantalon:
-            estilo = str(pers.get("estilo") or "estandar").lower()
-            # Usamos estos campos como recargos "roto" y "parche"
-            recargo_roto = Decimal(self.precio_personalizacion_color or 0)
-            recargo_parche = Decimal(self.precio_personalizacion_textura or 0)
-
-            if estilo in ("roto", "roto-parche"):
-                precio += recargo_roto
-            if estilo in ("parche", "roto-parche"):
-                precio += recargo_parche
-            return precio
-
-        # --- RESTO DE PRODUCTOS ---
-        if not self.permite_personalizacion:
-            return precio
-
-        texto = pers.get("texto") or ""
-        color_texto_raw = pers.get("color_texto") or ""
-        color_texto = str(color_texto_raw).strip().lower()
-        # Usamos preview_url como señal de que se subió imagen/textura
-        tiene_textura = bool(pers.get("preview_url"))
-
-        # Recargo por texto
-        if texto:
-            precio += Decimal(self.precio_personalizacion_nombre)
-
-        # Colores básicos que NO llevan recargo
-        colores_basicos = ("", "#ffffff", "#fff", "#000000", "#000")
-
-        # Recargo por color solo si no es blanco/negro básico
-        if color_texto not in colores_basicos:
-            precio += Decimal(self.precio_personalizacion_color)
-
-        # Recargo por textura / imagen
-        if tiene_textura:
-            precio += Decimal(self.precio_personalizacion_textura)
-
-        return precio
+        return precio + recargo(self, personalizacion)
 
 
 class Variante(models.Model):
@@ -208,7 +235,240 @@ class Variante(models.Model):
             models.Index(fields=["producto"]),
             models.Index(fields=["talla"]),
             models.Index(fields=["color"]),
+            # Filtros ?talla=&color= del catálogo (EXISTS por producto)
+            models.Index(fields=["talla", "color", "producto"], name="variante_talla_color_idx"),
         ]
 
+    def save(self, *args, **kwargs):
+        # El resumen de stock del producto (señal post_save) se recalcula
+        # dentro de esta misma transacción.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.producto.nombre} - {self.talla} - {self.color}"
+
+
+class SubidaPersonalizacion(models.Model):
+    """
+    Imagen que un cliente ha subido para personalizar un producto. El fichero
+    se guarda una sola vez por contenido (sha256); `usada` se actualiza cada
+    vez que se vuelve a subir, y el comando limpiar_subidas borra las que
+    llevan tiempo sin usarse y nadie referencia.
+    """
+    hash = models.CharField(max_length=64, unique=True)
+    fichero = models.CharField(max_length=255)
+    tamano = models.PositiveIntegerField(default=0)
+    creada = models.DateTimeField(auto_now_add=True)
+    usada = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = "Subida de personalización"
+        verbose_name_plural = "Subidas de personalización"
+
+    def __str__(self):
+        return self.fichero
+
+
+# ------------------------------------------------------------------
+#  Popularidad (ver popularidad.py)
+# ------------------------------------------------------------------
+
+class ProgresoTarea(models.Model):
+    """Hasta dónde ha llegado un proceso incremental (lo anterior a `hasta` ya está tratado)."""
+    tarea = models.CharField(max_length=60, unique=True)
+    hasta = models.DateTimeField(null=True, blank=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Progreso de tarea"
+        verbose_name_plural = "Progreso de tareas"
+
+    def __str__(self):
+        return f"{self.tarea}: {self.hasta}"
+
+
+class VentaDiaria(models.Model):
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name="ventas_diarias")
+    dia = models.DateField()
+    unidades = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("producto", "dia")
+        verbose_name = "Venta diaria"
+        verbose_name_plural = "Ventas diarias"
+        indexes = [
+            models.Index(fields=["dia"]),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_id} {self.dia}: {self.unidades}"
+
+
+class PedidoContado(models.Model):
+    """Pedido cuyas líneas ya están sumadas en VentaDiaria (ver popularidad.py)."""
+    # Sin FK: productos no depende de la app de pedidos (como PedidoItem.producto_id)
+    pedido_id = models.BigIntegerField(primary_key=True)
+    dia = models.DateField(db_index=True)
+
+    class Meta:
+        verbose_name = "Pedido contado"
+        verbose_name_plural = "Pedidos contados"
+
+    def __str__(self):
+        return f"{self.pedido_id} ({self.dia})"
+
+
+class Popularidad(models.Model):
+    producto = models.OneToOneField(
+        Producto, on_delete=models.CASCADE, primary_key=True, related_name="popularidad"
+    )
+    unidades_7 = models.PositiveIntegerField(default=0)
+    unidades_30 = models.PositiveIntegerField(default=0)
+    unidades_90 = models.PositiveIntegerField(default=0)
+    # unidades de los últimos 90 días con decaimiento exponencial por antigüedad
+    puntuacion = models.FloatField(default=0)
+    calculado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Popularidad"
+        verbose_name_plural = "Popularidad"
+        indexes = [
+            # orden "más vendidos" del catálogo (ver popularidad.anotar)
+            models.Index(fields=["-puntuacion", "-producto"]),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_id}: {self.puntuacion:.2f}"
+
+
+class CompraConjunta(models.Model):
+    """
+    "Comprados juntos": los k productos que más veces aparecen en el mismo
+    pedido que `producto`, en orden (`posicion` 0 = el más frecuente).
+    La reconstruye entera el comando calcular_compras_conjuntas.
+    """
+    producto = models.ForeignKey(
+        Producto, on_delete=models.CASCADE, related_name="compras_conjuntas"
+    )
+    companero = models.ForeignKey(
+        Producto, on_delete=models.CASCADE, related_name="comprado_con"
+    )
+    veces = models.PositiveIntegerField()
+    posicion = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ("producto", "posicion")
+        verbose_name = "Compra conjunta"
+        verbose_name_plural = "Compras conjuntas"
+
+    def __str__(self):
+        return f"{self.producto_id} + {self.companero_id} ({self.veces})"
+
+
+class HistogramaPrecio(models.Model):
+    """
+    Cuántos productos activos hay en cada tramo de precio, por categoría
+    propia y marca. Es lo que pinta el filtro de precio del catálogo sin
+    agregar Producto.precio en cada petición. Lo mantienen las señales de
+    Producto (ver histograma.py).
+    """
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE, related_name="+")
+    marca = models.ForeignKey(Marca, null=True, blank=True, on_delete=models.CASCADE, related_name="+")
+    tramo = models.PositiveSmallIntegerField()
+    productos = models.IntegerField(default=0)
+
+    class Meta:
+        # Con unique_together las filas sin marca no chocarían (NULL <> NULL)
+        constraints = [
+            models.UniqueConstraint(
+                fields=["categoria", "marca", "tramo"], condition=models.Q(marca__isnull=False),
+                name="histograma_cat_marca_tramo_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["categoria", "tramo"], condition=models.Q(marca__isnull=True),
+                name="histograma_cat_sin_marca_tramo_uniq",
+            ),
+        ]
+        verbose_name = "Histograma de precios"
+        verbose_name_plural = "Histograma de precios"
+
+    def __str__(self):
+        return f"{self.categoria_id}/{self.marca_id} tramo {self.tramo}: {self.productos}"
+
+
+class ReglaPrecio(models.Model):
+    """
+    Recargo de personalización. Las reglas se agrupan por ámbito (un producto,
+    una categoría, un `tipo` que manda el formulario de personalización o,
+    sin ninguno, las reglas generales) y el grupo más concreto sustituye a
+    los demás: producto > tipo > categoría > generales.
+
+    Las de una categoría valen también para sus subcategorías. Una categoría
+    raíz nueva (p. ej. otra de pantalones) no hereda nada: necesita sus
+    propias reglas, o que el formulario mande el `tipo` (la ficha manda
+    "pantalon" a los productos con selector de estilo).
+
+    Se compilan en memoria (ver precios.py); calcular_precio no las
+    consulta en cada llamada.
+    """
+
+    CONCEPTOS = [
+        ("estilo", "Estilo (uno de los valores)"),
+        ("texto", "Texto"),
+        ("color", "Color de texto (salvo los valores)"),
+        ("textura", "Textura / imagen"),
+    ]
+    RECARGOS = [
+        ("nombre", "Precio personalización nombre"),
+        ("color", "Precio personalización color"),
+        ("textura", "Precio personalización textura"),
+    ]
+
+    producto = models.ForeignKey(
+        Producto, null=True, blank=True, on_delete=models.CASCADE, related_name="reglas_precio"
+    )
+    categoria = models.ForeignKey(
+        Categoria, null=True, blank=True, on_delete=models.CASCADE, related_name="reglas_precio"
+    )
+    tipo = models.CharField(max_length=40, blank=True)
+    concepto = models.CharField(max_length=20, choices=CONCEPTOS)
+    valores = models.CharField(
+        max_length=200,
+        blank=True,
+        help_text="Separados por comas. Estilo: los que llevan recargo; color: los que no.",
+    )
+    recargo = models.CharField(
+        max_length=20,
+        choices=RECARGOS,
+        help_text="Campo del producto que da el importe.",
+    )
+    importe = models.DecimalField(
+        max_digits=8,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text="Importe fijo (si se indica, sustituye al del producto).",
+    )
+    solo_personalizables = models.BooleanField(
+        default=True, help_text="Solo en productos con permite_personalizacion."
+    )
+    activa = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ["pk"]
+        verbose_name = "Regla de precio"
+        verbose_name_plural = "Reglas de precio"
+
+    def clean(self):
+        if sum(bool(x) for x in (self.producto_id, self.categoria_id, self.tipo)) > 1:
+            raise ValidationError("Una regla se aplica a un producto, a una categoría o a un tipo, no a varios.")
+
+    def __str__(self):
+        ambito = (
+            f"producto {self.producto_id}" if self.producto_id
+            else f"categoría {self.categoria_id}" if self.categoria_id
+            else f"tipo {self.tipo}" if self.tipo
+            else "general"
+        )
+        return f"{ambito}: {self.concepto} -> {self.recargo}"
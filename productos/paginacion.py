@@ -0,0 +1,194 @@
+"""
+Paginación por cursor (keyset) del catálogo.
+
+En vez de OFFSET, cada página se pide "a partir de" la clave de ordenación del
+último (o primer) producto visto, así que la página 500 cuesta lo mismo que la
+primera: la base de datos entra por el índice directamente en ese punto.
+
+Los cursores van firmados y llevan la firma de los filtros con los que se
+generaron; si alguien cambia los filtros y reutiliza el cursor, se ignora y se
+vuelve a la primera página.
+"""
+import hashlib
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+
+SAL_CURSOR = "productos.paginacion.cursor"
+
+# Orden por defecto: el de Producto.Meta, con el id como desempate estable.
+ORDEN_NOVEDAD = ("-creado", "-id")
+
+# Valores de ?orden= en el catálogo. Cada uno tiene su índice compuesto en
+# Producto.Meta; si se añade uno aquí, hay que añadir también el índice.
+ORDENES = {
+    "novedad": ORDEN_NOVEDAD,
+    "precio": ("precio", "id"),
+    "-precio": ("-precio", "-id"),
+    "nombre": ("nombre", "id"),
+    # necesita popularidad.anotar() sobre el queryset (índice en Popularidad)
+    "vendidos": ("-puntuacion", "-popularidad_pk"),
+}
+
+
+def orden(valor: str):
+    """(nombre, campos) del orden pedido; el de novedad si no es válido."""
+    if valor in ORDENES:
+        return valor, ORDENES[valor]
+    return "novedad", ORDEN_NOVEDAD
+
+
+def por_pagina() -> int:
+    return int(getattr(settings, "CATALOGO_POR_PAGINA", 24))
+
+
+def firma_filtros(filtros: dict) -> str:
+    datos = json.dumps(
+        {k: v for k, v in sorted(filtros.items()) if v}, sort_keys=True, default=str
+    )
+    return hashlib.sha1(datos.encode("utf-8")).hexdigest()[:16]
+
+
+def crear_cursor(filtros: dict, **datos) -> str:
+    return signing.dumps({"f": firma_filtros(filtros), **datos}, salt=SAL_CURSOR)
+
+
+def leer_cursor(token: str, filtros: dict):
+    """Devuelve el contenido del cursor o None si no es válido para estos filtros."""
+    if not token:
+        return None
+    try:
+        datos = signing.loads(token, salt=SAL_CURSOR)
+    except signing.BadSignature:
+        return None
+    if not isinstance(datos, dict) or datos.get("f") != firma_filtros(filtros):
+        return None
+    return datos
+
+
+def url_pagina(request, token) -> str:
+    """URL de la página del cursor conservando el resto de parámetros (filtros)."""
+    if not token:
+        return ""
+    params = request.GET.copy()
+    params["cursor"] = token
+    return f"{request.path}?{params.urlencode()}"
+
+
+# ------------------------------------------------------------------
+#  Keyset sobre un queryset
+# ------------------------------------------------------------------
+
+def _serializar(valor):
+    if isinstance(valor, datetime):
+        return {"t": "dt", "v": valor.isoformat()}
+    if isinstance(valor, Decimal):
+        return {"t": "dec", "v": str(valor)}
+    return valor
+
+
+def _deserializar(valor):
+    if isinstance(valor, dict):
+        if valor.get("t") == "dt":
+            return datetime.fromisoformat(valor["v"])
+        if valor.get("t") == "dec":
+            return Decimal(valor["v"])
+    return valor
+
+
+def _clave(obj, orden) -> list:
+    return [_serializar(getattr(obj, campo.lstrip("-"))) for campo in orden]
+
+
+def _despues_de(orden, clave, invertir=False) -> Q:
+    """
+    Condición "viene después de `clave`" para el orden dado, expandida como
+    (a > x) OR (a = x AND b > y) OR ... respetando la dirección de cada campo.
+
+    Va precedida de la cota inclusiva a >= x: el OR por sí solo no le dice al
+    planificador dónde empezar y recorre el índice desde el principio; con la
+    cota entra directamente por x (SEARCH ... (a>?)) y la página N cuesta lo
+    mismo que la primera.
+    """
+    condicion = Q()
+    iguales = {}
+    for campo, valor in zip(orden, clave):
+        nombre = campo.lstrip("-")
+        descendente = campo.startswith("-") != invertir
+        lookup = f"{nombre}__lt" if descendente else f"{nombre}__gt"
+        condicion |= Q(**iguales, **{lookup: valor})
+        iguales[nombre] = valor
+    if not orden:
+        return condicion
+    primero = orden[0]
+    descendente = primero.startswith("-") != invertir
+    cota = f"{primero.lstrip('-')}__{'lte' if descendente else 'gte'}"
+    return Q(**{cota: clave[0]}) & condicion
+
+
+def _invertido(orden) -> list:
+    return [c[1:] if c.startswith("-") else f"-{c}" for c in orden]
+
+
+def paginar_keyset(qs, token: str, filtros: dict, orden=ORDEN_NOVEDAD, tam=None) -> dict:
+    """
+    Devuelve {"items": [...], "siguiente": token|None, "anterior": token|None}.
+
+    `orden` debe acabar en un campo único (el id) para que el corte sea exacto.
+    """
+    tam = tam or por_pagina()
+    cursor = leer_cursor(token, filtros)
+    orden = list(orden)
+
+    if cursor is None:
+        items = list(qs.order_by(*orden)[: tam + 1])
+        hay_siguiente, hay_anterior = len(items) > tam, False
+        items = items[:tam]
+    else:
+        clave = [_deserializar(v) for v in cursor["k"]]
+        if cursor.get("d") == "a":
+            filas = list(
+                qs.filter(_despues_de(orden, clave, invertir=True))
+                .order_by(*_invertido(orden))[: tam + 1]
+            )
+            hay_anterior, hay_siguiente = len(filas) > tam, True
+            items = list(reversed(filas[:tam]))
+        else:
+            filas = list(qs.filter(_despues_de(orden, clave)).order_by(*orden)[: tam + 1])
+            hay_siguiente, hay_anterior = len(filas) > tam, True
+            items = filas[:tam]
+
+    return {
+        "items": items,
+        "siguiente": crear_cursor(filtros, d="s", k=_clave(items[-1], orden))
+        if items and hay_siguiente else None,
+        "anterior": crear_cursor(filtros, d="a", k=_clave(items[0], orden))
+        if items and hay_anterior else None,
+    }
+
+
+# ------------------------------------------------------------------
+#  Lista de ids ya ordenada (resultados de búsqueda por relevancia)
+# ------------------------------------------------------------------
+
+def paginar_ids(ids: list, token: str, filtros: dict, tam=None) -> dict:
+    """
+    Igual que paginar_keyset pero sobre una lista de ids ya ordenada por
+    relevancia: la clave es la posición dentro de la lista.
+    """
+    tam = tam or por_pagina()
+    cursor = leer_cursor(token, filtros)
+    inicio = 0
+    if cursor is not None:
+        inicio = max(0, int(cursor.get("p", 0)))
+    trozo = ids[inicio: inicio + tam]
+    fin = inicio + len(trozo)
+    return {
+        "ids": trozo,
+        "siguiente": crear_cursor(filtros, p=fin) if fin < len(ids) else None,
+        "anterior": crear_cursor(filtros, p=max(0, inicio - tam)) if inicio > 0 else None,
+    }
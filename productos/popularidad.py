@@ -0,0 +1,268 @@
+"""
+Ranking de "más vendidos" a partir de las líneas de pedido.
+
+Calcularlo en cada página obligaría a agregar todo ``PedidoItem``. En su lugar
+el comando ``actualizar_popularidad`` (programado, p. ej. cada hora):
+
+1. Lleva a ``VentaDiaria`` los pedidos cambiados (``Pedido.actualizado``)
+   desde la última pasada, agrupados por producto y día del pedido: suma los
+   confirmados que aún no estaban (``PedidoContado``) y resta los que se han
+   cancelado.
+2. Recalcula ``Popularidad`` con las ventas diarias de los últimos 90 días:
+   unidades a 7/30/90 días y una puntuación con decaimiento exponencial
+   (``POPULARIDAD_VIDA_MEDIA_DIAS``). Solo de los productos cuyas ventas han
+   cambiado, salvo en la primera pasada del día, que envejece todas.
+
+El catálogo ordena por ``Popularidad.puntuacion`` con un join indexado.
+Los pedidos cancelados y los de tarjeta sin cobrar no cuentan.
+
+Cada recálculo avanza ``version()``, que usa el ETag de la API para que el
+orden "vendidos" no se quede en un 304 antiguo.
+"""
+import math
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import PedidoContado, Popularidad, Producto, ProgresoTarea, VentaDiaria
+
+TAREA = "popularidad"
+TAREA_DIA = "popularidad:dia"
+VENTANAS = (7, 30, 90)
+TAM_LOTE = 1000
+CLAVE_VERSION = "popularidad:version"
+
+
+def vida_media() -> float:
+    return float(getattr(settings, "POPULARIDAD_VIDA_MEDIA_DIAS", 14))
+
+
+def _avanzar_version() -> None:
+    cache.set(CLAVE_VERSION, time.time_ns(), None)
+
+
+def version() -> int:
+    valor = cache.get(CLAVE_VERSION)
+    if valor is None:
+        cache.add(CLAVE_VERSION, time.time_ns(), None)
+        valor = cache.get(CLAVE_VERSION)
+    return valor
+
+
+def margen() -> int:
+    return int(getattr(settings, "POPULARIDAD_MARGEN_SEGUNDOS", 60 * 10))
+
+
+def _inicio_ventana(hoy):
+    return hoy - timedelta(days=max(VENTANAS) - 1)
+
+
+def confirmados(pedidos):
+    """Los que cuentan como venta: no cancelados y, con tarjeta, ya cobrados."""
+    return pedidos.exclude(estado="cancelado").exclude(
+        Q(pago_metodo="tarjeta") & ~Q(pago_estado="pagado")
+    )
+
+
+def _lotes(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), TAM_LOTE):
+        yield ids[i:i + TAM_LOTE]
+
+
+def _sumar_lineas(sumas, pedido_ids, signo) -> int:
+    from pedidos.models import PedidoItem
+
+    tratadas = 0
+    for lote in _lotes(pedido_ids):
+        filas = (
+            PedidoItem.objects.filter(pedido_id__in=lote)
+            .annotate(dia=TruncDate("pedido__created_at"))
+            .values("producto_id", "dia")
+            .annotate(unidades=Sum("cantidad"), lineas=Count("id"))
+            .order_by()
+        )
+        for f in filas:
+            tratadas += f["lineas"]
+            sumas[(f["producto_id"], f["dia"])] += signo * f["unidades"]
+    return tratadas
+
+
+@transaction.atomic
+def acumular_ventas(hoy=None) -> tuple:
+    """
+    Lleva a VentaDiaria los pedidos que han cambiado desde la última pasada.
+    Devuelve cuántas líneas ha tratado y el conjunto de productos cuyas ventas
+    han cambiado.
+
+    Solo se miran los pedidos con ``actualizado`` posterior a ``hasta`` de la
+    pasada anterior. PedidoContado apunta cuáles están ya sumados: de esos
+    pedidos se suman los confirmados que aún no lo están (un pago con tarjeta
+    cuenta cuando se cobra, no al crear el pedido) y se restan los sumados que
+    ya no están confirmados (cancelados después). Un pedido borrado no se resta:
+    sus líneas se van con él. Los cambios de los últimos
+    ``POPULARIDAD_MARGEN_SEGUNDOS`` esperan a la siguiente pasada: así no se
+    cuenta un pedido a medio crear ni se salta el de una transacción que
+    confirma después de que otra más reciente haya movido la marca.
+    """
+    from pedidos.models import Pedido
+
+    hoy = hoy or timezone.localdate()
+    inicio = _inicio_ventana(hoy)
+    corte = timezone.now() - timedelta(seconds=margen())
+    # La fila de ProgresoTarea hace de cerrojo: una sola pasada a la vez
+    progreso, _ = ProgresoTarea.objects.select_for_update().get_or_create(tarea=TAREA)
+
+    cambiados = Pedido.objects.filter(created_at__date__gte=inicio, actualizado__lte=corte)
+    if progreso.hasta is not None:
+        cambiados = cambiados.filter(actualizado__gt=progreso.hasta)
+    nuevos, anulados = [], []
+    for lote in _lotes(cambiados.values_list("pk", flat=True).order_by("pk")):
+        ok = dict(confirmados(Pedido.objects.filter(pk__in=lote)).values_list("pk", "created_at"))
+        sumados = set(PedidoContado.objects.filter(pedido_id__in=lote).values_list("pedido_id", flat=True))
+        nuevos += [(pk, creado) for pk, creado in ok.items() if pk not in sumados]
+        anulados += [pk for pk in sumados if pk not in ok]
+
+    progreso.hasta = corte
+    progreso.save(update_fields=["hasta", "actualizado"])
+    if not nuevos and not anulados:
+        return 0, set()
+
+    sumas = defaultdict(int)
+    tratadas = _sumar_lineas(sumas, [pk for pk, _ in nuevos], 1)
+    tratadas += _sumar_lineas(sumas, anulados, -1)
+
+    # Las líneas guardan producto_id a secas: el producto puede ya no existir
+    existentes = set()
+    for lote in _lotes({p for p, _ in sumas}):
+        existentes.update(Producto.objects.filter(pk__in=lote).values_list("pk", flat=True))
+    sumas = {k: v for k, v in sumas.items() if v and k[0] in existentes}
+    productos = {p for p, _ in sumas}
+    if sumas:
+        dias = {d for _, d in sumas}
+        previas = {}
+        for lote in _lotes(productos):
+            for v in VentaDiaria.objects.filter(producto_id__in=lote, dia__in=dias):
+                previas[(v.producto_id, v.dia)] = v
+        actualizar, crear = [], []
+        for (producto_id, dia), unidades in sumas.items():
+            fila = previas.get((producto_id, dia))
+            if fila is None:
+                if unidades > 0:
+                    crear.append(VentaDiaria(producto_id=producto_id, dia=dia, unidades=unidades))
+            else:
+                fila.unidades = max(0, fila.unidades + unidades)
+                actualizar.append(fila)
+        VentaDiaria.objects.bulk_create(crear, batch_size=TAM_LOTE)
+        VentaDiaria.objects.bulk_update(actualizar, ["unidades"], batch_size=TAM_LOTE)
+
+    for lote in _lotes(anulados):
+        PedidoContado.objects.filter(pedido_id__in=lote).delete()
+    PedidoContado.objects.bulk_create(
+        [PedidoContado(pedido_id=pk, dia=timezone.localdate(creado)) for pk, creado in nuevos],
+        batch_size=TAM_LOTE,
+    )
+    return tratadas, productos
+
+
+def _pasada_diaria(desde) -> set:
+    """Poda lo que sale de la ventana y devuelve los productos a recalcular."""
+    VentaDiaria.objects.filter(dia__lt=desde).delete()
+    # Lo que sale de la ventana ya no se puede restar: se olvida
+    PedidoContado.objects.filter(dia__lt=desde).delete()
+    # Las altas ya la crean (señal, importación); esto cubre lo que se haya escapado
+    faltan = Producto.objects.filter(popularidad__isnull=True).values_list("pk", flat=True)
+    for lote in _lotes(faltan):
+        Popularidad.objects.bulk_create([Popularidad(producto_id=pk) for pk in lote], ignore_conflicts=True)
+    # Los que tienen ventas en la ventana y los que hay que dejar a cero
+    productos = set(VentaDiaria.objects.values_list("producto_id", flat=True).distinct())
+    productos.update(
+        Popularidad.objects.filter(Q(puntuacion__gt=0) | Q(unidades_90__gt=0)).values_list("producto_id", flat=True)
+    )
+    return productos
+
+
+@transaction.atomic
+def recalcular(hoy=None, productos=None) -> int:
+    """
+    Reescribe Popularidad de `productos` (por defecto, todos los que tienen o
+    han tenido ventas en la ventana). Devuelve cuántos ha recalculado.
+
+    Las edades se cuentan en días, así que la puntuación de un producto sin
+    ventas nuevas solo cambia al cambiar de día: la primera pasada de cada día
+    recalcula todos los que tienen ventas y las siguientes solo los que
+    acumular_ventas() ha tocado.
+    """
+    hoy = hoy or timezone.localdate()
+    desde = _inicio_ventana(hoy)
+    dia = timezone.make_aware(datetime.combine(hoy, datetime.min.time()))
+    progreso, _ = ProgresoTarea.objects.select_for_update().get_or_create(tarea=TAREA_DIA)
+    diaria = productos is None or progreso.hasta != dia
+    if diaria:
+        productos = _pasada_diaria(desde)
+        progreso.hasta = dia
+        progreso.save(update_fields=["hasta", "actualizado"])
+    elif not productos:
+        return 0
+
+    lam = math.log(2) / vida_media()
+    for lote in _lotes(sorted(productos)):
+        datos = {pk: {"unidades_7": 0, "unidades_30": 0, "unidades_90": 0, "puntuacion": 0.0} for pk in lote}
+        ventas = VentaDiaria.objects.filter(producto_id__in=lote, dia__gte=desde).values_list(
+            "producto_id", "dia", "unidades"
+        )
+        for producto_id, dia_venta, unidades in ventas:
+            edad = (hoy - dia_venta).days
+            d = datos[producto_id]
+            for ventana in VENTANAS:
+                if edad < ventana:
+                    d[f"unidades_{ventana}"] += unidades
+            d["puntuacion"] += unidades * math.exp(-lam * edad)
+        Popularidad.objects.bulk_create(
+            [Popularidad(producto_id=pk, **d) for pk, d in datos.items()],
+            update_conflicts=True,
+            unique_fields=["producto"],
+            update_fields=["unidades_7", "unidades_30", "unidades_90", "puntuacion", "calculado"],
+        )
+    # Como catalogo.invalidar: ya para este proceso y otra vez al confirmar
+    _avanzar_version()
+    transaction.on_commit(_avanzar_version)
+    return len(productos)
+
+
+@transaction.atomic
+def actualizar(hoy=None) -> dict:
+    lineas, productos = acumular_ventas(hoy)
+    return {"lineas": lineas, "productos_recalculados": recalcular(hoy, productos)}
+
+
+# ------------------------------------------------------------------
+#  Lectura (catálogo)
+# ------------------------------------------------------------------
+
+def anotar(productos):
+    """
+    Añade `puntuacion` y `popularidad_pk` para ordenar por
+    ("-puntuacion", "-popularidad_pk"). El desempate es el id de la fila de
+    Popularidad (el mismo que el del producto) para que las dos columnas del
+    orden sean de esa tabla y la base de datos recorra su índice.
+    """
+    return productos.filter(popularidad__isnull=False).annotate(
+        puntuacion=F("popularidad__puntuacion"),
+        popularidad_pk=F("popularidad__producto_id"),
+    )
+
+
+def mas_vendidos(limite=8) -> list:
+    return list(
+        anotar(Producto.objects.filter(activo=True, popularidad__puntuacion__gt=0))
+        .select_related("categoria", "marca")
+        .order_by("-puntuacion", "-popularidad_pk")[:limite]
+    )
@@ -0,0 +1,233 @@
+"""
+Precios: reglas de recargo compiladas y cálculo en lote.
+
+Reglas
+  Las ReglaPrecio se leen de la base de datos UNA vez por proceso y se
+  compilan en diccionarios {producto_id | tipo | categoria_id: reglas}, así
+  que ``calcular_precio`` no consulta nada ni compara nombres de categoría.
+  Las reglas de una categoría valen para todo su subárbol (manda la del
+  ancestro más cercano), así que una subcategoría nueva hereda las de su
+  madre; una categoría raíz nueva no tiene ninguna hasta que se le crea.
+
+  Guardar o borrar una regla, o crear o mover una categoría, avanza una
+  versión en la caché compartida. El proceso que hace el cambio recompila en
+  el acto; los demás miran la versión como mucho cada
+  ``PRECIOS_REGLAS_COMPROBAR_SEGUNDOS``, no en cada precio (con Redis serían
+  una ida y vuelta por línea de carrito o tarjeta).
+
+Lote
+  ``precios`` carga todos los productos y todas las variantes implicadas y
+  luego llama a ``calcular_precio``: dos consultas para cualquier número de
+  líneas.
+"""
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import CategoriaCierre, Producto, ReglaPrecio, Variante
+
+CLAVE_VERSION = "precios:reglas:version"
+
+# Mismos nombres que ReglaPrecio.RECARGOS
+CAMPOS_RECARGO = {
+    "nombre": "precio_personalizacion_nombre",
+    "color": "precio_personalizacion_color",
+    "textura": "precio_personalizacion_textura",
+}
+
+_lock = threading.Lock()
+_tabla = None
+_version = None
+_comprobar_en = 0.0
+
+
+# ------------------------------------------------------------------
+#  Reglas compiladas
+# ------------------------------------------------------------------
+
+def comprobar_cada() -> float:
+    return float(getattr(settings, "PRECIOS_REGLAS_COMPROBAR_SEGUNDOS", 5))
+
+
+def _avanzar() -> None:
+    cache.set(CLAVE_VERSION, time.time_ns(), None)
+
+
+def invalidar() -> None:
+    """Fuerza la recompilación en todos los procesos (lo llaman las señales)."""
+    global _tabla
+    # Como catalogo.invalidar: ya y otra vez al confirmar, para que otro
+    # proceso que recompile entre medias con los datos de antes no se quede
+    # con la versión buena.
+    _avanzar()
+    transaction.on_commit(_avanzar)
+    with _lock:
+        _tabla = None
+
+
+def _heredar(por_categoria: dict) -> dict:
+    """Extiende las reglas de cada categoría a su subárbol; gana el ancestro más cercano."""
+    if not por_categoria:
+        return {}
+    heredadas = {}
+    filas = (
+        CategoriaCierre.objects.filter(ancestro_id__in=list(por_categoria))
+        .order_by("-profundidad")
+        .values_list("descendiente_id", "ancestro_id")
+    )
+    for descendiente, ancestro in filas:
+        heredadas[descendiente] = por_categoria[ancestro]
+    return heredadas
+
+
+def _compilar() -> dict:
+    tabla = {"producto": {}, "tipo": {}, "categoria": {}, "general": ()}
+    generales = []
+    for r in ReglaPrecio.objects.filter(activa=True).order_by("pk"):
+        regla = (
+            r.concepto,
+            frozenset(v.strip().lower() for v in r.valores.split(",") if v.strip()),
+            CAMPOS_RECARGO[r.recargo],
+            r.importe,
+            r.solo_personalizables,
+        )
+        if r.producto_id:
+            tabla["producto"].setdefault(r.producto_id, []).append(regla)
+        elif r.tipo:
+            tabla["tipo"].setdefault(r.tipo.lower(), []).append(regla)
+        elif r.categoria_id:
+            tabla["categoria"].setdefault(r.categoria_id, []).append(regla)
+        else:
+            generales.append(regla)
+    for ambito in ("producto", "tipo", "categoria"):
+        tabla[ambito] = {k: tuple(v) for k, v in tabla[ambito].items()}
+    tabla["categoria"] = _heredar(tabla["categoria"])
+    tabla["general"] = tuple(generales)
+    return tabla
+
+
+def version() -> int:
+    """Versión actual de las reglas (cambia al guardar o borrar una)."""
+    valor = cache.get(CLAVE_VERSION)
+    if valor is None:
+        cache.add(CLAVE_VERSION, time.time_ns(), None)
+        valor = cache.get(CLAVE_VERSION)
+    return valor
+
+
+def tabla() -> dict:
+    global _tabla, _version, _comprobar_en
+    ahora = time.monotonic()
+    actual = _tabla
+    if actual is not None and ahora < _comprobar_en:
+        return actual
+    version_actual = version()
+    if actual is None or version_actual != _version:
+        actual = _compilar()
+        with _lock:
+            _tabla, _version = actual, version_actual
+    _comprobar_en = ahora + comprobar_cada()
+    return actual
+
+
+def reglas_de(producto, tipo: str = "") -> tuple:
+    """Grupo de reglas que aplica: producto > tipo > categoría > generales."""
+    t = tabla()
+    return (
+        t["producto"].get(producto.pk)
+        or (tipo and t["tipo"].get(tipo))
+        or t["categoria"].get(producto.categoria_id)
+        or t["general"]
+    )
+
+
+def _cumple(concepto, valores, pers) -> bool:
+    if concepto == "estilo":
+        return str(pers.get("estilo") or "estandar").lower() in valores
+    if concepto == "texto":
+        return bool(pers.get("texto"))
+    if concepto == "color":
+        color = str(pers.get("color_texto") or "").strip().lower()
+        return bool(color) and color not in valores
+    if concepto == "textura":
+        # preview_url es la señal de que se subió imagen/textura
+        return bool(pers.get("preview_url"))
+    return False
+
+
+def recargo(producto, personalizacion) -> Decimal:
+    """Suma de los recargos de personalización de `producto`."""
+    pers = personalizacion or {}
+    total = Decimal(0)
+    tipo = str(pers.get("tipo") or "").lower()
+    for concepto, valores, campo, importe, solo_personalizables in reglas_de(producto, tipo):
+        if solo_personalizables and not producto.permite_personalizacion:
+            continue
+        if _cumple(concepto, valores, pers):
+            total += Decimal(importe if importe is not None else getattr(producto, campo) or 0)
+    return total
+
+
+# ------------------------------------------------------------------
+#  Lote
+# ------------------------------------------------------------------
+
+
+def _a_int(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def precios(lineas, solo_activos=True) -> list:
+    """
+    `lineas`: iterable de (producto_id, variante_id | None, personalizacion | None).
+
+    Devuelve los precios unitarios (Decimal) en el mismo orden; None para las
+    líneas cuyo producto no existe (o no está activo) o cuya variante no es
+    de ese producto.
+    """
+    lineas = [(_a_int(p), _a_int(v), pers) for p, v, pers in lineas]
+
+    productos = Producto.objects.all()
+    if solo_activos:
+        productos = productos.filter(activo=True)
+    productos = productos.in_bulk({p for p, _, _ in lineas if p is not None})
+
+    ids_variantes = {v for _, v, _ in lineas if v is not None}
+    variantes = Variante.objects.in_bulk(ids_variantes) if ids_variantes else {}
+
+    resultado = []
+    for producto_id, variante_id, pers in lineas:
+        producto = productos.get(producto_id)
+        variante = variantes.get(variante_id) if variante_id is not None else None
+        if producto is None or (
+            variante_id is not None and (variante is None or variante.producto_id != producto_id)
+        ):
+            resultado.append(None)
+            continue
+        pers = pers if isinstance(pers, dict) else {}
+        resultado.append(producto.calcular_precio(variante=variante, personalizacion=pers))
+    return resultado
+
+
+def desde(productos) -> dict:
+    """
+    {producto_id: precio más bajo sin personalizar} de los productos cuyas
+    variantes tienen distinto precio (el "desde X €" del catálogo). Los demás
+    no aparecen: su precio es el de siempre.
+
+    No consulta Variante: el rango de extra_precio va en resumen_variantes
+    (ver stock.py).
+    """
+    resultado = {}
+    for p in productos:
+        rango = (p.resumen_variantes or {}).get("extra_precio")
+        if rango:
+            resultado[p.pk] = p.calcular_precio(variante=Variante(extra_precio=Decimal(rango[0])))
+    return resultado
@@ -0,0 +1,236 @@
+"""
+"Comprados juntos": co-ocurrencia de productos en un mismo pedido.
+
+``calcular`` se ejecuta fuera de línea (comando calcular_compras_conjuntas)
+con memoria acotada por ``RECOMENDACIONES_MAX_PARES``, sea cual sea el
+número de líneas de pedido o de pares distintos:
+
+1. Recorre ``PedidoItem`` ordenado por pedido, por trozos, y saca los pares
+   de cada pedido como claves ``i * n + j`` (posiciones de los productos en
+   el array ordenado de ids). Cada trozo se reduce con ``np.unique``; cuando
+   los trozos reducidos pasan del límite se fusionan y se vuelcan a disco
+   como un tramo ordenado, y se empieza de cero.
+2. Fusiona los tramos una sola vez, por bloques de productos ``i``: con
+   ``searchsorted`` sobre los ficheros mapeados en memoria se elige el
+   bloque más grande cuyos pares caben en el límite, se suman sus cuentas y
+   se guardan los ``k`` compañeros más frecuentes de cada producto del bloque
+   en ``CompraConjunta`` antes de pasar al siguiente.
+
+La ficha y el carrito los leen con una consulta.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import CompraConjunta, Producto
+
+# Pedidos enormes (mayoristas, pruebas) generarían m² pares y dicen poco
+MAX_PRODUCTOS_POR_PEDIDO = 50
+
+
+def top_k() -> int:
+    return int(getattr(settings, "RECOMENDACIONES_TOP_K", 8))
+
+
+def max_pares() -> int:
+    return int(getattr(settings, "RECOMENDACIONES_MAX_PARES", 5_000_000))
+
+
+def _pares_pedido(np, producto_ids, ids, n):
+    """Claves i*n+j de todos los pares ordenados (i != j) de un pedido."""
+    pks = np.unique(np.asarray(producto_ids, dtype=np.int64))
+    idx = np.searchsorted(ids, pks)
+    # el producto puede haberse borrado
+    idx = idx[(idx < len(ids)) & (ids[np.minimum(idx, len(ids) - 1)] == pks)]
+    if len(idx) < 2:
+        return None
+    if len(idx) > MAX_PRODUCTOS_POR_PEDIDO:
+        idx = idx[:MAX_PRODUCTOS_POR_PEDIDO]
+    i = np.repeat(idx, len(idx))
+    j = np.tile(idx, len(idx))
+    distintos = i != j
+    return i[distintos] * n + j[distintos]
+
+
+def _reducir(np, claves, cuentas):
+    unicas, inverso = np.unique(claves, return_inverse=True)
+    return unicas, np.bincount(inverso, weights=cuentas).astype(np.int64)
+
+
+def _top_k(np, claves, cuentas, n, k):
+    i, j = claves // n, claves % n
+    orden = np.lexsort((j, -cuentas, i))
+    i, j, cuentas = i[orden], j[orden], cuentas[orden]
+    # posición dentro de cada grupo de `i`
+    inicio_grupo = np.flatnonzero(np.r_[True, i[1:] != i[:-1]])
+    tam_grupo = np.diff(np.r_[inicio_grupo, len(i)])
+    posicion = np.arange(len(i)) - np.repeat(inicio_grupo, tam_grupo)
+    dentro = posicion < k
+    return i[dentro], j[dentro], cuentas[dentro], posicion[dentro]
+
+
+# ------------------------------------------------------------------
+#  Fase 1: tramos ordenados en disco
+# ------------------------------------------------------------------
+
+def _volcar_tramos(np, carpeta, ids, n, tam_trozo) -> list:
+    """Recorre las líneas de pedido y devuelve las rutas (claves, cuentas) de cada tramo."""
+    from pedidos.models import Pedido, PedidoItem
+    from .popularidad import confirmados
+
+    tramos = []
+    reducidos, pendientes = [], 0
+    trozo, pedido_actual, productos_pedido = [], None, []
+
+    def fusionar():
+        claves = np.concatenate([c for c, _ in reducidos])
+        cuentas = np.concatenate([v for _, v in reducidos])
+        return _reducir(np, claves, cuentas)
+
+    def volcar_tramo():
+        nonlocal reducidos, pendientes
+        if not reducidos:
+            return
+        claves, cuentas = fusionar()
+        base = os.path.join(carpeta, f"tramo-{len(tramos)}")
+        np.save(f"{base}-claves.npy", claves)
+        np.save(f"{base}-cuentas.npy", cuentas)
+        tramos.append((f"{base}-claves.npy", f"{base}-cuentas.npy"))
+        reducidos, pendientes = [], 0
+
+    def cerrar_pedido():
+        pares = _pares_pedido(np, productos_pedido, ids, n)
+        if pares is not None:
+            trozo.append(pares)
+
+    def volcar_trozo():
+        nonlocal pendientes
+        if not trozo:
+            return
+        claves = np.concatenate(trozo)
+        trozo.clear()
+        reducidos.append(_reducir(np, claves, np.ones(len(claves), dtype=np.int64)))
+        pendientes += len(reducidos[-1][0])
+        if pendientes > max_pares():
+            volcar_tramo()
+
+    lineas = (
+        PedidoItem.objects.filter(pedido__in=confirmados(Pedido.objects.all()))
+        .order_by("pedido_id")
+        .values_list("pedido_id", "producto_id")
+        .iterator(chunk_size=tam_trozo)
+    )
+    pedidos_en_trozo = 0
+    for pedido_id, producto_id in lineas:
+        if pedido_id != pedido_actual:
+            if pedido_actual is not None:
+                cerrar_pedido()
+                pedidos_en_trozo += 1
+                if pedidos_en_trozo >= tam_trozo:
+                    volcar_trozo()
+                    pedidos_en_trozo = 0
+            pedido_actual, productos_pedido = pedido_id, []
+        productos_pedido.append(producto_id)
+    if pedido_actual is not None:
+        cerrar_pedido()
+    volcar_trozo()
+    volcar_tramo()
+    return tramos
+
+
+# ------------------------------------------------------------------
+#  Fase 2: fusión por bloques de productos
+# ------------------------------------------------------------------
+
+def _fin_bloque(np, tramos, inicios, i0, n, limite) -> int:
+    """Mayor i1 tal que los pares con i en [i0, i1) de todos los tramos caben en `limite`."""
+    def pares(i1):
+        return sum(int(np.searchsorted(c, i1 * n)) - a for (c, _), a in zip(tramos, inicios))
+
+    bajo, alto = i0 + 1, n
+    while bajo < alto:
+        medio = (bajo + alto + 1) // 2
+        if pares(medio) <= limite:
+            bajo = medio
+        else:
+            alto = medio - 1
+    return bajo
+
+
+def calcular(tam_trozo=2000, k=None) -> int:
+    """Reconstruye CompraConjunta. Devuelve el número de filas guardadas."""
+    import numpy as np
+
+    k = k or top_k()
+    productos = np.fromiter(
+        Producto.objects.order_by("pk").values_list("pk", "activo").iterator(chunk_size=10000),
+        dtype=[("pk", np.int64), ("activo", np.bool_)],
+    )
+    ids, activo = productos["pk"], productos["activo"]
+    n = max(len(ids), 1)
+
+    guardadas = 0
+    with tempfile.TemporaryDirectory(prefix="compras-conjuntas-") as carpeta:
+        tramos = [
+            (np.load(c, mmap_mode="r"), np.load(v, mmap_mode="r"))
+            for c, v in _volcar_tramos(np, carpeta, ids, n, tam_trozo)
+        ]
+        inicios = [0] * len(tramos)
+        with transaction.atomic():
+            CompraConjunta.objects.all().delete()
+            i0 = 0
+            while tramos and i0 < n:
+                i1 = _fin_bloque(np, tramos, inicios, i0, n, max_pares())
+                fines = [int(np.searchsorted(c, i1 * n)) for c, _ in tramos]
+                claves = np.concatenate([c[a:b] for (c, _), a, b in zip(tramos, inicios, fines)])
+                cuentas = np.concatenate([v[a:b] for (_, v), a, b in zip(tramos, inicios, fines)])
+                inicios, i0 = fines, i1
+                if not len(claves):
+                    continue
+                claves, cuentas = _reducir(np, claves, cuentas)
+                # Solo se recomiendan productos que se pueden comprar
+                compra = activo[claves % n]
+                i, j, veces, posicion = _top_k(np, claves[compra], cuentas[compra], n, k)
+                CompraConjunta.objects.bulk_create(
+                    [
+                        CompraConjunta(
+                            producto_id=int(ids[a]), companero_id=int(ids[b]),
+                            veces=int(v), posicion=int(p),
+                        )
+                        for a, b, v, p in zip(i, j, veces, posicion)
+                    ],
+                    batch_size=1000,
+                )
+                guardadas += len(i)
+        del tramos  # cierra los mapas antes de borrar la carpeta
+    return guardadas
+
+
+# ------------------------------------------------------------------
+#  Lectura
+# ------------------------------------------------------------------
+
+def comprados_juntos(producto, limite=4) -> list:
+    """Compañeros de `producto`, en una consulta por el índice (producto, posicion)."""
+    return list(
+        Producto.objects.filter(comprado_con__producto=producto, activo=True)
+        .select_related("categoria", "marca")
+        .order_by("comprado_con__posicion")[:limite]
+    )
+
+
+def para_carrito(producto_ids, limite=4) -> list:
+    """Lo que más se compra junto con lo que ya hay en el carrito (una consulta)."""
+    ids = [int(pk) for pk in producto_ids]
+    if not ids:
+        return []
+    return list(
+        Producto.objects.filter(comprado_con__producto_id__in=ids, activo=True)
+        .exclude(pk__in=ids)
+        .annotate(veces_juntos=Sum("comprado_con__veces"))
+        .select_related("categoria", "marca")
+        .order_by("-veces_juntos", "-id")[:limite]
+    )
@@ -0,0 +1,103 @@
+"""
+Render de mockups fuera de la petición.
+
+``encolar`` reparte el trabajo de Pillow a un pool de procesos y devuelve al
+momento un id de trabajo; el estado vive en la caché (``mockup_job:<id>``)
+para que el endpoint de consulta lo lea sin tocar la base de datos.
+
+Con varios procesos web la caché tiene que ser compartida (Redis, ver
+settings.CACHES): el callback que marca el trabajo como listo corre en el
+proceso que lo encoló, y la consulta puede llegar a otro. Por eso con una
+caché local del proceso (LocMem, la de por defecto sin REDIS_URL) no se usa
+el pool aunque haya ``MOCKUP_WORKERS``: el trabajo sale ya terminado.
+
+``MOCKUP_WORKERS = 0`` renderiza en línea (útil en desarrollo y tests).
+"""
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+PREFIJO_CACHE = "mockup_job"
+
+PENDIENTE = "pendiente"
+LISTO = "listo"
+ERROR = "error"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def ttl() -> int:
+    return int(getattr(settings, "MOCKUP_JOB_TTL", 600))
+
+
+def cache_compartida() -> bool:
+    return not isinstance(caches["default"], (LocMemCache, DummyCache))
+
+
+def workers() -> int:
+    """Procesos del pool; 0 (en línea) si el estado no se vería desde otros procesos."""
+    if not cache_compartida():
+        return 0
+    return int(getattr(settings, "MOCKUP_WORKERS", 2))
+
+
+def _clave(job_id: str) -> str:
+    return f"{PREFIJO_CACHE}:{job_id}"
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers())
+        return _pool
+
+
+def _renderizar(base_path, texto, color, img_overlay_path, base_hash):
+    # Se ejecuta en el proceso hijo: importamos aquí para no arrastrar las
+    # vistas al cargar el módulo.
+    from .views import _generar_mockup
+
+    return _generar_mockup(
+        base_path, texto=texto, color=color,
+        img_overlay_path=img_overlay_path, base_hash=base_hash,
+    )
+
+
+def _terminar(job_id, future) -> None:
+    try:
+        url = future.result()
+    except Exception:
+        cache.set(_clave(job_id), {"estado": ERROR}, ttl())
+    else:
+        cache.set(_clave(job_id), {"estado": LISTO, "preview_url": url}, ttl())
+
+
+def estado(job_id: str):
+    """{"estado": ..., "preview_url"?: ...} o None si el trabajo no existe/caducó."""
+    return cache.get(_clave(job_id))
+
+
+def encolar(base_path, texto="", color="#ffffff", img_overlay_path=None, base_hash=None) -> str:
+    job_id = uuid4().hex
+    cache.set(_clave(job_id), {"estado": PENDIENTE}, ttl())
+    args = (base_path, texto, color, img_overlay_path, base_hash)
+
+    if workers() <= 0:
+        future = Future()
+        try:
+            future.set_result(_renderizar(*args))
+        except Exception as exc:
+            future.set_exception(exc)
+        _terminar(job_id, future)
+        return job_id
+
+    future = _get_pool().submit(_renderizar, *args)
+    future.add_done_callback(lambda f: _terminar(job_id, f))
+    return job_id
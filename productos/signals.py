@@ -0,0 +1,223 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import arbol, busqueda, catalogo, histograma, imagenes, precios, stock, sugerencias
+from .models import Categoria, Marca, Popularidad, Producto, ReglaPrecio, Variante
+
+# Campos que afectan al índice de búsqueda
+CAMPOS_BUSQUEDA = {"nombre", "descripcion", "activo"}
+
+
+def _tocar_productos(**filtro):
+    """
+    Avanza `actualizado` sin pasar por save(): es la versión que usan las
+    cachés por producto (tarjetas del catálogo, etc.).
+    """
+    Producto.objects.filter(**filtro).update(actualizado=timezone.now())
+
+
+@receiver(post_save, sender=Producto)
+def indexar_producto(sender, instance, update_fields=None, **kwargs):
+    # p.ej. save(update_fields=["stock"]) en el checkout: no hay nada que reindexar
+    if update_fields is not None and not CAMPOS_BUSQUEDA & set(update_fields):
+        return
+    busqueda.indexar([instance.pk])
+
+
+@receiver(pre_save, sender=Producto)
+def imagen_recordar(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Si la imagen es la misma que ya tiene derivados, no hace falta volver a
+    # leerla y calcular su hash en cada save() del producto
+    instance._imagen_cambiada = True
+    if raw or not instance.pk or not instance.imagen_hash or not instance.imagen_anchos:
+        return
+    if update_fields is not None and "imagen" not in update_fields:
+        return
+    if instance.imagen and not instance.imagen._committed:
+        return  # fichero recién subido
+    antes = Producto.objects.filter(pk=instance.pk).values_list("imagen", flat=True).first()
+    instance._imagen_cambiada = antes != instance.imagen.name
+
+
+@receiver(post_save, sender=Producto)
+def derivados_imagen(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and "imagen" not in update_fields):
+        return
+    if getattr(instance, "_imagen_cambiada", True):
+        imagenes.actualizar(instance)
+
+
+@receiver(post_save, sender=Producto)
+def popularidad_inicial(sender, instance, created, raw=False, **kwargs):
+    # Fila a 0 para que el orden "más vendidos" (join interno) lo incluya
+    # antes de la siguiente pasada de actualizar_popularidad
+    if created and not raw:
+        Popularidad.objects.get_or_create(producto=instance)
+
+
+@receiver(post_delete, sender=Producto)
+def desindexar_producto(sender, instance, **kwargs):
+    busqueda.desindexar([instance.pk])
+
+
+@receiver(post_save, sender=Variante)
+@receiver(post_delete, sender=Variante)
+def variante_cambiada(sender, instance, raw=False, **kwargs):
+    # Recalcula el resumen de stock del producto y, de paso, avanza su
+    # `actualizado` (invalida su tarjeta)
+    if not raw:
+        stock.recalcular([instance.producto_id])
+
+
+@receiver(pre_save, sender=Categoria)
+def categoria_recordar_padre(sender, instance, raw=False, **kwargs):
+    instance._padre_anterior_id = None
+    if raw or not instance.pk:
+        return
+    instance._padre_anterior_id = (
+        Categoria.objects.filter(pk=instance.pk).values_list("padre_id", flat=True).first()
+    )
+    if instance.padre_id != instance._padre_anterior_id and instance.padre_id:
+        if arbol.es_descendiente(instance.padre_id, instance.pk):
+            raise ValueError("Una categoría no puede colgar de sí misma ni de sus hijas.")
+
+
+@receiver(post_save, sender=Categoria)
+def categoria_guardada(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        arbol.insertar(instance)
+        # Puede heredar reglas de precio de sus ancestros
+        precios.invalidar()
+        return
+    if instance.padre_id != getattr(instance, "_padre_anterior_id", instance.padre_id):
+        arbol.mover(instance.pk, instance.padre_id)
+        precios.invalidar()
+    # Las tarjetas muestran el nombre de la categoría
+    _tocar_productos(categoria_id=instance.pk)
+
+
+@receiver(pre_delete, sender=Categoria)
+def categoria_borrandose(sender, instance, **kwargs):
+    arbol.soltar_hijas(instance.pk)
+    precios.invalidar()
+
+
+@receiver(post_save, sender=Marca)
+def marca_guardada(sender, instance, created, **kwargs):
+    if not created:
+        _tocar_productos(marca_id=instance.pk)
+
+
+# Histograma de precios del catálogo
+
+CAMPOS_HISTOGRAMA = {"precio", "activo", "categoria", "categoria_id", "marca", "marca_id"}
+_SIN_CAMBIOS = object()
+
+
+@receiver(pre_save, sender=Producto)
+def histograma_recordar(sender, instance, update_fields=None, raw=False, **kwargs):
+    instance._histograma_antes = _SIN_CAMBIOS
+    if raw or (update_fields is not None and not CAMPOS_HISTOGRAMA & set(update_fields)):
+        return
+    antes = None
+    if instance.pk:
+        antes = (
+            Producto.objects.filter(pk=instance.pk)
+            .values_list("activo", "categoria_id", "marca_id", "precio")
+            .first()
+        )
+    instance._histograma_antes = (
+        histograma.clave(Producto(activo=antes[0], categoria_id=antes[1], marca_id=antes[2], precio=antes[3]))
+        if antes else None
+    )
+
+
+@receiver(post_save, sender=Producto)
+def histograma_producto(sender, instance, raw=False, **kwargs):
+    antes = getattr(instance, "_histograma_antes", _SIN_CAMBIOS)
+    if not raw and antes is not _SIN_CAMBIOS:
+        histograma.mover(antes, histograma.clave(instance))
+
+
+@receiver(post_delete, sender=Producto)
+def histograma_borrado(sender, instance, **kwargs):
+    histograma.mover(histograma.clave(instance), None)
+
+
+@receiver(post_delete, sender=Marca)
+def histograma_marca_borrada(sender, instance, **kwargs):
+    # Sus productos se quedan sin marca con un UPDATE que no lanza señales
+    histograma.reconstruir()
+
+
+# Autocompletado del buscador (índice en memoria de este proceso)
+
+@receiver(post_save, sender=Producto)
+def sugerencias_producto(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or (update_fields is not None and not {"nombre", "slug", "activo"} & set(update_fields)):
+        return
+    sugerencias.actualizar("producto", instance)
+
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_save, sender=Marca)
+def sugerencias_categoria_marca(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sugerencias.actualizar(sender.__name__.lower(), instance)
+
+
+@receiver(post_delete, sender=Producto)
+@receiver(post_delete, sender=Categoria)
+@receiver(post_delete, sender=Marca)
+def sugerencias_borrado(sender, instance, **kwargs):
+    sugerencias.quitar(sender.__name__.lower(), instance.pk)
+
+
+@receiver(post_save, sender=ReglaPrecio)
+@receiver(post_delete, sender=ReglaPrecio)
+def regla_precio_cambiada(sender, raw=False, **kwargs):
+    # Todos los procesos recompilan la tabla de reglas en su siguiente cálculo
+    if not raw:
+        precios.invalidar()
+
+
+# Versión del catálogo (sitemap, feed). Va la última para que cuente
+# también lo que cambian los receptores de arriba (p. ej. imagen_hash).
+# Los guardados de solo stock (el checkout) no la cambian salvo que el
+# producto se agote o vuelva a haberlo: si no, cada venta regeneraría todo.
+
+CAMPOS_STOCK = {"stock", "stock_variantes", "resumen_variantes", "actualizado"}
+
+
+@receiver(pre_save, sender=Producto)
+def catalogo_recordar_agotado(sender, instance, update_fields=None, raw=False, **kwargs):
+    instance._agotado_antes = None
+    if raw or not instance.pk or update_fields is None or not set(update_fields) <= CAMPOS_STOCK:
+        return
+    antes = (
+        Producto.objects.filter(pk=instance.pk)
+        .values_list("stock", "stock_variantes", "resumen_variantes")
+        .first()
+    )
+    if antes:
+        instance._agotado_antes = Producto(
+            stock=antes[0], stock_variantes=antes[1], resumen_variantes=antes[2]
+        ).agotado
+
+
+@receiver(post_save, sender=Producto)
+@receiver(post_delete, sender=Producto)
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+@receiver(post_save, sender=Marca)
+@receiver(post_delete, sender=Marca)
+def catalogo_cambiado(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    antes = getattr(instance, "_agotado_antes", None)
+    if antes is not None and antes == instance.agotado:
+        return
+    catalogo.invalidar()
@@ -0,0 +1,292 @@
+"""
+sitemap.xml y feed de productos (formato Google Shopping) en streaming.
+
+Ninguno de los dos carga el catálogo: se recorren los productos activos con
+``values_list().iterator(chunk_size=...)`` y cada fila se escribe al fichero
+según llega. El sitemap se parte en ficheros de ``URLS_POR_FICHERO`` URLs
+(el máximo que admiten los buscadores) con un índice ``sitemap.xml`` que
+apunta a ellos.
+
+Los ficheros se guardan en disco, en una carpeta por versión (``version()``)
+y URL del sitio, y se sirven tal cual hasta que la versión cambia. Entonces las peticiones siguen sirviendo la carpeta anterior mientras
+un solo hilo (el que se queda el cerrojo en la caché) genera la nueva y borra
+las viejas; así ninguna petición recorre el catálogo, salvo la primera vez,
+cuando aún no hay nada que servir. El comando ``generar_sitemap`` (p. ej.
+desde cron) la deja generada de antemano.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.models import Count, Max, Sum
+from django.urls import reverse
+
+from . import catalogo, imagenes, renders
+from .models import Producto
+
+URLS_POR_FICHERO = 50_000
+TAM_TROZO = 2000
+
+INDICE = "sitemap.xml"
+FEED = "feed-productos.xml"
+PARTE = "sitemap-{}.xml"
+
+XMLNS_SITEMAP = "http://www.sitemaps.org/schemas/sitemap/0.9"
+XMLNS_GOOGLE = "http://base.google.com/ns/1.0"
+
+# Lo que puede tardar una generación antes de que otro la dé por perdida
+BLOQUEO_SEGUNDOS = 15 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def directorio() -> str:
+    return str(getattr(settings, "SITEMAP_DIR", "") or os.path.join(settings.MEDIA_ROOT, "sitemap"))
+
+
+def moneda_iso() -> str:
+    return getattr(settings, "MONEDA_ISO", "EUR")
+
+
+def _filas(*campos):
+    return (
+        Producto.objects.filter(activo=True)
+        .order_by("pk")
+        .values_list(*campos)
+        .iterator(chunk_size=TAM_TROZO)
+    )
+
+
+def _url_producto(base: str):
+    # Lo mismo que Producto.get_absolute_url sin un reverse() por fila
+    plantilla = reverse("productos:producto_detalle", kwargs={"slug": "__slug__"})
+    return lambda slug: base + plantilla.replace("__slug__", slug)
+
+
+# ------------------------------------------------------------------
+#  Escritura
+# ------------------------------------------------------------------
+
+def _escribir_sitemap(carpeta: str, base: str) -> int:
+    """Escribe las partes y el índice. Devuelve cuántas partes hay."""
+    url = _url_producto(base)
+    partes, en_parte, f = 0, 0, None
+    try:
+        for slug, actualizado in _filas("slug", "actualizado"):
+            if f is None or en_parte >= URLS_POR_FICHERO:
+                if f is not None:
+                    f.write("</urlset>\n")
+                    f.close()
+                partes += 1
+                en_parte = 0
+                f = open(os.path.join(carpeta, PARTE.format(partes)), "w", encoding="utf-8")
+                f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{XMLNS_SITEMAP}">\n')
+            f.write(
+                f"<url><loc>{escape(url(slug))}</loc>"
+                f"<lastmod>{actualizado.date().isoformat()}</lastmod></url>\n"
+            )
+            en_parte += 1
+        if f is not None:
+            f.write("</urlset>\n")
+    finally:
+        if f is not None:
+            f.close()
+
+    with open(os.path.join(carpeta, INDICE), "w", encoding="utf-8") as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{XMLNS_SITEMAP}">\n')
+        for n in range(1, partes + 1):
+            loc = base + reverse("productos:sitemap_parte", kwargs={"n": n})
+            f.write(f"<sitemap><loc>{escape(loc)}</loc></sitemap>\n")
+        f.write("</sitemapindex>\n")
+    return partes
+
+
+def _url_imagen(base, imagen, imagen_hash) -> str:
+    if imagen_hash:
+        ruta = default_storage.url(imagenes.ruta(imagen_hash, "ficha", "jpeg"))
+    elif imagen:
+        ruta = default_storage.url(imagen)
+    else:
+        return ""
+    return ruta if ruta.startswith(("http://", "https://")) else base + ruta
+
+
+def _escribir_feed(carpeta: str, base: str) -> None:
+    url = _url_producto(base)
+    moneda = moneda_iso()
+    with open(os.path.join(carpeta, FEED), "w", encoding="utf-8") as f:
+        f.write(
+            f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<rss version="2.0" xmlns:g="{XMLNS_GOOGLE}">\n<channel>\n'
+            f"<title>{escape(getattr(settings, 'TIENDA_NOMBRE', 'E-Clothify'))}</title>\n"
+            f"<link>{escape(base + '/')}</link>\n"
+        )
+        filas = _filas(
+            "pk", "slug", "nombre", "descripcion", "precio", "stock", "stock_variantes",
+            "resumen_variantes", "imagen", "imagen_hash", "marca__nombre",
+        )
+        for pk, slug, nombre, descripcion, precio, stock, stock_var, resumen, imagen, imagen_hash, marca in filas:
+            # Como Producto.stock_disponible
+            disponible = stock_var if (resumen or {}).get("variantes") else stock
+            partes = [
+                f"<item><g:id>{pk}</g:id>",
+                f"<title>{escape(nombre)}</title>",
+                f"<description>{escape(descripcion or nombre)}</description>",
+                f"<link>{escape(url(slug))}</link>",
+                f"<g:price>{precio} {moneda}</g:price>",
+                f"<g:availability>{'in_stock' if disponible > 0 else 'out_of_stock'}</g:availability>",
+                "<g:condition>new</g:condition>",
+            ]
+            imagen_url = _url_imagen(base, imagen, imagen_hash)
+            if imagen_url:
+                partes.append(f"<g:image_link>{escape(imagen_url)}</g:image_link>")
+            if marca:
+                partes.append(f"<g:brand>{escape(marca)}</g:brand>")
+            partes.append("</item>\n")
+            f.write("".join(partes))
+        f.write("</channel>\n</rss>\n")
+
+
+# ------------------------------------------------------------------
+#  Caché en disco
+# ------------------------------------------------------------------
+
+def version() -> int:
+    """
+    Versión con la que se nombra la carpeta. Con caché compartida es la del
+    catálogo (catalogo.py). Con una caché local cada proceso tendría la suya
+    (y el comando ``generar_sitemap`` otra), así que se saca de la base de
+    datos: el ``actualizado`` más reciente de los productos activos, cuántos
+    hay y su stock (las ventas no tocan ``actualizado``).
+    """
+    if renders.cache_compartida():
+        return catalogo.version()
+    datos = Producto.objects.filter(activo=True).aggregate(
+        ultimo=Max("actualizado"), total=Count("id"),
+        stock=Sum("stock"), stock_variantes=Sum("stock_variantes"),
+    )
+    ultimo = datos.pop("ultimo")
+    resto = int(hashlib.sha1(repr(sorted(datos.items())).encode("utf-8")).hexdigest()[:5], 16)
+    # Las cifras de delante ordenan por fecha (ver _anterior)
+    return (int(ultimo.timestamp() * 1_000_000) if ultimo else 0) * 10_000_000 + resto
+
+
+def _clave(base: str) -> str:
+    return hashlib.sha1(base.encode("utf-8")).hexdigest()[:8]
+
+
+def _carpeta(version, base: str) -> str:
+    return os.path.join(directorio(), f"{version}-{_clave(base)}")
+
+
+def _anterior(base: str):
+    """La carpeta completa más reciente de esta URL, sea de la versión que sea."""
+    sufijo = f"-{_clave(base)}"
+    try:
+        nombres = os.listdir(directorio())
+    except FileNotFoundError:
+        return None
+    versiones = []
+    for nombre in nombres:
+        version = nombre[: -len(sufijo)]
+        if nombre.endswith(sufijo) and version.isdigit():
+            ruta = os.path.join(directorio(), nombre)
+            if os.path.exists(os.path.join(ruta, INDICE)):
+                versiones.append((int(version), ruta))
+    return max(versiones)[1] if versiones else None
+
+
+def generar(base: str) -> str:
+    """
+    Devuelve la carpeta con los ficheros de la versión actual, generándolos
+    si hace falta. `base` es la URL del sitio sin barra final.
+    """
+    base = base.rstrip("/")
+    version_actual = version()
+    destino = _carpeta(version_actual, base)
+    if os.path.exists(os.path.join(destino, INDICE)):
+        return destino
+
+    raiz = directorio()
+    os.makedirs(raiz, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".generando-", dir=raiz)
+    try:
+        _escribir_sitemap(tmp, base)
+        _escribir_feed(tmp, base)
+        try:
+            os.rename(tmp, destino)
+        except OSError:
+            pass  # otro proceso lo ha generado a la vez: vale el suyo
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    # Fuera las versiones anteriores. Con caché compartida todos los procesos
+    # ven la misma versión; con la sacada de la base de datos, un proceso que
+    # aún no ve el último cambio genera una más antigua y no debe borrar la
+    # nueva, así que solo se borran las de fecha anterior.
+    compartida = renders.cache_compartida()
+    for nombre in os.listdir(raiz):
+        ruta = os.path.join(raiz, nombre)
+        otra = nombre.split("-", 1)[0]
+        if nombre.startswith(".") or otra == str(version_actual) or not os.path.isdir(ruta):
+            continue
+        if compartida or (otra.isdigit() and int(otra) < version_actual):
+            shutil.rmtree(ruta, ignore_errors=True)
+    return destino
+
+
+def _lanzar(funcion) -> None:
+    def hilo():
+        try:
+            funcion()
+        except Exception:
+            logger.exception("No se pudo generar el sitemap")
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=hilo, name="sitemap", daemon=True).start()
+
+
+def servir(base: str):
+    """
+    Para las vistas: la carpeta de la versión actual si ya está generada; si
+    no, la anterior, y un solo proceso la regenera en segundo plano. Solo
+    cuando no hay ninguna anterior se genera aquí mismo, y el resto de
+    peticiones reciben None (que lo intenten luego) en vez de generarla a la vez.
+    """
+    base = base.rstrip("/")
+    destino = _carpeta(version(), base)
+    if os.path.exists(os.path.join(destino, INDICE)):
+        return destino
+
+    anterior = _anterior(base)
+    cerrojo = f"sitemap:generando:{_clave(base)}"
+    if not cache.add(cerrojo, 1, BLOQUEO_SEGUNDOS):
+        return anterior  # ya la está generando otro
+
+    def generar_y_soltar():
+        try:
+            return generar(base)
+        finally:
+            cache.delete(cerrojo)
+
+    if anterior is None:
+        return generar_y_soltar()
+    _lanzar(generar_y_soltar)
+    return anterior
+
+
+def base_url(request=None) -> str:
+    """SITIO_URL si está configurada; si no, la del host de la petición."""
+    configurada = getattr(settings, "SITIO_URL", "")
+    if configurada or request is None:
+        return configurada.rstrip("/")
+    return request.build_absolute_uri("/").rstrip("/")
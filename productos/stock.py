@@ -0,0 +1,87 @@
+"""
+Resumen de stock de variantes desnormalizado en Producto.
+
+``Producto.stock_variantes`` (unidades disponibles sumando variantes) y
+``Producto.resumen_variantes`` (qué tallas/colores quedan) se recalculan cada
+vez que se guarda o borra una Variante, dentro de la misma transacción que el
+cambio de stock (ver Variante.save y signals.py). Así el listado sabe si algo
+está agotado sin hacer un join con Variante por tarjeta.
+
+OJO: ``Variante.objects.filter(...).update(stock=...)`` y ``bulk_create`` no
+lanzan señales; quien los use debe llamar a ``recalcular`` con los productos
+afectados.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import catalogo
+from .models import Producto, Variante
+
+
+def resumen(filas, extras=()) -> dict:
+    """
+    `filas`: iterable de (talla, color, stock) de un producto; `extras`, los
+    extra_precio de sus variantes. Si no todos son iguales se guarda el rango
+    en "extra_precio" ([mín, máx] como texto) para el "desde X €" del listado.
+    """
+    filas = list(filas)
+    con_stock = [(t, c, s) for t, c, s in filas if s > 0]
+    datos = {
+        "variantes": len(filas),
+        "con_stock": len(con_stock),
+        "tallas": sorted({t for t, _, _ in con_stock if t}),
+        "colores": sorted({c for _, c, _ in con_stock if c}),
+    }
+    extras = [Decimal(e or 0) for e in extras]
+    if extras and min(extras) != max(extras):
+        datos["extra_precio"] = [str(min(extras)), str(max(extras))]
+    return datos
+
+
+@transaction.atomic
+def recalcular(producto_ids) -> None:
+    ids = sorted({int(pk) for pk in producto_ids})
+    if not ids:
+        return
+    # Bloquea las filas de producto (en orden) para que dos pedidos
+    # simultáneos no se pisen el resumen.
+    antes = {
+        pid: (resumen_variantes, stock_var > 0)
+        for pid, stock_var, resumen_variantes in Producto.objects.select_for_update()
+        .filter(pk__in=ids).values_list("pk", "stock_variantes", "resumen_variantes")
+    }
+
+    por_producto = defaultdict(list)
+    extras = defaultdict(list)
+    for pid, talla, color, stock, extra in (
+        Variante.objects.filter(producto_id__in=ids)
+        .order_by()
+        .values_list("producto_id", "talla", "color", "stock", "extra_precio")
+    ):
+        por_producto[pid].append((talla, color, stock))
+        extras[pid].append(extra)
+
+    ahora = timezone.now()
+    nuevos = [
+        Producto(
+            pk=pid,
+            stock_variantes=sum(s for _, _, s in por_producto[pid]),
+            resumen_variantes=resumen(por_producto[pid], extras[pid]),
+            actualizado=ahora,
+        )
+        for pid in ids
+    ]
+    Producto.objects.bulk_update(
+        nuevos, ["stock_variantes", "resumen_variantes", "actualizado"], batch_size=500,
+    )
+    # Si solo han cambiado unidades (ninguna variante ni producto se ha
+    # agotado o repuesto) el catálogo sigue igual: sitemap, feed y filtros
+    # por talla/color no dependen de cuántas quedan.
+    if any(
+        pid not in antes or antes[pid] != (p.resumen_variantes, p.stock_variantes > 0)
+        for pid, p in zip(ids, nuevos)
+    ):
+        catalogo.invalidar()
@@ -0,0 +1,172 @@
+"""
+Almacén de las imágenes que suben los clientes al personalizar.
+
+Cada fichero se guarda con el sha256 de su contenido como nombre
+(``personalizados/uploads/ab/abcdef….png``), así que el mismo logo subido diez
+veces ocupa una sola vez. ``SubidaPersonalizacion`` lleva la cuenta de cuándo
+se usó por última vez; ``limpiar`` borra lo que ha pasado el TTL y no aparece
+ni en un carrito vivo ni en ``PedidoItem.personalizacion``. Ambos guardan el
+hash en ``personalizacion["subida"]`` (lo devuelve el endpoint de vista previa
+y lo pone el carrito al recibir la imagen con el formulario).
+"""
+import hashlib
+import json
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from .models import SubidaPersonalizacion
+
+CARPETA = "personalizados/uploads"
+TAM_LOTE = 500
+
+_HASH_RE = re.compile(r"\b[0-9a-f]{64}\b")
+_RUTA_RE = re.compile(re.escape(CARPETA) + r"/[^\s\"'\\]+")
+
+
+def ttl() -> timedelta:
+    return timedelta(hours=int(getattr(settings, "SUBIDAS_TTL_HORAS", 72)))
+
+
+def _hash(fichero) -> str:
+    h = hashlib.sha256()
+    for trozo in fichero.chunks():
+        h.update(trozo)
+    fichero.seek(0)
+    return h.hexdigest()
+
+
+def guardar(fichero) -> SubidaPersonalizacion:
+    """Guarda la subida (si no existía ya) y marca su último uso."""
+    h = _hash(fichero)
+    ext = os.path.splitext(fichero.name or "")[1].lower()[:10]
+    nombre = f"{CARPETA}/{h[:2]}/{h}{ext}"
+    if not default_storage.exists(nombre):
+        nombre = default_storage.save(nombre, fichero)
+    subida, creada = SubidaPersonalizacion.objects.get_or_create(
+        hash=h, defaults={"fichero": nombre, "tamano": fichero.size or 0}
+    )
+    if not creada:
+        SubidaPersonalizacion.objects.filter(pk=subida.pk).update(
+            usada=timezone.now(), fichero=nombre
+        )
+        subida.fichero = nombre
+    return subida
+
+
+# ------------------------------------------------------------------
+#  Recolección
+# ------------------------------------------------------------------
+
+def _referencias_en(texto: str, refs: set) -> None:
+    refs.update(_HASH_RE.findall(texto))
+    refs.update(os.path.basename(r) for r in _RUTA_RE.findall(texto))
+
+
+def referencias() -> set:
+    """
+    Hashes y nombres de fichero mencionados por líneas de pedido o por los
+    carritos de sesiones sin caducar. Se recorre todo con iterator(): solo el
+    conjunto de referencias vive en memoria.
+    """
+    from django.contrib.sessions.models import Session
+    from carrito.cart import CART_SESSION_ID
+    from pedidos.models import PedidoItem
+
+    refs = set()
+    lineas = (
+        PedidoItem.objects.exclude(personalizacion={})
+        .values_list("personalizacion", flat=True)
+        .iterator(chunk_size=TAM_LOTE)
+    )
+    for pers in lineas:
+        _referencias_en(json.dumps(pers, default=str), refs)
+
+    sesiones = Session.objects.filter(expire_date__gt=timezone.now()).iterator(
+        chunk_size=TAM_LOTE
+    )
+    for sesion in sesiones:
+        carrito = sesion.get_decoded().get(CART_SESSION_ID)
+        if carrito:
+            _referencias_en(json.dumps(carrito, default=str), refs)
+    return refs
+
+
+def _recorrer(ruta):
+    """Ficheros bajo `ruta`, de uno en uno (os.scandir, sin listar de golpe)."""
+    try:
+        entradas = os.scandir(ruta)
+    except FileNotFoundError:
+        return
+    with entradas:
+        for entrada in entradas:
+            if entrada.is_dir(follow_symlinks=False):
+                yield from _recorrer(entrada.path)
+            elif entrada.is_file(follow_symlinks=False):
+                yield entrada
+
+
+def limpiar(ahora=None, simular=False) -> dict:
+    """
+    Borra las subidas sin usar desde hace más de ``ttl()`` que nadie referencia,
+    y los ficheros huérfanos (sin registro, p. ej. los de nombre uuid antiguos)
+    igual de viejos. Devuelve {"registros": n, "ficheros": n, "bytes": n}.
+    """
+    corte = (ahora or timezone.now()) - ttl()
+    refs = referencias()
+    stats = {"registros": 0, "ficheros": 0, "bytes": 0}
+
+    caducadas = SubidaPersonalizacion.objects.filter(usada__lt=corte).iterator(
+        chunk_size=TAM_LOTE
+    )
+    lote = []
+    for subida in caducadas:
+        if subida.hash in refs or os.path.basename(subida.fichero) in refs:
+            continue
+        lote.append(subida.pk)
+        stats["registros"] += 1
+        stats["bytes"] += subida.tamano
+        if not simular:
+            default_storage.delete(subida.fichero)
+        if len(lote) >= TAM_LOTE:
+            if not simular:
+                SubidaPersonalizacion.objects.filter(pk__in=lote).delete()
+            lote = []
+    if lote and not simular:
+        SubidaPersonalizacion.objects.filter(pk__in=lote).delete()
+
+    # Huérfanos en disco: solo tiene sentido con almacenamiento local
+    try:
+        raiz = default_storage.path(CARPETA)
+    except NotImplementedError:
+        return stats
+    limite = corte.timestamp()
+    candidatos = []
+    for entrada in _recorrer(raiz):
+        if entrada.name in refs or entrada.stat().st_mtime >= limite:
+            continue
+        candidatos.append(entrada)
+        if len(candidatos) >= TAM_LOTE:
+            _borrar_huerfanos(candidatos, refs, stats, simular)
+            candidatos = []
+    _borrar_huerfanos(candidatos, refs, stats, simular)
+    return stats
+
+
+def _borrar_huerfanos(entradas, refs, stats, simular) -> None:
+    hashes = {os.path.splitext(e.name)[0] for e in entradas}
+    registradas = set(
+        SubidaPersonalizacion.objects.filter(hash__in=hashes).values_list("hash", flat=True)
+    )
+    for entrada in entradas:
+        h = os.path.splitext(entrada.name)[0]
+        if h in refs or h in registradas:
+            continue
+        stats["ficheros"] += 1
+        stats["bytes"] += entrada.stat().st_size
+        if not simular:
+            os.remove(entrada.path)
@@ -0,0 +1,201 @@
+"""
+Autocompletado del buscador sin tocar la base de datos.
+
+Índice en memoria (por proceso): una lista ordenada de tuplas
+``(clave, tipo, texto, url, pk)`` donde ``clave`` es el nombre normalizado
+(minúsculas, sin tildes) a partir de cada palabra, de modo que "negra"
+encuentra "Camiseta negra". Buscar un prefijo es un ``bisect`` más un
+recorrido corto mientras las claves empiecen por él.
+
+Se construye en la primera consulta del proceso (tres SELECT) y luego lo
+mantienen las señales de Producto/Categoria/Marca de este proceso, entrada a
+entrada y sobre la misma lista. Los cambios hechos en otros procesos llegan
+al reconstruirlo cada ``SUGERENCIAS_TTL`` segundos; esa reconstrucción va en
+un hilo aparte y mientras tanto se sigue sirviendo el índice anterior, así
+que ninguna consulta espera a la base de datos salvo la primera.
+"""
+import logging
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+# Orden en el que salen los resultados con la misma clave
+TIPOS = ("categoria", "marca", "producto")
+
+_lock = threading.Lock()  # protege el índice (lecturas y escrituras son cortas)
+_lock_construccion = threading.Lock()  # una sola construcción en frío a la vez
+_entradas = None  # lista ordenada de tuplas
+_por_objeto = {}  # (tipo, pk) -> [tuplas], para poder quitarlas
+_construido = 0.0
+_reconstruyendo = False
+_pendientes = []  # cambios que llegan mientras se reconstruye: (tipo, pk, tuplas | None)
+_generacion = 0  # la sube vaciar(): una reconstrucción anterior ya no vale
+
+
+def ttl() -> int:
+    return int(getattr(settings, "SUGERENCIAS_TTL", 300))
+
+
+def normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    return " ".join("".join(c for c in texto if not unicodedata.combining(c)).split())
+
+
+def _url(tipo, obj) -> str:
+    if tipo == "producto":
+        return reverse("productos:producto_detalle", kwargs={"slug": obj.slug})
+    if tipo == "categoria":
+        return reverse("productos:catalogo_por_categoria", kwargs={"slug": obj.slug})
+    return f"{reverse('productos:catalogo')}?marca={obj.slug}"
+
+
+def _tuplas(tipo, obj) -> list:
+    nombre = normalizar(obj.nombre)
+    palabras = nombre.split(" ")
+    url = _url(tipo, obj)
+    orden = TIPOS.index(tipo)
+    # una entrada por cada palabra: "camiseta negra", "negra"
+    return sorted({
+        (" ".join(palabras[i:]), orden, obj.nombre, url, obj.pk)
+        for i in range(len(palabras)) if palabras[i]
+    })
+
+
+def _leer() -> tuple:
+    from .models import Categoria, Marca, Producto
+
+    por_objeto = {}
+    fuentes = (
+        ("categoria", Categoria.objects.only("pk", "nombre", "slug")),
+        ("marca", Marca.objects.only("pk", "nombre", "slug")),
+        ("producto", Producto.objects.filter(activo=True).only("pk", "nombre", "slug")),
+    )
+    for tipo, qs in fuentes:
+        for obj in qs.iterator():
+            por_objeto[(tipo, obj.pk)] = _tuplas(tipo, obj)
+    return sorted(t for ts in por_objeto.values() for t in ts), por_objeto
+
+
+def _construir() -> None:
+    global _entradas, _por_objeto, _construido, _reconstruyendo
+    with _lock:
+        _reconstruyendo = True
+        generacion = _generacion
+    try:
+        entradas, por_objeto = _leer()
+    except Exception:
+        with _lock:
+            _reconstruyendo = False
+            _pendientes.clear()
+        raise
+    with _lock:
+        _reconstruyendo = False
+        if generacion != _generacion:
+            return  # vaciar() entre medias: lo leído puede ser anterior
+        # Lo que ha cambiado mientras se leía la base de datos
+        for tipo, pk, tuplas in _pendientes:
+            _aplicar(entradas, por_objeto, tipo, pk, tuplas)
+        _pendientes.clear()
+        _entradas, _por_objeto, _construido = entradas, por_objeto, time.monotonic()
+
+
+def _lanzar(funcion) -> None:
+    def hilo():
+        try:
+            funcion()
+        except Exception:
+            logger.exception("No se pudo reconstruir el índice de sugerencias")
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=hilo, name="sugerencias", daemon=True).start()
+
+
+def _indice() -> None:
+    """Se asegura de que hay índice; si ha caducado, lo rehace en segundo plano."""
+    global _reconstruyendo
+    if _entradas is None:
+        with _lock_construccion:
+            if _entradas is None:
+                _construir()
+        return
+    if time.monotonic() - _construido <= ttl():
+        return
+    with _lock:
+        if _reconstruyendo:
+            return
+        _reconstruyendo = True
+    _lanzar(_construir)
+
+
+def sugerir(q: str, limite: int = 8) -> list:
+    prefijo = normalizar(q)
+    if not prefijo:
+        return []
+    _indice()
+    resultados, vistos = [], set()
+    with _lock:
+        entradas = _entradas or []
+        i = bisect_left(entradas, (prefijo,))
+        while i < len(entradas) and len(resultados) < limite:
+            clave, orden, texto, url, pk = entradas[i]
+            if not clave.startswith(prefijo):
+                break
+            if (orden, pk) not in vistos:
+                vistos.add((orden, pk))
+                resultados.append({"tipo": TIPOS[orden], "texto": texto, "url": url})
+            i += 1
+    return resultados
+
+
+# ------------------------------------------------------------------
+#  Mantenimiento incremental (lo llaman las señales)
+# ------------------------------------------------------------------
+
+def _aplicar(entradas, por_objeto, tipo, pk, tuplas) -> None:
+    """Quita las tuplas de (tipo, pk) y pone `tuplas` (None: solo quitar), en el sitio."""
+    for t in por_objeto.pop((tipo, pk), []):
+        i = bisect_left(entradas, t)
+        if i < len(entradas) and entradas[i] == t:
+            del entradas[i]
+    if tuplas:
+        por_objeto[(tipo, pk)] = tuplas
+        for t in tuplas:
+            insort(entradas, t)
+
+
+def _cambiar(tipo, pk, tuplas) -> None:
+    with _lock:
+        if _reconstruyendo:
+            # El índice nuevo puede haberse leído antes de este cambio
+            _pendientes.append((tipo, pk, tuplas))
+        if _entradas is not None:
+            _aplicar(_entradas, _por_objeto, tipo, pk, tuplas)
+
+
+def actualizar(tipo: str, obj) -> None:
+    if _entradas is None and not _reconstruyendo:
+        return  # aún no construido: ya se leerá de la base de datos
+    visible = tipo != "producto" or obj.activo
+    _cambiar(tipo, obj.pk, _tuplas(tipo, obj) if visible else None)
+
+
+def quitar(tipo: str, pk) -> None:
+    if _entradas is None and not _reconstruyendo:
+        return
+    _cambiar(tipo, pk, None)
+
+
+def vaciar() -> None:
+    global _entradas, _por_objeto, _generacion
+    with _lock:
+        _entradas, _por_objeto = None, {}
+        _pendientes.clear()
+        _generacion += 1
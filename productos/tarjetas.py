@@ -0,0 +1,60 @@
+"""
+Caché de fragmentos para las tarjetas del catálogo.
+
+Cada tarjeta se guarda por separado con una clave que incluye
+``Producto.actualizado``: cualquier cambio del producto (o de sus variantes,
+categoría o marca, que "tocan" ese campo desde signals.py) genera una clave
+nueva, así que solo se rehacen las tarjetas afectadas y nunca hace falta
+vaciar la caché entera. Las claves viejas caducan solas.
+
+La clave lleva además si el producto está agotado: el checkout guarda el
+stock con ``update_fields=["stock"]``, que no toca ``actualizado``, y la
+tarjeta tiene que enseñar "Agotado" en cuanto se vende la última unidad.
+
+La rejilla se monta con un único ``get_many`` y se renderizan solo las que falten.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import precios
+
+PREFIJO_CACHE = "catalogo:tarjeta"
+PLANTILLA = "productos/_tarjeta.html"
+
+# Súbelo al cambiar _tarjeta.html para no servir HTML antiguo
+VERSION_PLANTILLA = 4
+
+
+def ttl() -> int:
+    return int(getattr(settings, "CATALOGO_TARJETAS_TTL", 60 * 60 * 24))
+
+
+def clave(producto) -> str:
+    version = producto.actualizado.timestamp() if producto.actualizado else 0
+    return f"{PREFIJO_CACHE}:{VERSION_PLANTILLA}:{producto.pk}:{version}:{int(producto.agotado)}"
+
+
+def renderizar(productos) -> list:
+    """HTML de las tarjetas, en el mismo orden que `productos`."""
+    productos = list(productos)
+    claves = [clave(p) for p in productos]
+    en_cache = cache.get_many(claves)
+
+    ctx_comun = {"MONEDA": getattr(settings, "MONEDA", "€")}
+    # "desde X €" de las que hay que pintar (sale de resumen_variantes)
+    faltan = [p for p, k in zip(productos, claves) if k not in en_cache]
+    minimos = precios.desde(faltan)
+    nuevas = {}
+    tarjetas = []
+    for p, k in zip(productos, claves):
+        html = en_cache.get(k)
+        if html is None:
+            html = render_to_string(PLANTILLA, {**ctx_comun, "p": p, "desde": minimos.get(p.pk)})
+            nuevas[k] = html
+        tarjetas.append(mark_safe(html))
+
+    if nuevas:
+        cache.set_many(nuevas, ttl())
+    return tarjetas
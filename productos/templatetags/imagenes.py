@@ -0,0 +1,17 @@
+from django import template
+
+from productos import imagenes
+
+register = template.Library()
+
+
+@register.simple_tag
+def srcset(producto, formato="webp"):
+    """{% srcset producto "webp" %} -> "…/tarjeta-400.webp 400w, …" (vacío si no hay derivados)."""
+    return imagenes.srcset(producto, formato)
+
+
+@register.simple_tag
+def imagen_url(producto, uso, formato="jpeg"):
+    """{% imagen_url producto "ficha" %} -> URL del derivado, o la original si no hay."""
+    return imagenes.url(producto, uso, formato)
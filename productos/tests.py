@@ -1,13 +1,32 @@
+import os
+import shutil
+import tempfile
+import time
 from decimal import Decimal
-from unittest.mock import patch
+from io import BytesIO
+from unittest.mock import Mock, patch
 
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.db import IntegrityError, connection, transaction
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from .models import Categoria, Marca, Producto, Variante
+from .models import (
+    Categoria, CategoriaCierre, CompraConjunta, HistogramaPrecio, Marca, Popularidad, Producto,
+    ProgresoTarea, ReglaPrecio, SubidaPersonalizacion, Variante, VentaDiaria,
+)
 from .forms import VarianteForm, PersonalizacionForm
-from . import views
+from . import (
+    bases, busqueda, cache_busqueda, catalogo, histograma, imagenes, listado, paginacion, popularidad,
+    precios, recomendaciones, renders, sitemap, subidas, sugerencias,
+)
 
 
 # =====================================================
@@ -449,3 +468,1994 @@ class PreviewPersonalizacionViewTests(TestCase):
        
         self.assertEqual(resp.status_code, 400)
 
+
+
+# =====================================================
+#   BÚSQUEDA: índice de texto completo
+# =====================================================
+
+class BusquedaTextoCompletoTests(TestCase):
+    def setUp(self):
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.otra_cat = Categoria.objects.create(nombre="Gorras")
+        self.marca = Marca.objects.create(nombre="Marca X")
+        self.en_nombre = Producto.objects.create(
+            categoria=self.cat,
+            marca=self.marca,
+            nombre="Camiseta algodón orgánico",
+            descripcion="Básica de manga corta",
+            precio=Decimal("10.00"),
+            stock=5,
+        )
+        self.en_descripcion = Producto.objects.create(
+            categoria=self.otra_cat,
+            nombre="Gorra clásica",
+            descripcion="Forro interior de algodón",
+            precio=Decimal("8.00"),
+            stock=5,
+        )
+
+    def test_busqueda_ordena_por_relevancia(self):
+        from . import busqueda
+
+        ids = busqueda.buscar_ids("algodon")
+        # sin tilde también encuentra, y el acierto en el nombre va primero
+        self.assertEqual(ids, [self.en_nombre.id, self.en_descripcion.id])
+
+    def test_busqueda_por_prefijo(self):
+        from . import busqueda
+
+        self.assertEqual(busqueda.buscar_ids("gorr"), [self.en_descripcion.id])
+
+    def test_indice_se_actualiza_al_guardar_y_borrar(self):
+        from . import busqueda
+
+        self.en_nombre.nombre = "Polo piqué"
+        self.en_nombre.save()
+        self.assertEqual(busqueda.buscar_ids("pique"), [self.en_nombre.id])
+
+        self.en_nombre.activo = False
+        self.en_nombre.save()
+        self.assertEqual(busqueda.buscar_ids("pique"), [])
+
+        self.en_descripcion.delete()
+        self.assertEqual(busqueda.buscar_ids("gorra"), [])
+
+    def test_vista_combina_busqueda_con_filtro_de_categoria(self):
+        url = reverse("productos:catalogo")
+        resp = self.client.get(url, {"q": "algodón", "categoria": self.otra_cat.slug})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            [p.id for p in resp.context["productos"]], [self.en_descripcion.id]
+        )
+
+
+    def test_avisa_si_la_busqueda_llega_al_tope(self):
+        if not busqueda.disponible():
+            self.skipTest("sin índice de texto")
+        cache_busqueda.vaciar()
+        self.addCleanup(cache_busqueda.vaciar)
+        url = reverse("productos:catalogo")
+        with self.settings(BUSQUEDA_MAX_RESULTADOS=1):
+            resp = self.client.get(url, {"q": "algodón"})
+            self.assertTrue(resp.context["pagina"]["truncado"])
+            self.assertContains(resp, "solo se muestran los más relevantes")
+            api = self.client.get(reverse("productos:api_productos"), {"q": "algodón", "orden": "precio"})
+            self.assertTrue(api.json()["truncado"])
+        cache_busqueda.vaciar()
+        resp = self.client.get(url, {"q": "algodón"})
+        self.assertFalse(resp.context["pagina"]["truncado"])
+
+# =====================================================
+#   PAGINACIÓN por cursor (keyset)
+# =====================================================
+
+@override_settings(CATALOGO_POR_PAGINA=2)
+class PaginacionCatalogoTests(TestCase):
+    def setUp(self):
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.marca = Marca.objects.create(nombre="Marca X")
+        self.productos = [
+            Producto.objects.create(
+                categoria=self.cat,
+                marca=self.marca,
+                nombre=f"Camiseta {i}",
+                precio=Decimal("10.00"),
+                stock=5,
+            )
+            for i in range(5)
+        ]
+        self.url = reverse("productos:catalogo")
+
+    def _recorrer(self, url, params=None):
+        vistos = []
+        resp = self.client.get(url, params or {})
+        while True:
+            self.assertEqual(resp.status_code, 200)
+            vistos.append([p.id for p in resp.context["productos"]])
+            siguiente = resp.context["pagina"]["siguiente_url"]
+            if not siguiente:
+                return vistos, resp
+            resp = self.client.get(siguiente)
+
+    def test_recorre_todo_el_catalogo_sin_repetir_en_orden_de_novedad(self):
+        paginas, _ = self._recorrer(self.url)
+        self.assertEqual([len(p) for p in paginas], [2, 2, 1])
+        esperados = [p.id for p in sorted(self.productos, key=lambda p: (p.creado, p.id), reverse=True)]
+        self.assertEqual(sum(paginas, []), esperados)
+
+    def test_anterior_vuelve_a_la_pagina_previa(self):
+        primera = self.client.get(self.url)
+        segunda = self.client.get(primera.context["pagina"]["siguiente_url"])
+        vuelta = self.client.get(segunda.context["pagina"]["anterior_url"])
+        self.assertEqual(
+            [p.id for p in vuelta.context["productos"]],
+            [p.id for p in primera.context["productos"]],
+        )
+        self.assertEqual(vuelta.context["pagina"]["anterior_url"], "")
+
+    def test_el_cursor_conserva_los_filtros(self):
+        paginas, ultima = self._recorrer(self.url, {"marca": self.marca.slug})
+        self.assertEqual(len(sum(paginas, [])), 5)
+        self.assertIn("marca=marca-x", ultima.context["pagina"]["anterior_url"])
+
+    def test_cursor_de_otros_filtros_se_ignora(self):
+        primera = self.client.get(self.url)
+        token = primera.context["pagina"]["siguiente"]
+        resp = self.client.get(self.url, {"marca": self.marca.slug, "cursor": token})
+        self.assertEqual(
+            [p.id for p in resp.context["productos"]],
+            [p.id for p in primera.context["productos"]],
+        )
+
+    def test_busqueda_pagina_por_relevancia(self):
+        paginas, _ = self._recorrer(self.url, {"q": "camiseta"})
+        self.assertCountEqual(sum(paginas, []), [p.id for p in self.productos])
+
+    def test_lista_por_categoria_pagina(self):
+        url = reverse("productos:catalogo_por_categoria", args=[self.cat.slug])
+        paginas, _ = self._recorrer(url)
+        self.assertEqual(len(sum(paginas, [])), 5)
+
+    @skipUnlessDBFeature("supports_partial_indexes")
+    def test_pagina_con_cursor_entra_por_el_indice(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("los planes comprobados son los de SQLite")
+        qs = Producto.objects.filter(activo=True)
+        token = paginacion.paginar_keyset(qs, "", {}, tam=2)["siguiente"]
+        clave = [paginacion._deserializar(v) for v in paginacion.leer_cursor(token, {})["k"]]
+        orden = list(paginacion.ORDEN_NOVEDAD)
+        plan = qs.filter(paginacion._despues_de(orden, clave)).order_by(*orden)[:3].explain()
+        # Entra por el punto del cursor en vez de recorrer el índice desde el principio
+        self.assertIn("SEARCH productos_producto USING INDEX prod_cat_novedad_idx (creado<?)", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+# =====================================================
+#   FACETAS: recuentos por categoría y marca
+# =====================================================
+
+class FacetasCatalogoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.camisetas = Categoria.objects.create(nombre="Camisetas")
+        self.sudaderas = Categoria.objects.create(nombre="Sudaderas")
+        self.uno = Marca.objects.create(nombre="Marca Uno")
+        self.dos = Marca.objects.create(nombre="Marca Dos")
+        for cat, marca, nombre in [
+            (self.camisetas, self.uno, "Camiseta lisa"),
+            (self.camisetas, self.dos, "Camiseta rayas"),
+            (self.sudaderas, self.uno, "Sudadera lisa"),
+            (self.sudaderas, None, "Sudadera sin marca"),
+        ]:
+            Producto.objects.create(
+                categoria=cat, marca=marca, nombre=nombre, precio=Decimal("10.00"), stock=1
+            )
+        Producto.objects.create(
+            categoria=self.sudaderas, marca=self.dos, nombre="Sudadera oculta",
+            precio=Decimal("10.00"), stock=1, activo=False,
+        )
+        self.url = reverse("productos:catalogo")
+
+    def _totales(self, lista):
+        return {f["slug"]: f["total"] for f in lista}
+
+    def test_recuentos_sin_filtros(self):
+        resp = self.client.get(self.url)
+        f = resp.context["facetas"]
+        self.assertEqual(self._totales(f["categorias"]), {"camisetas": 2, "sudaderas": 2})
+        self.assertEqual(self._totales(f["marcas"]), {"marca-uno": 2, "marca-dos": 1})
+        self.assertContains(resp, "Sudaderas (2)")
+
+    def test_cada_faceta_aplica_el_filtro_de_la_otra(self):
+        resp = self.client.get(self.url, {"q": "lisa", "marca": "marca-uno"})
+        f = resp.context["facetas"]
+        self.assertEqual(self._totales(f["categorias"]), {"camisetas": 1, "sudaderas": 1})
+        self.assertEqual(self._totales(f["marcas"]), {"marca-uno": 2})
+
+    def test_una_sola_consulta_y_cacheada(self):
+        from . import facetas
+
+        base = Producto.objects.filter(activo=True)
+        with self.assertNumQueries(1):
+            facetas.facetas(base, {"categoria": "camisetas"})
+        with self.assertNumQueries(0):
+            datos = facetas.facetas(base, {"categoria": "camisetas"})
+        self.assertEqual(self._totales(datos["marcas"]), {"marca-uno": 1, "marca-dos": 1})
+
+
+# =====================================================
+#   TARJETAS: caché de fragmentos del catálogo
+# =====================================================
+
+class TarjetasCatalogoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.p1 = Producto.objects.create(
+            categoria=self.cat, nombre="Camiseta uno", precio=Decimal("10.00"), stock=1
+        )
+        self.p2 = Producto.objects.create(
+            categoria=self.cat, nombre="Camiseta dos", precio=Decimal("12.50"), stock=0
+        )
+
+    def test_catalogo_pinta_las_tarjetas(self):
+        resp = self.client.get(reverse("productos:catalogo"))
+        self.assertContains(resp, "Camiseta uno")
+        self.assertContains(resp, "12,50")
+        self.assertContains(resp, "Agotado")
+        self.assertContains(resp, self.p1.get_absolute_url())
+
+    def test_segunda_pasada_sale_entera_de_cache(self):
+        from . import tarjetas
+
+        primeras = tarjetas.renderizar([self.p1, self.p2])
+        with patch("productos.tarjetas.render_to_string") as render:
+            segundas = tarjetas.renderizar([self.p1, self.p2])
+        render.assert_not_called()
+        self.assertEqual(primeras, segundas)
+
+    def test_guardar_variante_invalida_solo_su_tarjeta(self):
+        from . import tarjetas
+
+        clave_p1, clave_p2 = tarjetas.clave(self.p1), tarjetas.clave(self.p2)
+        tarjetas.renderizar([self.p1, self.p2])
+
+        Variante.objects.create(producto=self.p1, talla="M", color="Rojo", stock=2)
+        self.p1.refresh_from_db()
+        self.p2.refresh_from_db()
+
+        self.assertNotEqual(tarjetas.clave(self.p1), clave_p1)
+        self.assertEqual(tarjetas.clave(self.p2), clave_p2)
+        self.assertIsNotNone(cache.get(clave_p2))
+
+    def test_vender_la_ultima_unidad_pinta_agotado(self):
+        from . import tarjetas
+
+        self.assertNotIn("Agotado", tarjetas.renderizar([self.p1])[0])
+        # Como el checkout: solo el stock, sin tocar `actualizado`
+        self.p1.stock = 0
+        self.p1.save(update_fields=["stock"])
+        self.assertIn("Agotado", tarjetas.renderizar([self.p1])[0])
+
+    def test_renombrar_categoria_invalida_sus_tarjetas(self):
+        from . import tarjetas
+
+        antes = tarjetas.clave(self.p1)
+        self.cat.nombre = "Camisetas básicas"
+        self.cat.save()
+        self.p1.refresh_from_db()
+        self.assertNotEqual(tarjetas.clave(self.p1), antes)
+
+
+# =====================================================
+#   ÁRBOL DE CATEGORÍAS: tabla de cierre
+# =====================================================
+
+class ArbolCategoriasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ropa = Categoria.objects.create(nombre="Ropa")
+        self.arriba = Categoria.objects.create(nombre="Parte de arriba", padre=self.ropa)
+        self.camisetas = Categoria.objects.create(nombre="Camisetas", padre=self.arriba)
+        self.gorras = Categoria.objects.create(nombre="Gorras")
+
+    def _pares(self):
+        return set(
+            CategoriaCierre.objects.values_list(
+                "ancestro__nombre", "descendiente__nombre", "profundidad"
+            )
+        )
+
+    def test_alta_crea_filas_para_todos_los_ancestros(self):
+        self.assertEqual(
+            self._pares(),
+            {
+                ("Ropa", "Ropa", 0),
+                ("Parte de arriba", "Parte de arriba", 0),
+                ("Camisetas", "Camisetas", 0),
+                ("Gorras", "Gorras", 0),
+                ("Ropa", "Parte de arriba", 1),
+                ("Ropa", "Camisetas", 2),
+                ("Parte de arriba", "Camisetas", 1),
+            },
+        )
+
+    def test_mover_un_subarbol_solo_rehace_sus_enlaces(self):
+        self.arriba.padre = self.gorras
+        self.arriba.save()
+        pares = self._pares()
+        self.assertIn(("Gorras", "Camisetas", 2), pares)
+        self.assertIn(("Parte de arriba", "Camisetas", 1), pares)
+        self.assertNotIn(("Ropa", "Camisetas", 2), pares)
+        self.assertNotIn(("Ropa", "Parte de arriba", 1), pares)
+
+    def test_no_permite_ciclos(self):
+        self.ropa.padre = self.camisetas
+        with self.assertRaises(ValueError):
+            self.ropa.save()
+        with self.assertRaises(ValidationError):
+            self.ropa.clean()
+
+    def test_borrar_categoria_deja_a_sus_hijas_como_raiz(self):
+        self.arriba.delete()
+        self.camisetas.refresh_from_db()
+        self.assertIsNone(self.camisetas.padre)
+        self.assertEqual(
+            set(CategoriaCierre.objects.filter(descendiente=self.camisetas).values_list("ancestro__nombre", flat=True)),
+            {"Camisetas"},
+        )
+
+    def test_pagina_de_categoria_incluye_subcategorias(self):
+        camiseta = Producto.objects.create(
+            categoria=self.camisetas, nombre="Camiseta", precio=Decimal("10.00"), stock=1
+        )
+        Producto.objects.create(
+            categoria=self.gorras, nombre="Gorra", precio=Decimal("10.00"), stock=1
+        )
+        resp = self.client.get(reverse("productos:catalogo_por_categoria", args=[self.ropa.slug]))
+        self.assertEqual([p.id for p in resp.context["productos"]], [camiseta.id])
+
+        resp = self.client.get(reverse("productos:catalogo"), {"categoria": self.arriba.slug})
+        self.assertEqual([p.id for p in resp.context["productos"]], [camiseta.id])
+        totales = {f["slug"]: f["total"] for f in resp.context["facetas"]["categorias"]}
+        self.assertEqual(totales[self.ropa.slug], 1)
+        self.assertEqual(totales[self.camisetas.slug], 1)
+
+
+# =====================================================
+#   STOCK: resumen de variantes en Producto
+# =====================================================
+
+class ResumenStockVariantesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.prod = Producto.objects.create(
+            categoria=self.cat, nombre="Camiseta", precio=Decimal("10.00"), stock=0
+        )
+
+    def test_producto_sin_variantes_usa_su_stock(self):
+        self.assertFalse(self.prod.tiene_variantes)
+        self.assertTrue(self.prod.agotado)
+
+    def test_resumen_se_mantiene_al_cambiar_variantes(self):
+        v1 = Variante.objects.create(producto=self.prod, talla="M", color="Rojo", stock=3)
+        Variante.objects.create(producto=self.prod, talla="L", color="Azul", stock=0)
+        self.prod.refresh_from_db()
+        self.assertEqual(self.prod.stock_variantes, 3)
+        self.assertEqual(
+            self.prod.resumen_variantes,
+            {"variantes": 2, "con_stock": 1, "tallas": ["M"], "colores": ["Rojo"]},
+        )
+        self.assertFalse(self.prod.agotado)
+
+        v1.stock = 0
+        v1.save(update_fields=["stock"])
+        self.prod.refresh_from_db()
+        self.assertEqual(self.prod.stock_variantes, 0)
+        self.assertTrue(self.prod.agotado)
+
+        v1.delete()
+        self.prod.refresh_from_db()
+        self.assertEqual(self.prod.resumen_variantes["variantes"], 1)
+
+    def test_listado_no_consulta_variantes(self):
+        Variante.objects.create(producto=self.prod, talla="M", color="Rojo", stock=0)
+        with CaptureQueriesContext(connection) as consultas:
+            resp = self.client.get(reverse("productos:catalogo"))
+        self.assertContains(resp, "Agotado")
+        self.assertFalse(any("productos_variante" in q["sql"] for q in consultas))
+
+
+# =====================================================
+#   DETALLE: matriz de variantes cacheada
+# =====================================================
+
+class MatrizVariantesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.prod = Producto.objects.create(
+            categoria=self.cat, nombre="Camiseta", precio=Decimal("10.00"), stock=5
+        )
+        Variante.objects.create(producto=self.prod, talla="M", color="Rojo", stock=2)
+        Variante.objects.create(
+            producto=self.prod, talla="L", color="Azul", stock=0, extra_precio=Decimal("1.50")
+        )
+        self.url = reverse("productos:producto_detalle", args=[self.prod.slug])
+
+    def test_matriz_talla_color(self):
+        resp = self.client.get(self.url)
+        filas = resp.context["matriz"]
+        self.assertEqual([f["talla"] for f in filas], ["L", "M"])
+        self.assertEqual(resp.context["colores"], ["Azul", "Rojo"])
+        l_azul, l_rojo = filas[0]["celdas"]
+        self.assertEqual(l_azul["precio"], Decimal("11.50"))
+        self.assertIsNone(l_rojo)
+        self.assertContains(resp, "sin stock")
+
+    def test_ficha_caliente_no_toca_variantes(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as consultas:
+            resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        # producto + categoría + marca, y los "comprados juntos"
+        self.assertEqual(len(consultas), 2)
+        self.assertFalse(any("productos_variante" in q["sql"] for q in consultas))
+
+    def test_cambio_de_variante_refresca_la_matriz(self):
+        self.client.get(self.url)
+        Variante.objects.filter(talla="L").get().delete()
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.context["tallas"], ["M"])
+
+
+# ----------------------------------------------------------------------
+#  Derivados responsive de la imagen
+# ----------------------------------------------------------------------
+
+def _png(ancho=1200, alto=900, color=(200, 30, 30)):
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.new("RGB", (ancho, alto), color).save(buf, format="PNG")
+    return SimpleUploadedFile("foto.png", buf.getvalue(), content_type="image/png")
+
+
+class DerivadosImagenTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        cache.clear()
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.prod = Producto.objects.create(
+            nombre="Camiseta foto", precio=Decimal("10.00"), categoria=self.cat,
+            imagen=_png(),
+        )
+        self.prod.refresh_from_db()
+
+    def test_genera_todos_los_tamanos_y_formatos(self):
+        self.assertEqual(len(self.prod.imagen_hash), 64)
+        from PIL import Image
+
+        for uso, ancho in imagenes.TAMANOS.items():
+            for formato in imagenes.FORMATOS:
+                ruta = imagenes.ruta(self.prod.imagen_hash, uso, formato)
+                self.assertTrue(default_storage.exists(ruta), ruta)
+                with default_storage.open(ruta) as f:
+                    # nunca se amplía por encima del original (1200px)
+                    self.assertEqual(Image.open(f).width, min(ancho, 1200))
+
+    def test_solo_regenera_si_cambia_el_contenido(self):
+        with patch("productos.imagenes.generar", return_value=dict(imagenes.TAMANOS)) as generar:
+            self.prod.precio = Decimal("12.00")
+            self.prod.save()
+            generar.assert_not_called()
+
+            self.prod.imagen = _png(color=(0, 0, 255))
+            self.prod.save()
+            generar.assert_called_once()
+
+    def test_guardar_sin_tocar_la_imagen_no_la_relee(self):
+        with patch("productos.imagenes.hash_fichero") as hash_fichero:
+            self.prod.precio = Decimal("12.00")
+            self.prod.save()
+            Producto.objects.get(pk=self.prod.pk).save()
+        hash_fichero.assert_not_called()
+
+    def test_srcset_en_tarjeta(self):
+        resp = self.client.get(reverse("productos:catalogo"))
+        self.assertContains(resp, "tarjeta-400.webp 400w")
+        # el original mide 1200px: el zoom no se amplía y se anuncia con su ancho real
+        self.assertContains(resp, "zoom-1600.jpg 1200w")
+        self.assertNotContains(resp, "1600w")
+
+    def test_srcset_de_original_pequeno_sin_anchos_repetidos(self):
+        self.prod.imagen = _png(500, 500, color=(0, 90, 0))
+        self.prod.save()
+        self.prod.refresh_from_db()
+        self.assertEqual(self.prod.imagen_anchos, {"tarjeta": 400, "ficha": 500, "zoom": 500})
+        srcset = imagenes.srcset(self.prod)
+        self.assertIn("tarjeta-400.webp 400w", srcset)
+        self.assertIn("ficha-800.webp 500w", srcset)
+        self.assertNotIn("zoom", srcset)
+
+    def test_imagen_no_valida_sin_derivados(self):
+        prod = Producto.objects.create(
+            nombre="Rota", precio=Decimal("5.00"), categoria=self.cat,
+            imagen=SimpleUploadedFile("rota.png", b"no soy una imagen"),
+        )
+        prod.refresh_from_db()
+        self.assertEqual(prod.imagen_hash, "")
+        self.assertEqual(imagenes.srcset(prod), "")
+        self.assertEqual(imagenes.url(prod, "tarjeta"), prod.imagen.url)
+
+
+class MockupsPorContenidoTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        ajustes = override_settings(MEDIA_ROOT=self.media)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.prod = Producto.objects.create(
+            nombre="Camiseta perso", precio=Decimal("10.00"),
+            categoria=Categoria.objects.create(nombre="Camisetas"),
+            permite_personalizacion=True, imagen=_png(600, 600),
+        )
+        self.prod.refresh_from_db()
+        self.url = reverse("productos:producto_preview", args=[self.prod.slug])
+
+    def _preview(self, texto="Hola", color="#00ff00"):
+        resp = self.client.post(self.url, data={"texto": texto, "color_texto": color})
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()["preview_url"]
+
+    def test_preview_repetida_reutiliza_el_png(self):
+        primera = self._preview()
+        with patch("productos.views.Image.open") as abrir:
+            segunda = self._preview()
+            abrir.assert_not_called()
+        self.assertEqual(primera, segunda)
+        self.assertEqual(len(default_storage.listdir("personalizados")[1]), 1)
+
+    def test_cambiar_texto_o_color_genera_otro(self):
+        urls = {self._preview(), self._preview(texto="Adiós"), self._preview(color="#0000ff")}
+        self.assertEqual(len(urls), 3)
+
+    def test_nueva_version_de_render_invalida(self):
+        primera = self._preview()
+        with patch("productos.views.MOCKUP_VERSION", 2):
+            self.assertNotEqual(self._preview(), primera)
+
+
+@override_settings(MOCKUP_WORKERS=0)
+class PreviewEnSegundoPlanoTests(TestCase):
+    setUp = MockupsPorContenidoTests.setUp
+    _preview = MockupsPorContenidoTests._preview
+
+    def _encolar(self, **datos):
+        resp = self.client.post(self.url, data={"texto": "Hola", "modo": "job", **datos})
+        self.assertEqual(resp.status_code, 202)
+        return resp.json()
+
+    def test_job_devuelve_id_y_luego_la_url(self):
+        job = self._encolar()
+        resp = self.client.get(job["estado_url"])
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["estado"], "listo")
+        self.assertEqual(resp.json()["preview_url"], self._preview(texto="Hola", color="#ffffff"))
+
+    def test_error_de_render_queda_en_el_estado(self):
+        with patch("productos.views._generar_mockup", side_effect=OSError("roto")):
+            job = self._encolar()
+        self.assertEqual(self.client.get(job["estado_url"]).json()["estado"], "error")
+
+    def test_job_desconocido(self):
+        url = reverse("productos:producto_preview_estado", args=["nope"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_sin_cache_compartida_no_usa_el_pool(self):
+        with self.settings(MOCKUP_WORKERS=2), patch("productos.renders._get_pool") as pool:
+            job = self._encolar()
+        pool.assert_not_called()
+        self.assertEqual(self.client.get(job["estado_url"]).json()["estado"], "listo")
+
+    def test_pool_de_procesos(self):
+        # Caché en ficheros: la comparten el proceso web y los del pool
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        caches_ficheros = {"default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": cache_dir,
+        }}
+        with self.settings(MOCKUP_WORKERS=1, CACHES=caches_ficheros), \
+                patch("productos.renders._pool", None):
+            self.assertTrue(renders.cache_compartida())
+            self.addCleanup(renders._get_pool().shutdown)
+            job = self._encolar()
+            estado = self.client.get(job["estado_url"]).json()
+            limite = time.monotonic() + 30
+            while estado["estado"] == renders.PENDIENTE and time.monotonic() < limite:
+                time.sleep(0.05)
+                estado = self.client.get(job["estado_url"]).json()
+        self.assertEqual(estado["estado"], renders.LISTO)
+        self.assertEqual(estado["preview_url"], self._preview(texto="Hola", color="#ffffff"))
+
+
+class CacheBasesTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, ignore_errors=True)
+
+    def _guardar(self, nombre, lado, color=(10, 20, 30)):
+        from PIL import Image
+
+        ruta = f"{self.dir}/{nombre}"
+        Image.new("RGB", (lado, lado), color).save(ruta)
+        return ruta
+
+    def test_aciertos_y_copias_independientes(self):
+        lru = bases.CacheBases(limite_bytes=10 * 1024 * 1024)
+        ruta = self._guardar("a.png", 100)
+        primera = lru.obtener(ruta)
+        primera.putpixel((0, 0), (255, 255, 255, 255))
+        segunda = lru.obtener(ruta)
+        self.assertEqual(segunda.mode, "RGBA")
+        self.assertEqual(segunda.getpixel((0, 0)), (10, 20, 30, 255))
+        stats = lru.estadisticas()
+        self.assertEqual((stats["aciertos"], stats["fallos"]), (1, 1))
+        self.assertEqual(stats["bytes"], 100 * 100 * 4)
+
+    def test_respeta_el_presupuesto_de_memoria(self):
+        lru = bases.CacheBases(limite_bytes=2 * 100 * 100 * 4)
+        rutas = [self._guardar(f"{i}.png", 100) for i in range(3)]
+        for ruta in rutas:
+            lru.obtener(ruta)
+        self.assertEqual(lru.estadisticas()["entradas"], 2)
+        lru.obtener(rutas[0])  # la más antigua se expulsó
+        self.assertEqual(lru.estadisticas()["fallos"], 4)
+
+    def test_fichero_modificado_se_vuelve_a_leer(self):
+        import os
+
+        lru = bases.CacheBases(limite_bytes=10 * 1024 * 1024)
+        ruta = self._guardar("a.png", 50)
+        lru.obtener(ruta)
+        self._guardar("a.png", 50, color=(200, 0, 0))
+        os.utime(ruta, ns=(0, os.stat(ruta).st_mtime_ns + 1_000_000))
+        self.assertEqual(lru.obtener(ruta).getpixel((0, 0)), (200, 0, 0, 255))
+        self.assertEqual(lru.estadisticas()["entradas"], 1)
+
+
+class SubidasPersonalizacionTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        ajustes = override_settings(MEDIA_ROOT=self.media, SUBIDAS_TTL_HORAS=1)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+
+    def _subir(self, contenido=b"logo", nombre="logo.png"):
+        return subidas.guardar(SimpleUploadedFile(nombre, contenido))
+
+    def _envejecer(self, subida):
+        import os
+
+        viejo = timezone.now() - timezone.timedelta(hours=2)
+        SubidaPersonalizacion.objects.filter(pk=subida.pk).update(usada=viejo)
+        os.utime(default_storage.path(subida.fichero), (viejo.timestamp(), viejo.timestamp()))
+
+    def test_misma_imagen_se_guarda_una_vez(self):
+        a = self._subir(nombre="a.png")
+        b = self._subir(nombre="b.png")
+        self.assertEqual(a.fichero, b.fichero)
+        self.assertEqual(SubidaPersonalizacion.objects.count(), 1)
+        self.assertEqual(len(default_storage.listdir(f"{subidas.CARPETA}/{a.hash[:2]}")[1]), 1)
+
+    def test_limpia_caducadas_sin_referencias(self):
+        from pedidos.models import Pedido, PedidoItem
+
+        suelta = self._subir(b"uno")
+        en_pedido = self._subir(b"dos")
+        reciente = self._subir(b"tres")
+        self._envejecer(suelta)
+        self._envejecer(en_pedido)
+        pedido = Pedido.objects.create(
+            email="c@example.com", nombre="C", direccion="x", ciudad="y", cp="1"
+        )
+        PedidoItem.objects.create(
+            pedido=pedido, producto_id=1, titulo="T", precio_unit=Decimal("1"),
+            personalizacion={"imagen": default_storage.url(en_pedido.fichero)},
+        )
+
+        self.assertEqual(subidas.limpiar(simular=True)["registros"], 1)
+        self.assertTrue(default_storage.exists(suelta.fichero))
+
+        stats = subidas.limpiar()
+        self.assertEqual(stats["registros"], 1)
+        self.assertFalse(default_storage.exists(suelta.fichero))
+        self.assertTrue(default_storage.exists(en_pedido.fichero))
+        self.assertTrue(default_storage.exists(reciente.fichero))
+
+    def test_carrito_en_sesion_cuenta_como_referencia(self):
+        subida = self._subir()
+        self._envejecer(subida)
+        sesion = self.client.session
+        sesion["cart"] = {"1": {"meta": {"personalizacion": {"subida": subida.hash}}}}
+        sesion.save()
+        self.assertEqual(subidas.limpiar()["registros"], 0)
+
+    def test_subida_del_carrito_sobrevive_en_el_carrito_y_en_el_pedido(self):
+        from django.contrib.auth.models import AnonymousUser
+        from django.contrib.sessions.backends.db import SessionStore
+        from django.contrib.sessions.models import Session
+        from django.test import RequestFactory
+        from pedidos.models import PedidoItem
+        from pedidos.services import crear_pedido_desde_carrito
+
+        cat = Categoria.objects.create(nombre="Ropa")
+        producto = Producto.objects.create(
+            nombre="Camiseta", precio=Decimal("10.00"), categoria=cat, stock=5,
+            permite_personalizacion=True,
+        )
+        resp = self.client.post(
+            reverse("carrito:carrito_add", args=[producto.pk]),
+            {"quantity": "1", "imagen": _png(4, 4)},
+        )
+        self.assertEqual(resp.status_code, 302)
+        subida = SubidaPersonalizacion.objects.get()
+        self._envejecer(subida)
+        self.assertEqual(subidas.limpiar()["registros"], 0)
+
+        request = RequestFactory().post("/")
+        request.session = SessionStore(session_key=self.client.session.session_key)
+        request.user = AnonymousUser()
+        crear_pedido_desde_carrito(request, {
+            "email": "c@example.com", "nombre": "C", "direccion": "x", "ciudad": "y", "cp": "1",
+        })
+        self.assertEqual(PedidoItem.objects.get().personalizacion["subida"], subida.hash)
+        # Sin el carrito, la referencia del pedido basta
+        Session.objects.all().delete()
+        self.assertEqual(subidas.limpiar()["registros"], 0)
+        self.assertTrue(default_storage.exists(subida.fichero))
+
+    def test_huerfanos_antiguos_en_disco(self):
+        import os
+
+        nombre = default_storage.save(f"{subidas.CARPETA}/abc_logo.png", ContentFile(b"x"))
+        os.utime(default_storage.path(nombre), (0, 0))
+        self.assertEqual(subidas.limpiar()["ficheros"], 1)
+        self.assertFalse(default_storage.exists(nombre))
+
+
+# ----------------------------------------------------------------------
+#  Autocompletado del buscador
+# ----------------------------------------------------------------------
+
+class SugerenciasBuscadorTests(TestCase):
+    def setUp(self):
+        sugerencias.vaciar()
+        self.addCleanup(sugerencias.vaciar)
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.marca = Marca.objects.create(nombre="Camper Wear")
+        self.prod = Producto.objects.create(
+            nombre="Camión Camiseta negra", precio=Decimal("10.00"), categoria=self.cat
+        )
+        Producto.objects.create(
+            nombre="Camiseta oculta", precio=Decimal("10.00"), categoria=self.cat, activo=False
+        )
+        self.url = reverse("productos:sugerencias")
+
+    def _textos(self, q):
+        return [s["texto"] for s in self.client.get(self.url, {"q": q}).json()["sugerencias"]]
+
+    def test_prefijo_sin_tildes_y_por_palabra(self):
+        # orden alfabético de la clave normalizada
+        self.assertEqual(self._textos("cami"), ["Camión Camiseta negra", "Camisetas"])
+        self.assertEqual(self._textos("NEG"), ["Camión Camiseta negra"])
+        self.assertEqual(self._textos("camion"), ["Camión Camiseta negra"])
+        self.assertEqual(self._textos("camp"), ["Camper Wear"])
+
+    def test_consulta_caliente_no_toca_la_base_de_datos(self):
+        self.client.get(self.url, {"q": "ca"})
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.get(self.url, {"q": "cam"})
+        self.assertEqual(len(consultas), 0)
+
+    def test_se_actualiza_con_las_senales(self):
+        self._textos("x")  # construye el índice
+        self.prod.nombre = "Gorra azul"
+        self.prod.save()
+        Producto.objects.create(nombre="Camiseta nueva", precio=Decimal("9.00"), categoria=self.cat)
+        self.marca.delete()
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self._textos("cam"), ["Camiseta nueva", "Camisetas"])
+            self.assertEqual(self._textos("azu"), ["Gorra azul"])
+        self.assertEqual(len(consultas), 0)
+
+    def test_cambios_en_el_sitio_sin_copiar_el_indice(self):
+        self._textos("x")
+        indice = sugerencias._entradas
+        Producto.objects.create(nombre="Sudadera gris", precio=Decimal("9.00"), categoria=self.cat)
+        self.assertIs(sugerencias._entradas, indice)
+        self.assertEqual(self._textos("gris"), ["Sudadera gris"])
+
+    @override_settings(SUGERENCIAS_TTL=0)
+    def test_caducado_sirve_el_anterior_y_reconstruye_aparte(self):
+        self._textos("x")
+        # Un cambio hecho en otro proceso: aquí no llega la señal
+        Producto.objects.filter(pk=self.prod.pk).update(nombre="Gorra roja")
+        lanzadas = []
+        with patch("productos.sugerencias._lanzar", side_effect=lanzadas.append):
+            with CaptureQueriesContext(connection) as consultas:
+                self.assertEqual(self._textos("roj"), [])
+                self._textos("roj")
+        self.assertEqual(len(consultas), 0)
+        self.assertEqual(len(lanzadas), 1)  # una sola reconstrucción a la vez
+
+        # Lo que cambia en este proceso mientras se lee la base de datos no se pierde
+        def leer_y_cambiar():
+            leido = leer()
+            Producto.objects.create(nombre="Camiseta durante", precio=Decimal("9.00"), categoria=self.cat)
+            return leido
+
+        leer = sugerencias._leer
+        with patch("productos.sugerencias._leer", side_effect=leer_y_cambiar):
+            lanzadas[0]()
+        with self.settings(SUGERENCIAS_TTL=60):
+            self.assertEqual(self._textos("roj"), ["Gorra roja"])
+            self.assertEqual(self._textos("durante"), ["Camiseta durante"])
+
+
+# ----------------------------------------------------------------------
+#  API JSON v1
+# ----------------------------------------------------------------------
+
+class ApiCatalogoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.marca = Marca.objects.create(nombre="Marca X")
+        self.prod = Producto.objects.create(
+            nombre="Camiseta API", precio=Decimal("10.00"), categoria=self.cat, marca=self.marca
+        )
+        Variante.objects.create(
+            producto=self.prod, talla="M", color="Rojo", stock=3, extra_precio=Decimal("2.00")
+        )
+        Producto.objects.create(nombre="Gorra API", precio=Decimal("5.00"), categoria=self.cat)
+        self.url = reverse("productos:api_productos")
+
+    def test_listado_filtrado_con_campos(self):
+        resp = self.client.get(self.url, {"marca": "marca-x", "fields": "nombre,precio,tallas"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp.json()["resultados"],
+            [{"nombre": "Camiseta API", "precio": "10.00", "tallas": ["M"]}],
+        )
+
+    def test_campo_desconocido(self):
+        resp = self.client.get(self.url, {"fields": "nombre,coste"})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_etag_y_304_sin_serializar(self):
+        resp = self.client.get(self.url)
+        etag = resp["ETag"]
+        with patch("productos.api.serializar") as serializar:
+            with CaptureQueriesContext(connection) as consultas:
+                resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            serializar.assert_not_called()
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(len(consultas), 1)
+
+        Variante.objects.filter(producto=self.prod).update(stock=0)
+        self.prod.save()
+        resp = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp["ETag"], etag)
+
+    @override_settings(CATALOGO_POR_PAGINA=1)
+    def test_etag_solo_de_la_pagina_pedida(self):
+        # Orden por novedad: la primera página es la gorra
+        etag = self.client.get(self.url)["ETag"]
+        Producto.objects.filter(pk=self.prod.pk).update(actualizado=timezone.now(), stock=7)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Producto.objects.filter(nombre="Gorra API").update(stock=2)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depende_de_los_campos(self):
+        a = self.client.get(self.url, {"fields": "id"})["ETag"]
+        b = self.client.get(self.url, {"fields": "id,nombre"})["ETag"]
+        self.assertNotEqual(a, b)
+
+    def test_etag_depende_del_orden_y_de_la_popularidad(self):
+        por_precio = self.client.get(self.url, {"orden": "precio"})["ETag"]
+        por_nombre = self.client.get(self.url, {"orden": "nombre"})["ETag"]
+        self.assertNotEqual(por_precio, por_nombre)
+
+        vendidos = self.client.get(self.url, {"orden": "vendidos"})["ETag"]
+        popularidad.recalcular()
+        resp = self.client.get(self.url, {"orden": "vendidos"}, HTTP_IF_NONE_MATCH=vendidos)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_etag_cambia_con_el_stock_y_las_reglas(self):
+        self.addCleanup(precios.invalidar)
+        gorra = Producto.objects.get(nombre="Gorra API")
+        etag = self.client.get(self.url)["ETag"]
+        # Como el checkout: sin tocar `actualizado`
+        gorra.stock = 4
+        gorra.save(update_fields=["stock"])
+        etag_stock = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)["ETag"]
+        self.assertNotEqual(etag_stock, etag)
+
+        ReglaPrecio.objects.create(concepto="texto", recargo="nombre", importe=Decimal("1.00"))
+        self.assertNotEqual(self.client.get(self.url)["ETag"], etag_stock)
+        # Sin el precio en la respuesta las reglas no cuentan
+        solo_id = self.client.get(self.url, {"fields": "id"})["ETag"]
+        ReglaPrecio.objects.create(concepto="color", recargo="color", importe=Decimal("1.00"))
+        self.assertEqual(self.client.get(self.url, {"fields": "id"})["ETag"], solo_id)
+
+    def test_ficha_con_variantes_y_304(self):
+        url = reverse("productos:api_producto", args=[self.prod.slug])
+        resp = self.client.get(url)
+        datos = resp.json()
+        self.assertEqual(datos["variantes"][0]["precio"], "12.00")
+        self.assertEqual(datos["categoria"], {"slug": "camisetas", "nombre": "Camisetas"})
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(resp.status_code, 304)
+
+    def test_ficha_inexistente(self):
+        url = reverse("productos:api_producto", args=["no-existe"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+# ----------------------------------------------------------------------
+#  Órdenes del catálogo
+# ----------------------------------------------------------------------
+
+@override_settings(CATALOGO_POR_PAGINA=2)
+class OrdenCatalogoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.marca = Marca.objects.create(nombre="Marca X")
+        for nombre, precio in (("Beta", "15.00"), ("Alfa", "30.00"), ("Delta", "5.00"), ("Gamma", "20.00")):
+            Producto.objects.create(
+                nombre=nombre, precio=Decimal(precio), categoria=self.cat, marca=self.marca
+            )
+        self.url = reverse("productos:catalogo")
+
+    def _todos(self, **params):
+        nombres, resp = [], self.client.get(self.url, params)
+        while True:
+            nombres += [p.nombre for p in resp.context["productos"]]
+            siguiente = resp.context["pagina"]["siguiente_url"]
+            if not siguiente:
+                return nombres
+            resp = self.client.get(siguiente)
+
+    def test_ordenes(self):
+        self.assertEqual(self._todos(orden="precio"), ["Delta", "Beta", "Gamma", "Alfa"])
+        self.assertEqual(self._todos(orden="-precio"), ["Alfa", "Gamma", "Beta", "Delta"])
+        self.assertEqual(self._todos(orden="nombre"), ["Alfa", "Beta", "Delta", "Gamma"])
+        self.assertEqual(self._todos(orden="novedad"), ["Gamma", "Delta", "Alfa", "Beta"])
+        self.assertEqual(self._todos(orden="precio", marca="marca-x"), ["Delta", "Beta", "Gamma", "Alfa"])
+
+    def test_cursor_de_otro_orden_vuelve_al_principio(self):
+        resp = self.client.get(self.url, {"orden": "precio"})
+        cursor = resp.context["pagina"]["siguiente"]
+        resp = self.client.get(self.url, {"orden": "nombre", "cursor": cursor})
+        self.assertEqual([p.nombre for p in resp.context["productos"]], ["Alfa", "Beta"])
+
+    def test_orden_desconocido_es_novedad(self):
+        resp = self.client.get(self.url, {"orden": "stock; drop"})
+        self.assertEqual(resp.context["pagina"]["orden"], "novedad")
+
+    def test_categoria_con_orden(self):
+        url = reverse("productos:catalogo_por_categoria", args=[self.cat.slug])
+        resp = self.client.get(url, {"orden": "nombre"})
+        self.assertEqual([p.nombre for p in resp.context["productos"]], ["Alfa", "Beta"])
+
+
+@skipUnlessDBFeature("supports_partial_indexes")
+class IndicesOrdenCatalogoTests(TestCase):
+    """El plan de cada orden debe recorrer su índice, sin ordenar en memoria."""
+
+    def setUp(self):
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.hija = Categoria.objects.create(nombre="Manga corta", padre=self.cat)
+        self.marca = Marca.objects.create(nombre="Marca X")
+
+    # Valores de cursor de ejemplo, por campo de orden
+    CLAVE = {
+        "creado": timezone.now(), "precio": Decimal("10.00"), "nombre": "M", "id": 10,
+        "puntuacion": 1.5, "popularidad_pk": 10,
+    }
+
+    def _plan(self, filtros, orden, cursor=False):
+        qs = listado.filtrar(Producto.objects.filter(activo=True), filtros)
+        campos = list(paginacion.ORDENES[orden])
+        if orden == "vendidos":
+            qs = popularidad.anotar(qs)
+        if cursor:
+            # Lo que filtra paginar_keyset en una página que no es la primera
+            clave = [self.CLAVE[c.lstrip("-")] for c in campos]
+            qs = qs.filter(paginacion._despues_de(campos, clave))
+        return qs.order_by(*campos)[:25].explain()
+
+    def _comprobar(self, filtros, prefijo, cursor=False):
+        if connection.vendor != "sqlite":
+            self.skipTest("los planes comprobados son los de SQLite")
+        for orden, indice in (
+            ("novedad", "novedad"), ("precio", "precio"), ("-precio", "precio"), ("nombre", "nombre")
+        ):
+            with self.subTest(orden=orden):
+                plan = self._plan(filtros, orden, cursor)
+                self.assertIn(f"prod_{prefijo}_{indice}_idx", plan)
+                self.assertNotIn("TEMP B-TREE", plan)
+                if cursor:
+                    # Entra por el punto del cursor, no recorre el índice desde el principio
+                    primero = paginacion.ORDENES[orden][0]
+                    signo = "<" if primero.startswith("-") else ">"
+                    self.assertRegex(
+                        plan, rf"SEARCH productos_producto USING INDEX prod_{prefijo}_{indice}_idx "
+                              rf"\(.*{primero.lstrip('-')}{signo}\?\)",
+                    )
+
+    def test_catalogo_completo(self):
+        self._comprobar({}, "cat")
+
+    def test_por_marca(self):
+        self._comprobar({"marca": self.marca.slug}, "marca")
+
+    def test_por_categoria_hoja(self):
+        self._comprobar({"categoria": self.hija.slug}, "categoria")
+
+    def test_paginas_con_cursor(self):
+        for filtros, prefijo in (
+            ({}, "cat"),
+            ({"marca": self.marca.slug}, "marca"),
+            ({"categoria": self.hija.slug}, "categoria"),
+        ):
+            with self.subTest(prefijo=prefijo):
+                self._comprobar(filtros, prefijo, cursor=True)
+
+    def test_todos_los_ordenes_tienen_plan_con_cursor(self):
+        # Si se añade un orden a ORDENES, tiene que estar comprobado aquí
+        self.assertEqual(
+            set(paginacion.ORDENES), {"novedad", "precio", "-precio", "nombre", "vendidos"}
+        )
+
+    def test_mas_vendidos_recorre_el_indice_de_popularidad(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("los planes comprobados son los de SQLite")
+        qs = popularidad.anotar(Producto.objects.filter(activo=True))
+        plan = qs.order_by(*paginacion.ORDENES["vendidos"])[:25].explain()
+        self.assertIn("SCAN productos_popularidad USING COVERING INDEX", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_mas_vendidos_con_cursor(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("los planes comprobados son los de SQLite")
+        plan = self._plan({}, "vendidos", cursor=True)
+        self.assertIn("SEARCH productos_popularidad USING COVERING INDEX", plan)
+        self.assertIn("(puntuacion<?)", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+# ----------------------------------------------------------------------
+#  Más vendidos
+# ----------------------------------------------------------------------
+
+@override_settings(POPULARIDAD_MARGEN_SEGUNDOS=0)
+class PopularidadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.a = Producto.objects.create(nombre="A", precio=Decimal("10.00"), categoria=self.cat)
+        self.b = Producto.objects.create(nombre="B", precio=Decimal("10.00"), categoria=self.cat)
+        self.c = Producto.objects.create(nombre="C", precio=Decimal("10.00"), categoria=self.cat)
+
+    def _vender(self, producto, cantidad, hace_dias=0, estado="pendiente", **pago):
+        from pedidos.models import Pedido, PedidoItem
+
+        pedido = Pedido.objects.create(
+            email="c@example.com", nombre="C", direccion="x", ciudad="y", cp="1", estado=estado, **pago
+        )
+        Pedido.objects.filter(pk=pedido.pk).update(
+            created_at=timezone.now() - timezone.timedelta(days=hace_dias)
+        )
+        PedidoItem.objects.create(
+            pedido=pedido, producto_id=producto.pk, titulo=producto.nombre,
+            precio_unit=Decimal("10.00"), cantidad=cantidad,
+        )
+        return pedido
+
+    def test_ventanas_y_decaimiento(self):
+        self._vender(self.a, 5, hace_dias=40)
+        self._vender(self.b, 3, hace_dias=1)
+        self._vender(self.b, 1, hace_dias=10)
+        self._vender(self.c, 9, estado="cancelado")
+        popularidad.actualizar()
+
+        b = Popularidad.objects.get(producto=self.b)
+        self.assertEqual((b.unidades_7, b.unidades_30, b.unidades_90), (3, 4, 4))
+        a = Popularidad.objects.get(producto=self.a)
+        self.assertEqual((a.unidades_7, a.unidades_30, a.unidades_90), (0, 0, 5))
+        self.assertGreater(b.puntuacion, a.puntuacion)  # 5 uds. de hace 40 días pesan menos
+        self.assertEqual(Popularidad.objects.get(producto=self.c).puntuacion, 0)
+
+    def test_incremental_desde_la_ultima_pasada(self):
+        self._vender(self.a, 2)
+        self.assertEqual(popularidad.actualizar()["lineas"], 1)
+        self.assertEqual(popularidad.actualizar()["lineas"], 0)
+        self._vender(self.a, 3)
+        self.assertEqual(popularidad.actualizar()["lineas"], 1)
+        self.assertEqual(VentaDiaria.objects.get(producto=self.a).unidades, 5)
+        self.assertEqual(Popularidad.objects.get(producto=self.a).unidades_7, 5)
+
+    def test_tarjeta_cuenta_al_cobrarse(self):
+        pedido = self._vender(self.a, 2, pago_metodo="tarjeta", pago_estado="iniciado")
+        self.assertEqual(popularidad.actualizar()["lineas"], 0)
+        self.assertEqual(Popularidad.objects.get(producto=self.a).unidades_7, 0)
+
+        pedido.pago_estado = "pagado"
+        pedido.save(update_fields=["pago_estado"])
+        popularidad.actualizar()
+        self.assertEqual(Popularidad.objects.get(producto=self.a).unidades_7, 2)
+
+    def test_cancelar_despues_resta_las_unidades(self):
+        self._vender(self.a, 1)
+        pedido = self._vender(self.a, 4)
+        popularidad.actualizar()
+        self.assertEqual(Popularidad.objects.get(producto=self.a).unidades_7, 5)
+
+        pedido.estado = "cancelado"
+        pedido.save(update_fields=["estado"])
+        self.assertEqual(popularidad.actualizar()["lineas"], 1)
+        self.assertEqual(Popularidad.objects.get(producto=self.a).unidades_7, 1)
+        self.assertEqual(popularidad.actualizar()["lineas"], 0)
+
+    def test_solo_mira_los_pedidos_cambiados(self):
+        self._vender(self.a, 2)
+        popularidad.actualizar()
+        with patch("productos.popularidad._sumar_lineas", return_value=0) as sumar:
+            popularidad.actualizar()
+        sumar.assert_not_called()
+        self.assertIsNotNone(ProgresoTarea.objects.get(tarea=popularidad.TAREA).hasta)
+
+    def test_recalcula_solo_los_productos_cambiados(self):
+        self._vender(self.a, 2)
+        self._vender(self.b, 1)
+        self.assertEqual(popularidad.actualizar()["productos_recalculados"], 2)
+        self._vender(self.b, 3)
+        self.assertEqual(popularidad.actualizar()["productos_recalculados"], 1)
+        self.assertEqual(Popularidad.objects.get(producto=self.b).unidades_7, 4)
+        self.assertEqual(popularidad.actualizar()["productos_recalculados"], 0)
+
+        # Al cambiar de día se envejecen todos los que tienen ventas
+        manana = timezone.localdate() + timezone.timedelta(days=1)
+        self.assertEqual(popularidad.actualizar(manana)["productos_recalculados"], 2)
+
+    def test_pedidos_recientes_esperan_al_margen(self):
+        self._vender(self.a, 2)
+        with self.settings(POPULARIDAD_MARGEN_SEGUNDOS=600):
+            self.assertEqual(popularidad.actualizar()["lineas"], 0)
+        self.assertEqual(popularidad.actualizar()["lineas"], 1)
+
+    def test_orden_y_estanteria_en_el_catalogo(self):
+        self._vender(self.b, 4)
+        self._vender(self.c, 2)
+        popularidad.actualizar()
+        nuevo = Producto.objects.create(nombre="D", precio=Decimal("1.00"), categoria=self.cat)
+
+        resp = self.client.get(reverse("productos:catalogo"), {"orden": "vendidos"})
+        nombres = [p.nombre for p in resp.context["productos"]]
+        self.assertEqual(nombres[:2], ["B", "C"])
+        self.assertIn(nuevo.nombre, nombres)  # sin ventas, pero sale
+
+        resp = self.client.get(reverse("productos:catalogo"))
+        self.assertEqual(len(resp.context["mas_vendidos"]), 2)
+        self.assertContains(resp, "Más vendidos")
+
+
+# ----------------------------------------------------------------------
+#  Comprados juntos
+# ----------------------------------------------------------------------
+
+class CompradosJuntosTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Categoria.objects.create(nombre="Camisetas")
+        self.p = {
+            n: Producto.objects.create(nombre=n, precio=Decimal("10.00"), categoria=self.cat)
+            for n in ("A", "B", "C", "D")
+        }
+
+    def _pedido(self, *nombres, estado="pendiente"):
+        from pedidos.models import Pedido, PedidoItem
+
+        pedido = Pedido.objects.create(
+            email="c@example.com", nombre="C", direccion="x", ciudad="y", cp="1", estado=estado
+        )
+        for n in nombres:
+            PedidoItem.objects.create(
+                pedido=pedido, producto_id=self.p[n].pk, titulo=n, precio_unit=Decimal("10.00")
+            )
+
+    def _companeros(self, nombre):
+        return [
+            (c.companero.nombre, c.veces)
+            for c in CompraConjunta.objects.filter(producto=self.p[nombre]).order_by("posicion")
+        ]
+
+    def test_top_k_por_producto(self):
+        self._pedido("A", "B", "C")
+        self._pedido("A", "B")
+        self._pedido("A", "C", "C")  # repetido en el mismo pedido cuenta una vez
+        self._pedido("A", "D")
+        self._pedido("A", "D", estado="cancelado")
+        # trozos de 1 pedido: fuerza la fusión entre trozos
+        with self.settings(RECOMENDACIONES_MAX_PARES=1):
+            recomendaciones.calcular(tam_trozo=1, k=2)
+        self.assertEqual(self._companeros("A"), [("B", 2), ("C", 2)])
+        self.assertEqual(self._companeros("D"), [("A", 1)])
+
+    def test_memoria_acotada_con_tramos_en_disco(self):
+        for nombres in (("A", "B", "C"), ("A", "B"), ("B", "D"), ("C", "D"), ("A", "D"), ("A", "B", "D")):
+            self._pedido(*nombres)
+        recomendaciones.calcular(k=3)
+        sin_limite = {n: self._companeros(n) for n in self.p}
+
+        original, tamanos = recomendaciones._reducir, []
+
+        def reducir(np, claves, cuentas):
+            tamanos.append(len(claves))
+            return original(np, claves, cuentas)
+
+        with self.settings(RECOMENDACIONES_MAX_PARES=4), \
+                patch("productos.recomendaciones._reducir", side_effect=reducir), \
+                patch("numpy.save", wraps=__import__("numpy").save) as guardar:
+            recomendaciones.calcular(tam_trozo=1, k=3)
+        self.assertGreater(guardar.call_count, 2)  # más de un tramo en disco
+        # Nunca se junta más que el límite más un trozo (un pedido de 3 = 6 pares)
+        self.assertLessEqual(max(tamanos), 4 + 6)
+        self.assertEqual({n: self._companeros(n) for n in self.p}, sin_limite)
+
+    def test_tarjeta_sin_cobrar_no_cuenta(self):
+        from pedidos.models import Pedido
+
+        self._pedido("A", "B")
+        Pedido.objects.update(pago_metodo="tarjeta", pago_estado="iniciado")
+        recomendaciones.calcular()
+        self.assertEqual(self._companeros("A"), [])
+
+    def test_no_recomienda_inactivos(self):
+        self._pedido("A", "B")
+        self.p["B"].activo = False
+        self.p["B"].save()
+        recomendaciones.calcular()
+        self.assertEqual(self._companeros("A"), [])
+        self.assertEqual(self._companeros("B"), [("A", 1)])
+
+    def test_ficha_y_carrito(self):
+        self._pedido("A", "B", "C")
+        self._pedido("A", "C")
+        recomendaciones.calcular()
+
+        resp = self.client.get(reverse("productos:producto_detalle", args=[self.p["A"].slug]))
+        self.assertEqual(len(resp.context["comprados_juntos"]), 2)
+        self.assertContains(resp, "Se suele comprar con")
+
+        with CaptureQueriesContext(connection) as consultas:
+            juntos = recomendaciones.para_carrito([self.p["B"].pk, self.p["C"].pk])
+        self.assertEqual([p.nombre for p in juntos], ["A"])
+        self.assertEqual(len(consultas), 1)
+
+
+# ----------------------------------------------------------------------
+#  Precios en lote
+# ----------------------------------------------------------------------
+
+class PreciosLoteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.pantalones = Categoria.objects.create(nombre="Pantalones")
+        self.camisetas = Categoria.objects.create(nombre="Camisetas")
+        self.pantalon = Producto.objects.create(
+            nombre="Vaquero", precio=Decimal("30.00"), categoria=self.pantalones,
+            precio_personalizacion_color=Decimal("4.00"),
+            precio_personalizacion_textura=Decimal("6.00"),
+        )
+        self.camiseta = Producto.objects.create(
+            nombre="Camiseta", precio=Decimal("10.00"), categoria=self.camisetas,
+            permite_personalizacion=True, precio_personalizacion_nombre=Decimal("2.00"),
+        )
+        self.v_m = Variante.objects.create(producto=self.camiseta, talla="M", color="Rojo", stock=1)
+        self.v_xl = Variante.objects.create(
+            producto=self.camiseta, talla="XL", color="Rojo", stock=1, extra_precio=Decimal("3.00")
+        )
+
+    def test_igual_que_calcular_precio_en_dos_consultas(self):
+        lineas = [
+            (self.pantalon.pk, None, {"tipo": "pantalon", "estilo": "roto-parche"}),
+            (self.camiseta.pk, self.v_xl.pk, {"texto": "Hola"}),
+            (self.camiseta.pk, self.v_m.pk, None),
+            (self.camiseta.pk, 999999, None),  # variante inexistente
+            (self.pantalon.pk, self.v_m.pk, None),  # variante de otro producto
+            (999999, None, None),
+        ]
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = precios.precios(lineas)
+        # + la compilación de las reglas la primera vez
+        self.assertLessEqual(len(consultas), 3)
+        with CaptureQueriesContext(connection) as consultas:
+            precios.precios(lineas)
+        self.assertEqual(len(consultas), 2)
+        self.assertEqual(resultado[:3], [
+            self.pantalon.calcular_precio(personalizacion={"tipo": "pantalon", "estilo": "roto-parche"}),
+            self.camiseta.calcular_precio(variante=self.v_xl, personalizacion={"texto": "Hola"}),
+            Decimal("10.00"),
+        ])
+        self.assertEqual(resultado[0], Decimal("40.00"))
+        self.assertEqual(resultado[3:], [None, None, None])
+
+    def test_endpoint(self):
+        url = reverse("productos:api_precios")
+        resp = self.client.post(
+            url,
+            data={"lineas": [{"producto": self.camiseta.pk, "variante": self.v_xl.pk}, {"producto": 0}]},
+            content_type="application/json",
+        )
+        self.assertEqual(resp.json()["precios"], ["13.00", None])
+        resp = self.client.post(url, data="no json", content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_desde_en_el_catalogo(self):
+        resp = self.client.get(reverse("productos:catalogo"))
+        self.assertContains(resp, "desde")
+        self.camiseta.refresh_from_db()
+        self.assertEqual(precios.desde([self.camiseta]), {self.camiseta.pk: Decimal("10.00")})
+        self.assertEqual(precios.desde([self.pantalon]), {})
+
+    def test_repreciar_carrito(self):
+        from carrito.cart import CART_SESSION_ID
+
+        sesion = self.client.session
+        sesion[CART_SESSION_ID] = {
+            str(self.camiseta.pk): {
+                "qty": 1, "price": "10.00", "name": "Camiseta", "slug": "camiseta",
+                "meta": {"variante_id": self.v_xl.pk},
+            },
+        }
+        sesion.save()
+        resp = self.client.get(reverse("carrito:carrito_ver"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            self.client.session[CART_SESSION_ID][str(self.camiseta.pk)]["price"], "13.00"
+        )
+
+
+class ReglasPrecioTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(precios.invalidar)
+        self.camisetas = Categoria.objects.create(nombre="Camisetas")
+        self.vaqueros = Categoria.objects.create(nombre="Vaqueros")
+        self.camiseta = Producto.objects.create(
+            nombre="Camiseta", precio=Decimal("10.00"), categoria=self.camisetas,
+            permite_personalizacion=True,
+            precio_personalizacion_nombre=Decimal("2.00"),
+            precio_personalizacion_color=Decimal("1.00"),
+            precio_personalizacion_textura=Decimal("5.00"),
+        )
+        self.vaquero = Producto.objects.create(
+            nombre="Vaquero", precio=Decimal("30.00"), categoria=self.vaqueros,
+            precio_personalizacion_color=Decimal("4.00"),
+            precio_personalizacion_textura=Decimal("6.00"),
+        )
+
+    def test_reglas_generales(self):
+        p = self.camiseta.calcular_precio
+        self.assertEqual(p(), Decimal("10.00"))
+        self.assertEqual(p(personalizacion={"texto": "Hola", "color_texto": "#FFF"}), Decimal("12.00"))
+        self.assertEqual(
+            p(personalizacion={"texto": "Hola", "color_texto": "#ff0000", "preview_url": "/x.png"}),
+            Decimal("18.00"),
+        )
+        # sin permite_personalizacion no hay recargos generales
+        self.assertEqual(self.vaquero.calcular_precio(personalizacion={"texto": "Hola"}), Decimal("30.00"))
+
+    def test_tipo_pantalon(self):
+        p = self.vaquero.calcular_precio
+        self.assertEqual(p(personalizacion={"tipo": "pantalon"}), Decimal("30.00"))
+        self.assertEqual(p(personalizacion={"tipo": "pantalon", "estilo": "roto"}), Decimal("34.00"))
+        self.assertEqual(p(personalizacion={"tipo": "pantalon", "estilo": "parche"}), Decimal("36.00"))
+        self.assertEqual(p(personalizacion={"tipo": "pantalon", "estilo": "roto-parche"}), Decimal("40.00"))
+
+    def test_regla_de_categoria_sin_tocar_el_codigo(self):
+        pers = {"estilo": "roto"}
+        self.assertEqual(self.vaquero.calcular_precio(personalizacion=pers), Decimal("30.00"))
+        regla = ReglaPrecio.objects.create(
+            categoria=self.vaqueros, concepto="estilo", valores="roto", recargo="color",
+            solo_personalizables=False,
+        )
+        self.assertEqual(self.vaquero.calcular_precio(personalizacion=pers), Decimal("34.00"))
+        # el grupo de la categoría sustituye a las generales
+        self.assertEqual(self.vaquero.calcular_precio(personalizacion={"texto": "x"}), Decimal("30.00"))
+        regla.delete()
+        self.assertEqual(self.vaquero.calcular_precio(personalizacion=pers), Decimal("30.00"))
+
+    def test_regla_de_producto_con_importe_fijo(self):
+        ReglaPrecio.objects.create(
+            producto=self.camiseta, concepto="texto", recargo="nombre", importe=Decimal("0.50")
+        )
+        self.assertEqual(
+            self.camiseta.calcular_precio(personalizacion={"texto": "Hola", "preview_url": "/x.png"}),
+            Decimal("10.50"),
+        )
+
+    def test_tabla_compilada_sin_consultas(self):
+        self.camiseta.calcular_precio()
+        producto = Producto.objects.get(pk=self.camiseta.pk)
+        with self.assertNumQueries(0):
+            producto.calcular_precio(personalizacion={"texto": "Hola"})
+
+    def test_version_no_se_mira_en_cada_precio(self):
+        self.camiseta.calcular_precio()
+        with patch("productos.precios.cache.get") as leer:
+            for _ in range(5):
+                self.camiseta.calcular_precio(personalizacion={"texto": "Hola"})
+        leer.assert_not_called()
+
+    def test_cambio_de_otro_proceso_se_ve_al_comprobar(self):
+        pers = {"estilo": "roto"}
+        self.assertEqual(self.vaquero.calcular_precio(personalizacion=pers), Decimal("30.00"))
+        # Otro proceso guarda una regla: aquí solo llega la nueva versión
+        with patch("productos.precios.invalidar"):
+            ReglaPrecio.objects.create(
+                categoria=self.vaqueros, concepto="estilo", valores="roto", recargo="color",
+                solo_personalizables=False,
+            )
+        precios._avanzar()
+        self.assertEqual(self.vaquero.calcular_precio(personalizacion=pers), Decimal("30.00"))
+        with self.settings(PRECIOS_REGLAS_COMPROBAR_SEGUNDOS=0):
+            precios._comprobar_en = 0
+            self.assertEqual(self.vaquero.calcular_precio(personalizacion=pers), Decimal("34.00"))
+
+    def test_subcategoria_hereda_las_reglas(self):
+        ReglaPrecio.objects.create(
+            categoria=self.vaqueros, concepto="estilo", valores="roto", recargo="color",
+            solo_personalizables=False,
+        )
+        rectos = Categoria.objects.create(nombre="Vaqueros rectos", padre=self.vaqueros)
+        recto = Producto.objects.create(
+            nombre="Recto", precio=Decimal("20.00"), categoria=rectos,
+            precio_personalizacion_color=Decimal("3.00"),
+        )
+        self.assertEqual(recto.calcular_precio(personalizacion={"estilo": "roto"}), Decimal("23.00"))
+
+    def test_ambito_unico(self):
+        regla = ReglaPrecio(categoria=self.camisetas, tipo="pantalon", concepto="texto", recargo="nombre")
+        with self.assertRaises(ValidationError):
+            regla.full_clean()
+
+
+# ----------------------------------------------------------------------
+#  Importación masiva
+# ----------------------------------------------------------------------
+
+class ImportCatalogoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir, ignore_errors=True)
+        self.ropa = Categoria.objects.create(nombre="Ropa")
+
+    def _fichero(self, nombre, contenido):
+        ruta = f"{self.tmpdir}/{nombre}"
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(contenido)
+        return ruta
+
+    def _importar(self, ruta, *args):
+        from io import StringIO
+        from django.core.management import call_command
+
+        salida, errores = StringIO(), StringIO()
+        call_command("import_catalogo", ruta, *args, stdout=salida, stderr=errores)
+        return salida.getvalue(), errores.getvalue()
+
+    def test_csv_con_variantes(self):
+        ruta = self._fichero("catalogo.csv", (
+            "nombre,precio,categoria,marca,talla,color,stock_variante,extra_precio\n"
+            "Camiseta lisa,10,Ropa,Básicos,M,Rojo,3,0\n"
+            "Camiseta lisa,10,Ropa,Básicos,XL,Rojo,0,2\n"
+            "Gorra plana,8.5,Accesorios,Básicos,,,,\n"
+        ))
+        salida, _ = self._importar(ruta, "--lote", "1")
+        self.assertIn("2 productos nuevos", salida)
+
+        camiseta = Producto.objects.get(slug="camiseta-lisa")
+        self.assertEqual(camiseta.categoria, self.ropa)
+        self.assertEqual(camiseta.marca.nombre, "Básicos")
+        self.assertEqual(camiseta.variantes.count(), 2)
+        self.assertEqual(camiseta.stock_variantes, 3)
+        self.assertEqual(camiseta.resumen_variantes["tallas"], ["M"])
+        self.assertTrue(Popularidad.objects.filter(producto=camiseta).exists())
+
+        gorra = Producto.objects.get(slug="gorra-plana")
+        self.assertEqual(gorra.precio, Decimal("8.50"))
+        # la categoría nueva entra en la tabla de cierre
+        self.assertTrue(CategoriaCierre.objects.filter(descendiente=gorra.categoria).exists())
+        if busqueda.disponible():
+            self.assertEqual(busqueda.buscar_ids("gorra"), [gorra.pk])
+
+    def test_jsonl_actualiza_por_slug(self):
+        existente = Producto.objects.create(
+            nombre="Sudadera", precio=Decimal("20.00"), categoria=self.ropa, descripcion="Antigua",
+        )
+        Variante.objects.create(producto=existente, talla="M", color="Gris", stock=1)
+        ruta = self._fichero("catalogo.jsonl", "\n".join([
+            '{"slug": "sudadera", "precio": "25.00", '
+            '"variantes": [{"talla": "M", "color": "Gris", "stock": 9}]}',
+            "no es json",
+            '{"nombre": "Sin precio", "categoria": "Ropa"}',
+            "",
+        ]))
+        salida, errores = self._importar(ruta)
+        self.assertIn("1 actualizados", salida)
+        self.assertIn("fila 2", errores)
+        self.assertIn("fila 3", errores)
+
+        existente.refresh_from_db()
+        self.assertEqual(existente.precio, Decimal("25.00"))
+        self.assertEqual(existente.descripcion, "Antigua")
+        self.assertEqual(existente.variantes.get().stock, 9)
+        self.assertEqual(existente.stock_variantes, 9)
+        self.assertFalse(Producto.objects.filter(slug="sin-precio").exists())
+
+    def test_categoria_existente_con_otro_slug(self):
+        camisetas = Categoria.objects.create(nombre="Camisetas", slug="camis")
+        marca = Marca.objects.create(nombre="Retro", slug="retro-co")
+        ruta = self._fichero("catalogo.jsonl", "\n".join([
+            '{"nombre": "Camiseta A", "precio": "10", "categoria": "Camisetas", "marca": "retro"}',
+            '{"nombre": "Camiseta B", "precio": "10", "categoria": "camis"}',
+        ]))
+        salida, _ = self._importar(ruta)
+        self.assertIn("2 productos nuevos", salida)
+        self.assertEqual(
+            list(Producto.objects.order_by("nombre").values_list("categoria_id", "marca_id")),
+            [(camisetas.pk, marca.pk), (camisetas.pk, None)],
+        )
+        self.assertEqual(Categoria.objects.filter(nombre__iexact="camisetas").count(), 1)
+
+    def test_filas_que_no_caben_en_la_bd_no_deshacen_el_lote(self):
+        malas = [
+            '{"nombre": "Stock negativo", "precio": "5", "categoria": "Ropa", "stock": -1}',
+            '{"nombre": "Variante negativa", "precio": "5", "categoria": "Ropa", '
+            '"variantes": [{"talla": "M", "stock": -1}]}',
+            '{"nombre": "Precio nan", "precio": "NaN", "categoria": "Ropa"}',
+            '{"nombre": "Precio enorme", "precio": "1e20", "categoria": "Ropa"}',
+            '{"nombre": "Tres decimales", "precio": "1.005", "categoria": "Ropa"}',
+            '{"nombre": "Variantes texto", "precio": "5", "categoria": "Ropa", "variantes": "abc"}',
+            '{"nombre": "Variantes sueltas", "precio": "5", "categoria": "Ropa", "variantes": ["M"]}',
+            # Más largos que sus columnas (PostgreSQL daría DataError)
+            '{"nombre": "%s", "precio": "5", "categoria": "Ropa"}' % ("N" * 161),
+            '{"slug": "%s", "nombre": "Slug largo", "precio": "5", "categoria": "Ropa"}' % ("s" * 181),
+            '{"nombre": "Talla larga", "precio": "5", "categoria": "Ropa", '
+            '"variantes": [{"talla": "%s"}]}' % ("T" * 11),
+            '{"nombre": "Color largo", "precio": "5", "categoria": "Ropa", '
+            '"variantes": [{"color": "%s"}]}' % ("C" * 31),
+            '{"nombre": "Categoria larga", "precio": "5", "categoria": "%s"}' % ("c" * 121),
+            '{"nombre": "Marca larga", "precio": "5", "categoria": "Ropa", "marca": "%s"}' % ("m" * 121),
+        ]
+        ruta = self._fichero("catalogo.jsonl", "\n".join(
+            ['{"nombre": "Buena", "precio": "9.99", "categoria": "Ropa"}'] + malas
+        ))
+        salida, errores = self._importar(ruta)
+
+        self.assertIn("1 productos nuevos", salida)
+        for fila in range(2, len(malas) + 2):
+            self.assertIn(f"fila {fila}", errores)
+        self.assertEqual(list(Producto.objects.values_list("slug", flat=True)), ["buena"])
+
+    def test_errores_guardados_con_tope(self):
+        from productos import importacion
+
+        filas = ((n, {"nombre": f"Mala {n}", "precio": "x"}) for n in range(1, 31))
+        with patch("productos.importacion.MAX_ERRORES", 10):
+            stats = importacion.Importador().importar(filas)
+        self.assertEqual(len(stats["errores"]), 10)
+        self.assertEqual(stats["errores"][0][0], 1)
+        self.assertEqual(stats["total_errores"], 30)
+
+    def test_consultas_por_lote_no_por_fila(self):
+        def contar(n):
+            ruta = self._fichero(f"c{n}.csv", "nombre,precio,categoria\n" + "".join(
+                f"Producto {n}-{i},{i + 1},Ropa\n" for i in range(n)
+            ))
+            with CaptureQueriesContext(connection) as consultas:
+                self._importar(ruta, "--lote", "500")
+            return len(consultas)
+
+        contar(1)  # consultas de arranque que se hacen una vez por proceso
+        # 40 filas: SQLite parte los INSERT en 999 parámetros (unas 49 filas de Producto)
+        self.assertEqual(contar(5), contar(40))
+
+
+class FixSlugsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Categoria.objects.create(nombre="Ropa")
+        self.productos = [
+            Producto.objects.create(nombre=f"P{i}", precio=Decimal("1.00"), categoria=self.cat)
+            for i in range(4)
+        ]
+        # Slugs sucios que save() habría normalizado
+        sucios = ["Camión Rojo", "camion-rojo", "", "camion-rojo-2"]
+        for p, slug in zip(self.productos, sucios):
+            Producto.objects.filter(pk=p.pk).update(slug=slug)
+        Categoria.objects.filter(pk=self.cat.pk).update(slug="Ropa Útil")
+
+    def _fix(self, *args):
+        from io import StringIO
+        from django.core.management import call_command
+
+        salida = StringIO()
+        call_command("fix_slugs", *args, stdout=salida)
+        return salida.getvalue()
+
+    def _slugs(self):
+        return [Producto.objects.get(pk=p.pk).slug for p in self.productos]
+
+    def test_dry_run_no_guarda(self):
+        salida = self._fix("--dry-run")
+        self.assertIn("'Camión Rojo' -> 'camion-rojo-3'", salida)
+        self.assertEqual(self._slugs()[0], "Camión Rojo")
+
+    def test_normaliza_sin_colisiones(self):
+        self._fix()
+        slugs = self._slugs()
+        self.assertEqual(slugs, ["camion-rojo-3", "camion-rojo", "p2", "camion-rojo-2"])
+        self.assertEqual(Categoria.objects.get(pk=self.cat.pk).slug, "ropa-util")
+
+    def test_consultas_no_dependen_del_numero_de_filas(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self._fix("--modelos", "producto", "--dry-run")
+        self.assertLessEqual(len(consultas), 4)
+
+
+# ----------------------------------------------------------------------
+#  Sitemap y feed
+# ----------------------------------------------------------------------
+
+class SitemapFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        ajustes = override_settings(MEDIA_ROOT=self.media, SITIO_URL="")
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        cat = Categoria.objects.create(nombre="Ropa")
+        marca = Marca.objects.create(nombre="Retro & Co")
+        self.activos = [
+            Producto.objects.create(
+                nombre=f"Camiseta {i}", precio=Decimal("12.50"), categoria=cat, marca=marca,
+                stock=i,
+            )
+            for i in range(5)
+        ]
+        Producto.objects.create(nombre="Oculto", precio=Decimal("1.00"), categoria=cat, activo=False)
+
+    def _contenido(self, nombre, **kwargs):
+        resp = self.client.get(reverse(nombre, kwargs=kwargs or None))
+        self.assertEqual(resp.status_code, 200)
+        return b"".join(resp.streaming_content).decode("utf-8")
+
+    def test_indice_y_partes(self):
+        with patch("productos.sitemap.URLS_POR_FICHERO", 2):
+            indice = self._contenido("productos:sitemap")
+            self.assertEqual(indice.count("<sitemap>"), 3)
+            self.assertIn("http://testserver/sitemap-3.xml", indice)
+            parte = self._contenido("productos:sitemap_parte", n=1)
+        self.assertIn(f"http://testserver{self.activos[0].get_absolute_url()}", parte)
+        self.assertNotIn("oculto", parte)
+        self.assertEqual(self.client.get("/sitemap-9.xml").status_code, 404)
+
+    def test_feed(self):
+        feed = self._contenido("productos:feed_productos")
+        self.assertEqual(feed.count("<item>"), 5)
+        self.assertIn("<g:price>12.50 EUR</g:price>", feed)
+        self.assertIn("<g:availability>out_of_stock</g:availability>", feed)
+        self.assertIn("<g:brand>Retro &amp; Co</g:brand>", feed)
+
+    @patch("productos.renders.cache_compartida", return_value=True)
+    def test_se_reutiliza_hasta_que_cambia_el_catalogo(self, _):
+        self._contenido("productos:sitemap")
+        with CaptureQueriesContext(connection) as consultas:
+            self._contenido("productos:feed_productos")
+        self.assertEqual(len(consultas), 0)
+
+        p = self.activos[0]
+        p.nombre = "Camiseta renombrada"
+        p.save()
+        lanzadas = []
+        with patch("productos.sitemap._lanzar", side_effect=lanzadas.append):
+            # Mientras se genera la nueva versión se sirve la anterior, y
+            # las peticiones que llegan a la vez no lanzan otra generación
+            self.assertNotIn("Camiseta renombrada", self._contenido("productos:feed_productos"))
+            self._contenido("productos:sitemap")
+        self.assertEqual(len(lanzadas), 1)
+        lanzadas[0]()
+        self.assertIn("Camiseta renombrada", self._contenido("productos:feed_productos"))
+        # solo queda la carpeta de la versión actual
+        self.assertEqual(len(os.listdir(sitemap.directorio())), 1)
+
+    def test_con_cache_local_la_version_sale_de_la_base_de_datos(self):
+        # LocMemCache: catalogo.version() sería distinta en cada proceso
+        antes = sitemap.version()
+        cache.clear()
+        self.assertEqual(sitemap.version(), antes)
+        vieja = sitemap.generar("http://testserver")
+
+        p = self.activos[3]
+        p.stock = 2
+        p.save(update_fields=["stock"])
+        self.assertNotEqual(sitemap.version(), antes)
+        # Una carpeta de una versión posterior (otro proceso) no se borra
+        futura = sitemap._carpeta(sitemap.version() * 10, "http://testserver")
+        os.makedirs(futura)
+        nueva = sitemap.generar("http://testserver")
+        self.assertNotEqual(nueva, vieja)
+        self.assertFalse(os.path.exists(vieja))
+        self.assertTrue(os.path.exists(futura))
+
+    def test_primera_generacion_una_sola_vez(self):
+        cache.add(f"sitemap:generando:{sitemap._clave('http://testserver')}", 1)
+        resp = self.client.get(reverse("productos:sitemap"))
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp["Retry-After"], "60")
+
+    def test_vender_sin_agotar_no_cambia_la_version(self):
+        antes = catalogo.version()
+        p = self.activos[3]
+        p.stock = 2
+        p.save(update_fields=["stock"])
+        self.assertEqual(catalogo.version(), antes)
+        # agotarse sí cambia el feed
+        p.stock = 0
+        p.save(update_fields=["stock"])
+        self.assertNotEqual(catalogo.version(), antes)
+
+    def test_variantes_sin_agotar_no_cambian_la_version(self):
+        p = self.activos[1]
+        variante = Variante.objects.create(producto=p, talla="M", stock=3)
+        antes = catalogo.version()
+        variante.stock = 2
+        variante.save(update_fields=["stock"])
+        self.assertEqual(catalogo.version(), antes)
+        variante.stock = 0
+        variante.save(update_fields=["stock"])
+        self.assertNotEqual(catalogo.version(), antes)
+
+
+class FiltroTallaColorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cat = Categoria.objects.create(nombre="Ropa")
+        self.marca = Marca.objects.create(nombre="Retro")
+
+        def producto(nombre, variantes, **extra):
+            p = Producto.objects.create(nombre=nombre, precio=Decimal("10.00"), categoria=self.cat, **extra)
+            for talla, color, stock in variantes:
+                Variante.objects.create(producto=p, talla=talla, color=color, stock=stock)
+            return p
+
+        self.negra_m = producto("Negra M", [("M", "Negro", 2), ("L", "Negro", 1), ("M", "Blanco", 3)])
+        self.negra_agotada = producto("Negra agotada", [("M", "Negro", 0), ("S", "Blanco", 4)])
+        self.blanca_l = producto("Blanca L", [("L", "Blanco", 1)], marca=self.marca)
+
+    def _nombres(self, url):
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return sorted(p.nombre for p in resp.context["productos"])
+
+    def test_filtra_por_variante_con_stock(self):
+        base = reverse("productos:catalogo")
+        self.assertEqual(self._nombres(f"{base}?talla=M&color=Negro"), ["Negra M"])
+        # la misma variante debe cumplir los dos filtros
+        self.assertEqual(self._nombres(f"{base}?talla=S&color=Negro"), [])
+        self.assertEqual(self._nombres(f"{base}?talla=M&talla=L"), ["Blanca L", "Negra M"])
+        self.assertEqual(self._nombres(f"{base}?color=Blanco&marca={self.marca.slug}"), ["Blanca L"])
+
+    def test_sin_filas_repetidas_ni_distinct(self):
+        filtros = {"talla": ["M", "L"], "color": ["Negro", "Blanco"]}
+        qs = listado.filtrar_variantes(Producto.objects.filter(activo=True), filtros)
+        self.assertEqual(qs.count(), 2)
+        sql = str(qs.query).upper()
+        self.assertIn("EXISTS", sql)
+        self.assertNotIn("DISTINCT", sql)
+        self.assertNotIn("JOIN", sql)
+        if connection.vendor == "sqlite":
+            plan = qs.order_by(*paginacion.ORDEN_NOVEDAD)[:25].explain()
+            self.assertIn("prod_cat_novedad_idx", plan)
+            self.assertIn("SEARCH U0 USING INDEX", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_opciones_y_api(self):
+        resp = self.client.get(reverse("productos:catalogo"))
+        self.assertEqual(resp.context["opciones_variantes"], {
+            "tallas": ["S", "M", "L"], "colores": ["Blanco", "Negro"],
+        })
+        resp = self.client.get(reverse("productos:api_productos") + "?talla=L&color=Blanco&fields=nombre")
+        self.assertEqual(resp.json()["resultados"], [{"nombre": "Blanca L"}])
+
+
+class FiltroPrecioTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ropa = Categoria.objects.create(nombre="Ropa")
+        self.camisetas = Categoria.objects.create(nombre="Camisetas", padre=self.ropa)
+        self.gorras = Categoria.objects.create(nombre="Gorras")
+        self.marca = Marca.objects.create(nombre="Retro")
+
+        def producto(nombre, precio, categoria, **extra):
+            return Producto.objects.create(
+                nombre=nombre, precio=Decimal(precio), categoria=categoria, **extra
+            )
+
+        self.barata = producto("Barata", "8.00", self.camisetas)
+        self.media = producto("Media", "25.00", self.camisetas, marca=self.marca)
+        self.cara = producto("Cara", "250.00", self.gorras)
+
+    def _totales(self, **filtros):
+        return {t["desde"]: t["total"] for t in histograma.histograma(filtros) if t["total"]}
+
+    def test_filtro_por_rango(self):
+        resp = self.client.get(reverse("productos:catalogo") + "?precio_min=10&precio_max=30")
+        self.assertEqual([p.nombre for p in resp.context["productos"]], ["Media"])
+        resp = self.client.get(reverse("productos:catalogo") + "?precio_min=abc&precio_max=9,5")
+        self.assertEqual([p.nombre for p in resp.context["productos"]], ["Barata"])
+
+    def test_histograma_por_categoria_y_marca(self):
+        self.assertEqual(self._totales(), {Decimal(0): 1, Decimal(20): 1, Decimal(200): 1})
+        # la categoría incluye sus subcategorías
+        self.assertEqual(self._totales(categoria=self.ropa.slug), {Decimal(0): 1, Decimal(20): 1})
+        self.assertEqual(self._totales(marca=self.marca.slug), {Decimal(20): 1})
+
+    def test_se_mantiene_al_cambiar_precios(self):
+        self.barata.precio = Decimal("45.00")
+        self.barata.save()
+        self.cara.activo = False
+        self.cara.save()
+        self.media.delete()
+        self.assertEqual(self._totales(), {Decimal(40): 1})
+        histograma.reconstruir()
+        self.assertEqual(self._totales(), {Decimal(40): 1})
+
+    def test_una_sola_fila_sin_marca_por_tramo(self):
+        fila = HistogramaPrecio.objects.get(categoria=self.gorras, marca=None)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            HistogramaPrecio.objects.create(categoria=self.gorras, marca=None, tramo=fila.tramo)
+
+    def test_sumar_con_la_fila_creada_a_la_vez(self):
+        # Otro proceso crea la fila entre el UPDATE (0 filas) y el INSERT
+        clave = (self.gorras.pk, None, histograma.tramo(Decimal("1.00")))
+        actualizar = QuerySet.update
+        llamadas = []
+
+        def update(qs, **kwargs):
+            llamadas.append(kwargs)
+            if len(llamadas) == 1:
+                HistogramaPrecio.objects.create(categoria=self.gorras, marca=None, tramo=clave[2], productos=1)
+                return 0
+            return actualizar(qs, **kwargs)
+
+        with patch.object(QuerySet, "update", autospec=True, side_effect=update):
+            histograma.mover(None, clave)
+        filas = HistogramaPrecio.objects.filter(categoria=self.gorras, tramo=clave[2])
+        self.assertEqual(list(filas.values_list("productos", flat=True)), [2])
+
+    def test_pintar_no_agrega_productos(self):
+        with CaptureQueriesContext(connection) as consultas:
+            histograma.histograma({"categoria": self.ropa.slug})
+        self.assertFalse(any('"productos_producto"' in q["sql"] for q in consultas))
+
+    def test_rango_usa_indice_de_precio(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("los planes comprobados son los de SQLite")
+        filtros = {"precio_min": "10", "precio_max": "30"}
+        qs = listado.filtrar_atributos(Producto.objects.filter(activo=True), filtros)
+        plan = qs.order_by(*paginacion.ORDENES["precio"])[:25].explain()
+        self.assertIn("prod_cat_precio_idx (precio>? AND precio<?)", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+
+# ----------------------------------------------------------------------
+#  Caché de búsquedas
+# ----------------------------------------------------------------------
+
+class CacheBusquedaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        cache_busqueda.vaciar()
+        self.addCleanup(cache_busqueda.vaciar)
+        self.cat = Categoria.objects.create(nombre="Ropa")
+        for nombre in ("Camión rojo", "Camión azul", "Gorra"):
+            Producto.objects.create(nombre=nombre, precio=Decimal("10.00"), categoria=self.cat)
+
+    def _buscar(self, q, **extra):
+        params = {"q": q, **extra}
+        resp = self.client.get(reverse("productos:catalogo"), params)
+        return sorted(p.nombre for p in resp.context["productos"])
+
+    def test_acierto_con_la_busqueda_normalizada(self):
+        if not busqueda.disponible():
+            self.skipTest("sin índice de texto")
+        self.assertEqual(self._buscar("camión"), ["Camión azul", "Camión rojo"])
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self._buscar("  CAMION "), ["Camión azul", "Camión rojo"])
+        sql = [q["sql"] for q in consultas]
+        self.assertFalse(any(busqueda.FTS_TABLA in s for s in sql))
+        # la página sale por clave primaria
+        self.assertTrue(any('"productos_producto"."id" IN' in s for s in sql))
+        self.assertGreaterEqual(cache_busqueda.estadisticas()["aciertos"], 2)
+
+    def test_filtros_en_la_clave(self):
+        if not busqueda.disponible():
+            self.skipTest("sin índice de texto")
+        self.assertEqual(self._buscar("camion"), ["Camión azul", "Camión rojo"])
+        self.assertEqual(self._buscar("camion", precio_min="11"), [])
+
+    def test_cambio_de_catalogo_invalida(self):
+        if not busqueda.disponible():
+            self.skipTest("sin índice de texto")
+        self.assertEqual(self._buscar("gorra"), ["Gorra"])
+        Producto.objects.create(nombre="Gorra plana", precio=Decimal("5.00"), categoria=self.cat)
+        self.assertEqual(self._buscar("gorra"), ["Gorra", "Gorra plana"])
+
+    def test_una_venta_no_vacia_el_indice_cacheado(self):
+        if not busqueda.disponible():
+            self.skipTest("sin índice de texto")
+        gorra = Producto.objects.get(nombre="Gorra")
+        gorra.stock = 1
+        gorra.save(update_fields=["stock"])
+        self.assertEqual(self._buscar("gorra"), ["Gorra"])
+        antes = catalogo.version()
+        # Se vende la última: cambia el catálogo, pero no el índice de texto
+        gorra.stock = 0
+        gorra.save(update_fields=["stock"])
+        self.assertNotEqual(catalogo.version(), antes)
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(self._buscar("gorra"), ["Gorra"])
+        self.assertFalse(any(busqueda.FTS_TABLA in q["sql"] for q in consultas))
+
+    def test_al_indice_llega_la_busqueda_original(self):
+        calcular = Mock(return_value=[1])
+        cache_busqueda.ids_texto("Camión", calcular)
+        calcular.assert_called_once_with("Camión")
+        with patch("productos.cache_busqueda.connection") as conexion:
+            conexion.vendor = "postgresql"
+            # 'spanish' no quita tildes: no comparten entrada
+            self.assertNotEqual(cache_busqueda.normalizar_q("Camión"), cache_busqueda.normalizar_q("camion"))
+            self.assertEqual(cache_busqueda.normalizar_q("  CAMIÓN "), "camión")
+
+    def test_lru_y_ttl(self):
+        lru = cache_busqueda.CacheBusquedas(limite=2)
+        lru.guardar("a", 1, (1,))
+        lru.guardar("b", 1, (2,))
+        lru.obtener("a", 1)
+        lru.guardar("c", 1, (3,))  # fuera "b", el menos usado
+        self.assertEqual(lru.obtener("a", 1), (1,))
+        self.assertIsNone(lru.obtener("b", 1))
+        self.assertIsNone(lru.obtener("c", 2))  # otra versión del catálogo
+        with override_settings(BUSQUEDA_CACHE_TTL=0):
+            lru.guardar("d", 1, (4,))
+        self.assertIsNone(lru.obtener("d", 1))
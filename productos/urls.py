@@ -1,14 +1,26 @@
 from django.urls import path
 from django.views.generic import RedirectView
-from . import views
+from . import api, views
 
 app_name = "productos"
 
 urlpatterns = [
     path("", views.lista_productos, name="catalogo"),
+    path("sugerencias/", views.sugerir, name="sugerencias"),
     path("c/<slug:slug>/", views.lista_por_categoria, name="catalogo_por_categoria"),
     path("p/<slug:slug>/", views.detalle_producto, name="producto_detalle"),
     path("p/<slug:slug>/preview/", views.preview_personalizacion, name="producto_preview"),
+    path(
+        "preview/<str:job_id>/", views.preview_estado, name="producto_preview_estado"
+    ),
+    # API JSON de solo lectura
+    path("api/v1/productos/", api.productos, name="api_productos"),
+    path("api/v1/productos/<slug:slug>/", api.producto, name="api_producto"),
+    path("api/v1/precios/", api.precios, name="api_precios"),
+    # Buscadores y Google Shopping (ficheros cacheados por versión del catálogo)
+    path("sitemap.xml", views.sitemap_indice, name="sitemap"),
+    path("sitemap-<int:n>.xml", views.sitemap_parte, name="sitemap_parte"),
+    path("feed/productos.xml", views.feed_productos, name="feed_productos"),
     path(
         "producto/<slug:slug>/",
         RedirectView.as_view(pattern_name="productos:producto_detalle", permanent=True),
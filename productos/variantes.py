@@ -0,0 +1,61 @@
+"""
+Matriz talla × color de un producto, precalculada y cacheada.
+
+La clave lleva ``Producto.actualizado``, que avanza con cualquier cambio del
+producto o de sus variantes (ver stock.py), así que una ficha caliente se
+pinta sin tocar la tabla Variante y nunca hace falta invalidar a mano.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+PREFIJO_CACHE = "producto:matriz"
+
+
+def ttl() -> int:
+    return int(getattr(settings, "PRODUCTO_MATRIZ_TTL", 60 * 60 * 24))
+
+
+def clave(producto) -> str:
+    version = producto.actualizado.timestamp() if producto.actualizado else 0
+    return f"{PREFIJO_CACHE}:{producto.pk}:{version}"
+
+
+def construir(producto) -> dict:
+    """
+    Una consulta a Variante. Los precios salen de Producto.calcular_precio sin
+    personalización (necesita `categoria` ya cargada para no hacer otra).
+    """
+    variantes = []
+    por_celda = {}
+    for v in producto.variantes.order_by("talla", "color"):
+        fila = {
+            "id": v.id,
+            "talla": v.talla,
+            "color": v.color,
+            "stock": v.stock,
+            "precio": producto.calcular_precio(variante=v),
+        }
+        variantes.append(fila)
+        por_celda[(v.talla, v.color)] = fila
+
+    tallas = sorted({v["talla"] for v in variantes if v["talla"]})
+    colores = sorted({v["color"] for v in variantes if v["color"]})
+    return {
+        "tallas": tallas,
+        "colores": colores,
+        "variantes": variantes,
+        # filas de la tabla: una por talla, una celda (o None) por color
+        "filas": [
+            {"talla": t, "celdas": [por_celda.get((t, c)) for c in colores]}
+            for t in tallas
+        ],
+    }
+
+
+def matriz(producto) -> dict:
+    k = clave(producto)
+    datos = cache.get(k)
+    if datos is None:
+        datos = construir(producto)
+        cache.set(k, datos, ttl())
+    return datos
@@ -1,68 +1,142 @@
+import hashlib
+import os
+from decimal import Decimal
 from io import BytesIO
-from uuid import uuid4
 from PIL import Image, ImageDraw, ImageFont
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
-from django.http import JsonResponse, HttpResponseBadRequest
-from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, HttpResponseBadRequest
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
 
-from .models import Producto, Categoria, Marca, Variante
-from .forms import VarianteForm, PersonalizacionForm
+from .models import Producto, Categoria, Marca
+from .forms import PersonalizacionForm
+from . import (
+    arbol, bases, facetas, histograma, imagenes, listado, paginacion, popularidad, recomendaciones,
+    renders, sitemap, subidas, sugerencias, tarjetas, variantes,
+)
+
+def _pagina_catalogo(request, productos, filtros, ids_relevancia=None):
+    pagina = listado.paginar(request, productos, filtros, ids_relevancia)
+    pagina["tarjetas"] = tarjetas.renderizar(pagina["items"])
+    pagina["siguiente_url"] = paginacion.url_pagina(request, pagina["siguiente"])
+    pagina["anterior_url"] = paginacion.url_pagina(request, pagina["anterior"])
+    return pagina
+
+
+# Opciones del desplegable de orden (valor de ?orden=, etiqueta)
+ORDENES_CATALOGO = [
+    ("novedad", "Novedades"),
+    ("precio", "Precio: de menor a mayor"),
+    ("-precio", "Precio: de mayor a menor"),
+    ("nombre", "Nombre"),
+    ("vendidos", "Más vendidos"),
+]
+
+def _histograma(request, filtros):
+    """Tramos del histograma de precio con su altura relativa y su enlace."""
+    tramos = histograma.histograma(filtros)
+    maximo = max((t["total"] for t in tramos), default=0) or 1
+    for t in tramos:
+        params = request.GET.copy()
+        params.pop("cursor", None)
+        params["precio_min"] = str(t["desde"])
+        if t["hasta"] is None:
+            params.pop("precio_max", None)
+        else:
+            # los límites son inclusivos: el tramo acaba un céntimo antes
+            params["precio_max"] = str(t["hasta"] - Decimal("0.01"))
+        t["altura"] = round(100 * t["total"] / maximo)
+        t["url"] = f"{request.path}?{params.urlencode()}"
+    return tramos
 
 def lista_productos(request):
-    q = request.GET.get("q", "").strip()
-    categoria_slug = request.GET.get("categoria", "").strip()
-    marca_slug = request.GET.get("marca", "").strip()
+    filtros = listado.leer_filtros(request)
+    q, categoria_slug, marca_slug = filtros["q"], filtros["categoria"], filtros["marca"]
+
+    buscados, ids_relevancia = listado.buscar(q)
+    buscados = listado.filtrar_atributos(buscados, filtros)
+    # Los recuentos de los filtros se calculan antes de aplicar categoría/marca
+    recuentos = facetas.facetas(buscados, filtros)
+    productos = listado.filtrar(buscados, filtros)
 
-    productos = Producto.objects.filter(activo=True)
+    pagina = _pagina_catalogo(request, productos, filtros, ids_relevancia)
 
-    if q:
-        productos = productos.filter(Q(nombre__icontains=q) | Q(descripcion__icontains=q))
-    if categoria_slug:
-        productos = productos.filter(categoria__slug=categoria_slug)
-    if marca_slug:
-        productos = productos.filter(marca__slug=marca_slug)
+    # Estantería de "más vendidos" solo en la portada del catálogo
+    mas_vendidos = []
+    if not any(filtros.values()) and not request.GET.get("cursor"):
+        mas_vendidos = tarjetas.renderizar(popularidad.mas_vendidos(limite=4))
 
     ctx = {
         "q": q,
         "categoria_sel": categoria_slug,
         "marca_sel": marca_slug,
+        "ordenes": ORDENES_CATALOGO,
         "categorias": Categoria.objects.order_by("nombre"),
         "marcas": Marca.objects.order_by("nombre"),
-        "productos": productos.select_related("categoria", "marca"),
+        "facetas": recuentos,
+        "opciones_variantes": facetas.opciones_variantes(),
+        "tallas_sel": filtros["talla"],
+        "colores_sel": filtros["color"],
+        "precio_min": filtros["precio_min"],
+        "precio_max": filtros["precio_max"],
+        "histograma": _histograma(request, filtros),
+        "productos": pagina["items"],
+        "tarjetas": pagina["tarjetas"],
+        "pagina": pagina,
+        "mas_vendidos": mas_vendidos,
     }
     return render(request, "productos/lista.html", ctx)
 
 def lista_por_categoria(request, slug):
     categoria = get_object_or_404(Categoria, slug=slug)
-    productos = categoria.productos.filter(activo=True)
+    # Productos de la categoría y de todo su subárbol
+    filtros = {
+        "categoria": categoria.slug,
+        "talla": listado.lista_param(request, "talla"),
+        "color": listado.lista_param(request, "color"),
+        "precio_min": listado.precio_param(request, "precio_min"),
+        "precio_max": listado.precio_param(request, "precio_max"),
+    }
+    activos = listado.filtrar_atributos(Producto.objects.filter(activo=True), filtros)
+    productos = listado.en_subarbol(activos, arbol.subarbol_ids(categoria.pk))
     categorias = Categoria.objects.all().order_by("nombre")
+    recuentos = facetas.facetas(activos, filtros)
+    pagina = _pagina_catalogo(request, productos, filtros)
     return render(request, "productos/lista.html",
-                  {"productos": productos, "categorias": categorias, "categoria": categoria})
+                  {"productos": pagina["items"], "tarjetas": pagina["tarjetas"], "pagina": pagina,
+                   "categorias": categorias, "categoria": categoria,
+                   "categoria_sel": categoria.slug, "facetas": recuentos,
+                   "opciones_variantes": facetas.opciones_variantes(),
+                   "tallas_sel": filtros["talla"], "colores_sel": filtros["color"],
+                   "precio_min": filtros["precio_min"], "precio_max": filtros["precio_max"],
+                   "histograma": _histograma(request, filtros),
+                   "ordenes": ORDENES_CATALOGO})
 
-def detalle_producto(request, slug):
-    producto = get_object_or_404(Producto, slug=slug, activo=True)
+# Súbela si cambia cómo se dibuja el mockup (posiciones, fuente...): así no
+# se reutilizan los PNG generados con el render anterior.
+MOCKUP_VERSION = 1
 
-    variantes = producto.variantes.all()
-    tallas = variantes.values_list("talla", flat=True).distinct()
-    colores = variantes.values_list("color", flat=True).distinct()
 
-    var_form = VarianteForm(producto=producto)
-    pers_form = PersonalizacionForm()
+def _clave_mockup(base_hash, texto, color, overlay_hash):
+    datos = "\0".join(
+        [str(MOCKUP_VERSION), base_hash, texto or "", (color or "").lower(), overlay_hash or ""]
+    )
+    return hashlib.sha256(datos.encode("utf-8")).hexdigest()
 
-    ctx = {
-        "producto": producto,
-        "variantes": variantes,
-        "tallas": tallas,
-        "colores": colores,
-        "var_form": var_form,
-        "pers_form": pers_form,
-    }
-    return render(request, "productos/detalle.html", ctx)
 
-def _generar_mockup(base_path, texto=None, color="#ffffff", img_overlay_path=None):
-    base = Image.open(base_path).convert("RGBA")
+def _generar_mockup(base_path, texto=None, color="#ffffff", img_overlay_path=None, base_hash=None):
+    """
+    El nombre del PNG sale del contenido (imagen base, texto, color, overlay),
+    así que repetir una vista previa devuelve la URL existente sin tocar Pillow.
+    """
+    overlay_hash = imagenes.hash_ruta(img_overlay_path) if img_overlay_path else ""
+    clave = _clave_mockup(base_hash or imagenes.hash_ruta(base_path), texto, color, overlay_hash)
+    filename = f"personalizados/mockup_{clave}.png"
+    if default_storage.exists(filename):
+        return default_storage.url(filename)
+
+    base = bases.obtener(base_path)
     if img_overlay_path:
         overlay = Image.open(img_overlay_path).convert("RGBA")
         overlay.thumbnail((500, 500))
@@ -80,15 +154,13 @@ def _generar_mockup(base_path, texto=None, color="#ffffff", img_overlay_path=Non
     buf = BytesIO()
     base.save(buf, format="PNG")
     buf.seek(0)
-    filename = f"personalizados/mockup_{uuid4().hex}.png"
     path = default_storage.save(filename, ContentFile(buf.read()))
     return default_storage.url(path)
 
 from django.views.decorators.http import require_POST
 def _save_tmp_upload(fieldfile):
-    tmp_name = f"personalizados/uploads/{uuid4().hex}_{fieldfile.name}"
-    saved = default_storage.save(tmp_name, fieldfile)
-    return default_storage.path(saved)
+    # Deduplicado por contenido: el mismo logo subido varias veces es un fichero
+    return subidas.guardar(fieldfile)
 
 @require_POST
 def preview_personalizacion(request, slug):
@@ -107,23 +179,79 @@ def preview_personalizacion(request, slug):
     if not producto.imagen:
         return HttpResponseBadRequest("Producto sin imagen base")
 
-    img_path = _save_tmp_upload(imagen) if imagen else None
-    preview_url = _generar_mockup(producto.imagen.path, texto=texto, color=color, img_overlay_path=img_path)
-    return JsonResponse({"preview_url": preview_url})
+    subida = _save_tmp_upload(imagen) if imagen else None
+    img_path = default_storage.path(subida.fichero) if subida else None
+    # El cliente lo guarda en la personalización (meta del carrito) para que
+    # la subida cuente como usada mientras el carrito o el pedido existan
+    ref_subida = {"subida": subida.hash} if subida else {}
+
+    # Modo trabajo: el render va al pool de procesos y respondemos ya con el
+    # id; el navegador consulta producto_preview_estado hasta que esté listo.
+    if request.POST.get("modo") == "job":
+        job_id = renders.encolar(
+            producto.imagen.path, texto=texto, color=color, img_overlay_path=img_path,
+            base_hash=producto.imagen_hash or None,
+        )
+        return JsonResponse(
+            {
+                "job_id": job_id,
+                "estado_url": reverse("productos:producto_preview_estado", args=[job_id]),
+                **ref_subida,
+            },
+            status=202,
+        )
+
+    preview_url = _generar_mockup(
+        producto.imagen.path, texto=texto, color=color, img_overlay_path=img_path,
+        base_hash=producto.imagen_hash or None,
+    )
+    return JsonResponse({"preview_url": preview_url, **ref_subida})
+
+def sugerir(request):
+    """Autocompletado del buscador: sale de memoria, sin consultas."""
+    return JsonResponse({"sugerencias": sugerencias.sugerir(request.GET.get("q", ""))})
+
+def preview_estado(request, job_id):
+    estado = renders.estado(job_id)
+    if estado is None:
+        return JsonResponse({"estado": "desconocido"}, status=404)
+    return JsonResponse(estado)
+
+def _fichero_sitemap(request, nombre):
+    """Sirve un fichero ya generado (el de la versión actual o, mientras se genera, el anterior)."""
+    carpeta = sitemap.servir(sitemap.base_url(request))
+    if carpeta is None:
+        # La primera generación está en marcha en otra petición
+        respuesta = HttpResponse("Generando el sitemap, inténtalo en un momento.", status=503)
+        respuesta["Retry-After"] = "60"
+        return respuesta
+    ruta = os.path.join(carpeta, nombre)
+    if not os.path.exists(ruta):
+        raise Http404
+    return FileResponse(open(ruta, "rb"), content_type="application/xml; charset=utf-8")
+
+def sitemap_indice(request):
+    return _fichero_sitemap(request, sitemap.INDICE)
+
+def sitemap_parte(request, n):
+    return _fichero_sitemap(request, sitemap.PARTE.format(n))
+
+def feed_productos(request):
+    return _fichero_sitemap(request, sitemap.FEED)
 
 def detalle_producto(request, slug):
-    p = get_object_or_404(Producto, slug=slug, activo=True)
-    qs_var = getattr(p, "variantes", None)
-    tallas = colores = variantes = []
-    if qs_var:
-        variantes = list(qs_var.all())
-        tallas   = sorted({v.talla for v in variantes if v.talla})
-        colores  = sorted({v.color for v in variantes if v.color})
+    producto = get_object_or_404(
+        Producto.objects.select_related("categoria", "marca"), slug=slug, activo=True
+    )
+    # Tallas, colores y precios por variante: de caché mientras el producto
+    # no cambie (una consulta a Variante solo en el primer acceso)
+    matriz = variantes.matriz(producto)
 
     return render(request, "productos/detalle.html", {
-        "producto": p,
-        "tallas": tallas,
-        "colores": colores,
-        "variantes": variantes,
+        "producto": producto,
+        "comprados_juntos": tarjetas.renderizar(recomendaciones.comprados_juntos(producto)),
+        "tallas": matriz["tallas"],
+        "colores": matriz["colores"],
+        "variantes": matriz["variantes"],
+        "matriz": matriz["filas"],
     })
-
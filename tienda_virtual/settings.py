@@ -71,6 +71,24 @@ DATABASES = {
     }
 }
 
+# Caché: memoria del proceso en local. En producción conviene una compartida
+# (REDIS_URL) para que todos los workers vean las mismas invalidaciones.
+REDIS_URL = os.environ.get("REDIS_URL", "")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "tienda-virtual",
+        }
+    }
+
 # Autenticación
 LOGIN_URL = "accounts:login"
 LOGIN_REDIRECT_URL = "accounts:after_login"
@@ -114,6 +132,37 @@ DEFAULT_FROM_EMAIL = os.environ.get(
 
 ENVIO_GRATIS_DESDE = Decimal("50.00")
 MONEDA = "€"
+MONEDA_ISO = "EUR"  # código ISO 4217 (feed de productos)
+
+# Catálogo
+# Ids que devuelve como mucho una búsqueda por texto (ordenados por relevancia).
+# Más allá no se pagina: el catálogo y la API avisan de que la lista está cortada.
+BUSQUEDA_MAX_RESULTADOS = 10_000
+BUSQUEDA_CACHE_ENTRADAS = 500  # búsquedas (q + filtros) cacheadas por proceso
+BUSQUEDA_CACHE_TTL = 60 * 5
+CATALOGO_POR_PAGINA = 24
+CATALOGO_FACETAS_TTL = 60  # segundos
+CATALOGO_OPCIONES_TTL = 60 * 10  # tallas/colores de los filtros
+# CATALOGO_TRAMOS_PRECIO: límites inferiores de los tramos del histograma de
+# precios; por defecto histograma.TRAMOS (tras cambiarlos: manage.py
+# reconstruir_histograma_precios)
+CATALOGO_TARJETAS_TTL = 60 * 60 * 24
+SUGERENCIAS_TTL = 60 * 5  # otros procesos reconstruyen el autocompletado tras este tiempo
+# Cada cuánto mira cada proceso si han cambiado las reglas de precio
+PRECIOS_REGLAS_COMPROBAR_SEGUNDOS = 5
+# actualizar_popularidad deja para la siguiente pasada los pedidos más recientes
+POPULARIDAD_MARGEN_SEGUNDOS = 60 * 10
+RECOMENDACIONES_TOP_K = 8  # "comprados juntos" guardados por producto
+RECOMENDACIONES_MAX_PARES = 5_000_000  # pares en memoria antes de fusionar trozos
+# URL pública del sitio para sitemap.xml y el feed (vacía = la del host de la petición)
+SITIO_URL = os.environ.get("SITIO_URL", "")
+
+# Personalización: procesos que renderizan mockups en segundo plano (0 = en
+# línea). Solo con caché compartida: sin REDIS_URL se renderiza en línea.
+MOCKUP_WORKERS = int(os.environ.get("MOCKUP_WORKERS", "2" if REDIS_URL else "0"))
+MOCKUP_JOB_TTL = 60 * 10  # segundos que se guarda el estado de un render
+MOCKUP_BASES_MAX_BYTES = 256 * 1024 * 1024  # imágenes base decodificadas en memoria
+SUBIDAS_TTL_HORAS = 72  # limpiar_subidas borra las subidas sin usar desde entonces
 
 STRIPE_PUBLIC_KEY = os.environ.get("STRIPE_PUBLIC_KEY", "")
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY", "")